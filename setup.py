@@ -1,6 +1,20 @@
 # setup.py
+import os
+import shutil
 from setuptools import setup, Extension
 from setuptools.command.build_ext import build_ext
+from setuptools.command.build_py import build_py
+
+# the OpenCL kernels compile the TFM library from source. ship it as package data
+TFM_KERNEL_SOURCES = ["include/tfm_opencl.h", "src/c/tfm_opencl.c"]
+
+class CustomBuildPy(build_py):
+    def run(self):
+        super().run()
+        package_dir = os.path.join(self.build_lib, "msurf")
+        os.makedirs(package_dir, exist_ok=True)
+        for source in TFM_KERNEL_SOURCES:
+            shutil.copy(source, package_dir)
 
 class CustomBuildExt(build_ext):
     def build_extension(self, ext):
@@ -23,5 +37,5 @@ tfm_extension = Extension(
 
 setup(
     ext_modules=[tfm_extension],
-    cmdclass={"build_ext": CustomBuildExt}
+    cmdclass={"build_ext": CustomBuildExt, "build_py": CustomBuildPy}
 )
@@ -1,15 +1,52 @@
+from copy import copy
+from cpu_backend import CpuBackend, ITER_INTERIOR, in_interior
 from MandelbrotParams import MandelbrotParams
+import fp_numpy
 import numpy as np
-import os
+from perturbation import ReferenceOrbit
+from program_cache import build_program, read_source
 import pyopencl as cl
+from render_cache import RenderCache
 import struct
+from subdivide import MIN_SIZE, subdivide
 
 
 OPENCL_DEBUG = False
 MAX_MAXITER = (2 << 30) / 256 # 2^31 / 256. limited by 32 bit signed ints in opencl
+ITER_DEFERRED = ITER_INTERIOR - 1  # above any maxiter, so the kernels skip the pixel. see mandelbrot_set_subdivided
 
 DEBUG_INFO_SIZE = 52  # bytes
-ITER_STATE_ITEM_SIZE = 68  # int + 2*fp_digit bytes
+# iteration state is a structure-of-arrays: ITER_STATE_PLANES uint32 planes of (height, width)
+# plane 0 is the count, z_real starts at plane 1 and z_imag at plane 4, in each kernel's own format:
+# tfm: dp[0..2], the sign is the top bit of dp[2]. float32: float bits.
+# dblfloat: high, low float bits. fp64: double low, high words. see mandelbrot_common.cl
+ITER_STATE_COUNT = 0
+ITER_STATE_Z_REAL = 1
+ITER_STATE_Z_IMAG = 4
+ITER_STATE_PLANES = 7
+ITER_STATE_ITEM_SIZE = ITER_STATE_PLANES * 4  # bytes per pixel
+ITER_STATE_SIGN_BIT = 0x80000000
+
+# kernels, cheapest first, with the smallest step_size each one is precise enough for:
+# about 14 bits of mantissa left below the pixel size (24 bits float32, ~48 dblfloat, 53 fp64).
+# the last one has no limit. perturb replaces tfm when MandelbrotFuncs.use_perturbation is set
+PRECISION_TIERS = (
+    ('float32', 1e-3),
+    ('dblfloat', 1e-10),
+    ('fp64', 2e-12),
+    ('tfm', 0.0),
+)
+# kernel source files, in order, after mandelbrot_common.cl. see program_cache.read_source
+KERNEL_SOURCES = {
+    'float32': ['mandelbrot_kernel.cl'],
+    'dblfloat': ['mandelbrot_kernel_dblfloat.cl'],
+    'fp64': ['mandelbrot_kernel_fp64.cl'],
+    'tfm': ['tfm_opencl.h', 'tfm_opencl.c', 'mandelbrot_kernel_tfm.cl'],
+    'perturb': ['mandelbrot_kernel_perturb.cl'],
+}
+FP64_KERNELS = ('fp64', 'perturb')  # need cl_khr_fp64
+# inherit_pixels and colorize, shared by all the kernels
+UTILITY_SOURCES = ['mandelbrot_inherit.cl', 'mandelbrot_colorize.cl']
 def parse_debug_info(array_slice):
     # Ensure the input is a numpy array of uint8
     #if not isinstance(array, np.ndarray) or array.dtype != np.uint8:
@@ -25,19 +62,40 @@ def parse_debug_info(array_slice):
 
     return (x, y, c_real, c_imag, i, d1, d2, d3, i1, i2, i3, i4, i5)
 
-def unpack_iter_state(array_slice):
-    byte_data = array_slice.tobytes()
-    if len(byte_data) != ITER_STATE_ITEM_SIZE:
-        raise ValueError(f'Input must be a numpy array slice with bytesize {ITER_STATE_ITEM_SIZE}')
-    iter_count = struct.unpack('i', byte_data[:4])
-    i1, i2, i3, i4, i5, i6, fp_used, fp_sign = struct.unpack('IIIIII ii', byte_data[4:36])
-    z_real = i3 + (i2 / (1<<32)) + (i1 / (1 << 64))
-    if fp_sign:
-        z_real = -z_real
-    i1, i2, i3, i4, i5, i6, fp_used, fp_sign = struct.unpack('IIIIII ii', byte_data[36:68])
-    z_imag = i3 + (i2 / (1<<32)) + (i1 / (1 << 64))
-    if fp_sign:
-        z_imag = -z_imag
+def state_limbs_to_float(dp0, dp1, dp2):
+    '''
+    convert the 3 state limbs of a fixed-point value to float
+    works on scalars and numpy arrays
+    '''
+    sign = (dp2 & ITER_STATE_SIGN_BIT) != 0
+    value = (dp2 & (ITER_STATE_SIGN_BIT - 1)) + (dp1 / (1 << 32)) + (dp0 / (1 << 64))
+    return np.where(sign, -value, value)
+
+def state_planes_to_float(planes, kernel):
+    '''
+    convert the 3 state planes of one value (z_real or z_imag), written by kernel, to float
+    '''
+    planes = np.asarray(planes, dtype=np.uint32)
+    if kernel == 'tfm':
+        return state_limbs_to_float(*planes)
+    if kernel == 'float32':
+        return planes[0].view(np.float32).astype(np.float64)
+    if kernel == 'dblfloat':
+        return planes[0].view(np.float32).astype(np.float64) + planes[1].view(np.float32)
+    # fp64 and perturb (dz for perturb)
+    return ((planes[1].astype(np.uint64) << np.uint64(32)) | planes[0]).view(np.float64)
+
+def unpack_iter_state(state, x, y, kernel='tfm'):
+    '''
+    state is the host copy of the iteration state. shape=(ITER_STATE_PLANES, height, width) dtype=np.uint32
+    returns (iter_count, z_real, z_imag) for pixel x, y
+    '''
+    if state.ndim != 3 or state.shape[0] != ITER_STATE_PLANES:
+        raise ValueError(f'Input must be a numpy array with shape ({ITER_STATE_PLANES}, height, width)')
+    pixel = state[:, y, x]
+    iter_count = int(pixel[ITER_STATE_COUNT].view(np.int32))
+    z_real = float(state_planes_to_float(pixel[ITER_STATE_Z_REAL:ITER_STATE_Z_REAL + 3], kernel))
+    z_imag = float(state_planes_to_float(pixel[ITER_STATE_Z_IMAG:ITER_STATE_Z_IMAG + 3], kernel))
     return (iter_count, z_real, z_imag)
 
 def double_to_fp_int_array(float_value):
@@ -68,6 +126,15 @@ def double_to_fp_int_array(float_value):
         hi &= ~0x8000000000000000
     return (hi, lo)
 
+def double_to_dblfloat(float_value):
+    '''
+    split a double into the (high, low) float32 pair of mandelbrot_kernel_dblfloat.cl
+    high + low is float_value to about 48 bits
+    '''
+    high = np.float32(float_value)
+    low = np.float32(float_value - float(high))
+    return (high, low)
+
 def mandelbrot_set(params: MandelbrotParams, horizon=2.0):
     xmin, xmax, ymin, ymax, xn, yn, maxiter = params.xmin, params.xmax, params.ymin, params.ymax, params.width, params.height, params.maxiter
     print(f'mandelbrot_set({params.get_params()})')
@@ -80,147 +147,715 @@ def mandelbrot_set(params: MandelbrotParams, horizon=2.0):
     mandelbrot = np.zeros(complex.shape, dtype=np.int32)
     # Z is the calculation in the real plane, updated each repetition
     z = np.zeros_like(complex)
+    # points inside the main cardioid or the period-2 bulb never escape. they are left at 0, inside black
+    outside = ~in_interior(complex.real, complex.imag)
     # the point to sample to create the trace array
     for n in range(maxiter):
-        points_in_bounds = np.where(np.abs(z) < horizon)
+        points_in_bounds = np.where((np.abs(z) < horizon) & outside)
         z[points_in_bounds] = z[points_in_bounds]**2 + complex[points_in_bounds]
         mandelbrot[points_in_bounds] = n
     mandelbrot[mandelbrot == maxiter-1] = 0  # inside black
     # mandelbrot[np.abs(z) <= horizon] = maxiter  # inside white
     return mandelbrot
 
+def rect_intersect(a, b):
+    '''
+    rects are (x, y, width, height). returns None if they don't overlap
+    '''
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (x1, y1, x2 - x1, y2 - y1)
+
+def rect_subtract(a, b):
+    '''
+    returns a list of up to 4 rects covering a - b
+    '''
+    overlap = rect_intersect(a, b)
+    if overlap is None:
+        return [a]
+    ax, ay, aw, ah = a
+    ox, oy, ow, oh = overlap
+    rects = [
+        (ax, ay, aw, oy - ay),  # below
+        (ax, oy + oh, aw, ay + ah - oy - oh),  # above
+        (ax, oy, ox - ax, oh),  # left
+        (ox + ow, oy, ax + aw - ox - ow, oh),  # right
+    ]
+    return [r for r in rects if r[2] > 0 and r[3] > 0]
+
 class IterState:
     '''
-    reuse this as long as xmin, ymin, and step_size are the same
+    reuse this as long as xmin, ymin, and step_size are the same, and the same kernel runs
+
+    params is a snapshot of the frame the state was computed for, kernel is the name
+    of the kernel that wrote it (see PRECISION_TIERS).
+    the state itself lives on the device in DeviceBuffers.state_buf
+
+    image_key is the (maxiter, palette) the whole device image was last painted with.
+    exposed is the list of rects (x, y, width, height) that still need painting
+    at image_key, e.g. the strips uncovered by a pan
+
+    complete is the maxiter every pixel has been iterated to. unfinished is the list
+    of rects not yet iterated to pass_maxiter, the pass under way
     '''
     params = None
-    iter_buf = None
-    def __init__(self, params, iter_buf):
-        self.params = params
-        self.iter_buf = iter_buf
+    image_key = None
+    exposed = None
+    maxiter = 0  # largest maxiter iterated to so far
+    complete = 0
+    pass_maxiter = 0
+    unfinished = None
+    cached = 0  # complete when the state was last put in the render cache
+    def __init__(self, params, kernel):
+        self.params = copy(params)
+        self.kernel = kernel
+
+    def matches(self, params):
+        p = self.params
+        return p.xmin == params.xmin and p.xmax == params.xmax and p.ymin == params.ymin \
+            and p.width == params.width and p.height == params.height
+
+def render_view(frame: MandelbrotParams, kernel):
+    '''
+    the render cache key of the state of frame written by kernel, see render_cache.py.
+    None for perturb, its state is relative to a reference orbit
+    '''
+    if kernel == 'perturb':
+        return None
+    step_size = (frame.xmax - frame.xmin) / frame.width
+    return (double_to_fp_int_array(frame.xmin) + double_to_fp_int_array(frame.ymin) +
+            double_to_fp_int_array(step_size) + (frame.width, frame.height, kernel))
+
+class DeviceBuffers:
+    '''
+    OpenCL buffers for one frame geometry (width, height)
+
+    allocated once and kept on the device between progressive passes.
+    rebuilt only when the width or height changes
+    image_buf: rgb output, width * height * 3 bytes
+    state_buf: iteration state, width * height * ITER_STATE_ITEM_SIZE bytes
+    palette_buf: re-uploaded only when palette_key changes
+
+    the state is ITER_STATE_PLANES planes of width * height uint32 so neighbouring
+    work items load and store neighbouring words
+    '''
+    palette_buf = None
+    palette_key = None
+    palette_size = 0
+    def __init__(self, ctx, width, height):
+        self.width = width
+        self.height = height
+        mf = cl.mem_flags
+        self.ctx = ctx
+        self.image_buf = cl.Buffer(ctx, mf.READ_WRITE, width * height * 3)
+        self.state_buf = cl.Buffer(ctx, mf.READ_WRITE, width * height * ITER_STATE_ITEM_SIZE)
+        # second set of buffers, allocated on the first pan. buffer to buffer copies must not overlap
+        self.spare_image_buf = None
+        self.spare_state_buf = None
+
+    def allocate_spares(self):
+        if self.spare_image_buf is None:
+            mf = cl.mem_flags
+            self.spare_image_buf = cl.Buffer(self.ctx, mf.READ_WRITE, self.width * self.height * 3)
+            self.spare_state_buf = cl.Buffer(self.ctx, mf.READ_WRITE,
+                                             self.width * self.height * ITER_STATE_ITEM_SIZE)
+
+    def swap(self):
+        '''
+        swap the spare and current buffers (after shifting into the spares)
+        '''
+        self.image_buf, self.spare_image_buf = self.spare_image_buf, self.image_buf
+        self.state_buf, self.spare_state_buf = self.spare_state_buf, self.state_buf
+
+    def release(self):
+        for buf in (self.image_buf, self.state_buf, self.palette_buf, self.spare_image_buf, self.spare_state_buf):
+            if buf is not None:
+                buf.release()
+        self.image_buf = self.state_buf = self.palette_buf = None
+        self.spare_image_buf = self.spare_state_buf = None
 
 class MandelbrotFuncs:
-    use_tfm = 1  # high precision TFM library
+    precision = None  # None picks the kernel by step size from PRECISION_TIERS, or force one of KERNEL_SOURCES
+    use_perturbation = 0  # deepest tier: double precision deltas from a reference orbit instead of tfm. needs cl_khr_fp64
+    use_cpu = 0  # NumPy backend even if there is an OpenCL device
+    use_subdivision = 0  # render full resolution tiles with mandelbrot_set_subdivided
+    cpu_backend = None  # set when rendering on the host, see cpu_backend.py
+    use_render_cache = 0  # keep the state of finished frames for when they come back. OpenCL only, see render_cache.py
+    render_cache = None
     iter_state = None
+    buffers = None
+    # perturbation reference orbit and its device copy
+    reference = None
+    ref_orbit_buf = None
+    ref_orbit_len = 0
 
-    def __init__(self):
-        self.init_opencl()
+    def __init__(self, use_render_cache=None):
+        '''
+        use_render_cache overrides the class default. the display turns it on, the
+        headless renderers leave it off: they rarely see a view twice
+        '''
+        if use_render_cache is not None:
+            self.use_render_cache = use_render_cache
+        if self.use_cpu:
+            self.cpu_backend = CpuBackend()
+            return
+        try:
+            self.init_opencl()
+        except cl.Error as e:
+            print(f'MandelbrotFuncs: no usable OpenCL device ({e}). using the NumPy backend')
+            self.cpu_backend = CpuBackend()
 
     def init_opencl(self):
         # Create OpenCL context and command queue
         self.ctx = cl.create_some_context()
         self.queue = cl.CommandQueue(self.ctx)
-        # OpenCL kernel code
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        if self.use_tfm:
-            tfm_code = open('include/tfm_opencl.h', 'r').read()
-            tfm_code += open('src/c/tfm_opencl.c', 'r').read()
-            kernel_code_path = os.path.join(dir_path, 'mandelbrot_kernel_tfm.cl')
-            kernel_src = tfm_code + open(kernel_code_path, 'r').read()
+        self.has_fp64 = 'cl_khr_fp64' in self.queue.device.extensions
+        if self.use_perturbation and not self.has_fp64:
+            raise RuntimeError(f'use_perturbation needs cl_khr_fp64, not supported by {self.queue.device.name}')
+        # programs are built on first use, see get_kernel
+        self.kernels = {}
+        self.utility_kernels = None
+        if self.use_render_cache:
+            self.render_cache = RenderCache()
+
+    def build_kernel_program(self, sources):
+        '''
+        build mandelbrot_common.cl followed by sources. binaries are cached on disk
+        '''
+        kernel_src = read_source('mandelbrot_common.cl')
+        for source in sources:
+            kernel_src += read_source(source)
+        return build_program(self.ctx, kernel_src)
+
+    def kernel_available(self, name):
+        return name in KERNEL_SOURCES and (self.has_fp64 or name not in FP64_KERNELS)
+
+    def get_kernel(self, name):
+        '''
+        the mandelbrot kernel by name (see KERNEL_SOURCES). its program is built once,
+        the first time it's needed
+        '''
+        if name not in self.kernels:
+            if not self.kernel_available(name):
+                raise ValueError(f'kernel {name} not available on {self.queue.device.name}')
+            prg = self.build_kernel_program(KERNEL_SOURCES[name])
+            # retrieve the kernels once. prg.mandelbrot creates a new kernel object on every access
+            self.kernels[name] = cl.Kernel(prg, 'mandelbrot')
+        return self.kernels[name]
+
+    def get_utility_kernel(self, name):
+        '''
+        inherit_pixels or colorize
+        '''
+        if self.utility_kernels is None:
+            prg = self.build_kernel_program(UTILITY_SOURCES)
+            self.utility_kernels = {k: cl.Kernel(prg, k) for k in ('inherit_pixels', 'colorize')}
+        return self.utility_kernels[name]
+
+    def select_kernel(self, step_size):
+        '''
+        name of the cheapest kernel precise enough for step_size
+        '''
+        if self.precision is not None:
+            return self.precision
+        for name, min_step_size in PRECISION_TIERS:
+            if not self.kernel_available(name):
+                continue
+            if step_size >= min_step_size:
+                break
+        if name == 'tfm' and self.use_perturbation:
+            name = 'perturb'
+        return name
+
+    def device_buffers(self, frame: MandelbrotParams):
+        '''
+        return the buffer pool for this frame geometry. (re)allocate if width/height changed
+        '''
+        xn, yn = frame.width, frame.height
+        if self.buffers is None or self.buffers.width != xn or self.buffers.height != yn:
+            if self.buffers is not None:
+                self.cache_iter_state()
+                self.buffers.release()
+            print(f'device_buffers: allocating for ({xn}, {yn})')
+            self.buffers = DeviceBuffers(self.ctx, xn, yn)
+            self.iter_state = None
+        return self.buffers
+
+    def upload_palette(self, params: MandelbrotParams, maxiter):
+        '''
+        copy the palette to the device, unless the one already there is the same
+        '''
+        buffers = self.buffers
+        key = (maxiter, params.palette_r, params.palette_g, params.palette_b)
+        if buffers.palette_key == key:
+            return buffers.palette_buf
+        palette = params.iter_to_color(maxiter)  # shape=(maxiter,3) dtype=np.uint8
+        if buffers.palette_buf is None or buffers.palette_size < palette.nbytes:
+            if buffers.palette_buf is not None:
+                buffers.palette_buf.release()
+            buffers.palette_buf = cl.Buffer(self.ctx, cl.mem_flags.READ_ONLY, palette.nbytes)
+            buffers.palette_size = palette.nbytes
+        cl.enqueue_copy(self.queue, buffers.palette_buf, palette)
+        buffers.palette_key = key
+        return buffers.palette_buf
+
+    def upload_reference(self, frame: MandelbrotParams, maxiter, horizon):
+        '''
+        make sure the perturbation reference orbit covers this frame and maxiter,
+        and that the device copy is current. the iteration state is relative to the
+        reference, so it is cleared when the reference is replaced
+        '''
+        if self.reference is None or not self.reference.usable_for(frame):
+            self.reference = ReferenceOrbit.for_frame(frame, horizon)
+            self.iter_state = None
+            print(f'upload_reference: new reference with {self.reference.bits} bits')
+        self.reference.extend(maxiter)
+        orbit = self.reference.orbit
+        if self.ref_orbit_buf is None or self.ref_orbit_len != len(orbit) or self.iter_state is None:
+            if self.ref_orbit_buf is not None:
+                self.ref_orbit_buf.release()
+            self.ref_orbit_buf = cl.Buffer(self.ctx, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
+                                           hostbuf=orbit)
+            self.ref_orbit_len = len(orbit)
+        return self.ref_orbit_buf
+
+    def restore_iter_state(self, frame: MandelbrotParams, kernel):
+        '''
+        keep the device iteration state if it belongs to this frame and kernel.
+        if the frame is a pan or aligned zoom of the previous one, carry the overlap over.
+        otherwise start from the render cache's state of the frame, or clear it.
+        a state written by a different kernel is always cleared
+        '''
+        if self.iter_state is not None and (self.iter_state.kernel != kernel or not self.iter_state.matches(frame)):
+            self.cache_iter_state()
+        if self.iter_state is not None and self.iter_state.kernel != kernel:
+            print(f'restore_iter_state: switching kernel {self.iter_state.kernel} -> {kernel}')
+            self.iter_state = None
+        if self.iter_state is not None and not self.iter_state.matches(frame):
+            offset = frame.grid_offset(self.iter_state.params)
+            zoom_grid = frame.zoom_grid(self.iter_state.params)
+            if offset is not None:
+                self.shift_iter_state(frame, offset)
+            elif zoom_grid is not None:
+                self.inherit_iter_state(frame, zoom_grid)
+        if self.iter_state is None or not self.iter_state.matches(frame):
+            view = render_view(frame, kernel)
+            entry = self.render_cache.get(view) if self.render_cache is not None and view is not None else None
+            if entry is None:
+                print('iter_state initialized')
+                cl.enqueue_fill_buffer(self.queue, self.buffers.state_buf, np.uint8(0), 0,
+                                       frame.width * frame.height * ITER_STATE_ITEM_SIZE)
+                self.iter_state = IterState(frame, kernel)
+            else:
+                cached_maxiter, state = entry
+                print(f'iter_state restored from the render cache. maxiter: {cached_maxiter}')
+                cl.enqueue_copy(self.queue, self.buffers.state_buf, state)
+                self.iter_state = IterState(frame, kernel)
+                self.iter_state.maxiter = self.iter_state.complete = self.iter_state.cached = cached_maxiter
+        return self.iter_state
+
+    def cache_iter_state(self):
+        '''
+        put the device state in the render cache, if it has been iterated further
+        than when it was last put there. the copy to the host is only enqueued, the
+        cache waits for it when the state is read
+        '''
+        iter_state = self.iter_state
+        if self.render_cache is None or iter_state is None or iter_state.complete <= iter_state.cached:
+            return
+        view = render_view(iter_state.params, iter_state.kernel)
+        if view is None:
+            return
+        state, ready = self.enqueue_read_iter_state()
+        self.render_cache.put(view, iter_state.complete, state, ready)
+        iter_state.cached = iter_state.complete
+
+    def shift_iter_state(self, frame: MandelbrotParams, offset):
+        '''
+        the new frame's pixel (x, y) is the old frame's pixel (x + offset[0], y + offset[1]).
+        copy the overlapping rectangle of state and image into the spare buffers, zero
+        the rest, and swap. only the newly exposed strips are left to compute
+        '''
+        buffers = self.buffers
+        xn, yn = frame.width, frame.height
+        xoffset, yoffset = offset
+        full = (0, 0, xn, yn)
+        overlap = rect_intersect(full, (-xoffset, -yoffset, xn, yn))
+        x, y, w, h = overlap
+        print(f'shift_iter_state: offset: {offset}  overlap: {overlap}')
+        buffers.allocate_spares()
+        cl.enqueue_fill_buffer(self.queue, buffers.spare_state_buf, np.uint8(0), 0, xn * yn * ITER_STATE_ITEM_SIZE)
+        cl.enqueue_fill_buffer(self.queue, buffers.spare_image_buf, np.uint8(0), 0, xn * yn * 3)
+        # all planes in one 3d copy. origins and regions are (bytes, rows, planes)
+        cl.enqueue_copy(self.queue, buffers.spare_state_buf, buffers.state_buf,
+                        src_origin=((x + xoffset) * 4, y + yoffset, 0), dst_origin=(x * 4, y, 0),
+                        region=(w * 4, h, ITER_STATE_PLANES),
+                        src_pitches=(xn * 4, xn * yn * 4), dst_pitches=(xn * 4, xn * yn * 4))
+        # the image is stored top row first
+        row = yn - y - h
+        cl.enqueue_copy(self.queue, buffers.spare_image_buf, buffers.image_buf,
+                        src_origin=((x + xoffset) * 3, row - yoffset), dst_origin=(x * 3, row),
+                        region=(w * 3, h), src_pitches=(xn * 3,), dst_pitches=(xn * 3,))
+        buffers.swap()
+        iter_state = self.iter_state
+        iter_state.params = copy(frame)
+        # the exposed strips start from zero
+        iter_state.complete = iter_state.pass_maxiter = iter_state.cached = 0
+        if iter_state.exposed is None:
+            iter_state.image_key = None
         else:
-            kernel_code_path = os.path.join(dir_path, 'mandelbrot_kernel.cl')
-            kernel_src = open(kernel_code_path, 'r').read()
-        # Compile the kernel
-        self.prg = cl.Program(self.ctx, kernel_src).build()
+            exposed = [rect_intersect((r[0] - xoffset, r[1] - yoffset, r[2], r[3]), overlap)
+                       for r in iter_state.exposed]
+            iter_state.exposed = [r for r in exposed if r is not None] + rect_subtract(full, overlap)
 
+    def inherit_iter_state(self, frame: MandelbrotParams, zoom_grid):
+        '''
+        after an aligned zoom by a power of two, seed the new state and image from the
+        pixels of the previous frame that land on the new grid. a quarter of the pixels
+        when zooming in by 2, all the pixels covering the old frame when zooming out
+        '''
+        buffers = self.buffers
+        num, den, xoffset, yoffset = zoom_grid
+        print(f'inherit_iter_state: zoom_grid: {zoom_grid}')
+        buffers.allocate_spares()
+        self.get_utility_kernel('inherit_pixels')(self.queue, (frame.width, frame.height), None,
+                            buffers.state_buf, buffers.image_buf,
+                            buffers.spare_state_buf, buffers.spare_image_buf,
+                            np.int32(frame.width), np.int32(frame.height),
+                            np.int32(num), np.int32(den), np.int32(xoffset), np.int32(yoffset))
+        buffers.swap()
+        # the image is only partly painted. the next pass launches the whole frame,
+        # inherited pixels that are already done just get colored
+        self.iter_state = IterState(frame, self.iter_state.kernel)
 
-    # export PYOPENCL_CTX='0:1'
-    def mandelbrot_set_opencl(self, params: MandelbrotParams, horizon=2.0):
+    def read_image(self, params: MandelbrotParams):
         '''
-        returns a numpy array with shape=(params.width, params.height, 3) and dtype=np.int8
+        copy the rgb pixels of this tile back from the device image buffer
+        the image buffer is stored top row first, so the tile rows are flipped
         '''
-        xmin, xmax, ymin, ymax, xn, yn, maxiter = \
-            params.xmin, params.xmax, params.ymin, params.ymax, params.width, params.height, params.maxiter
-        step_size = (xmax - xmin) / xn
-        if maxiter >= MAX_MAXITER:
-            print(f'WARNING: maxiter: {maxiter} greater than limit {MAX_MAXITER}. reducing to limit')
-            maxiter = MAX_MAXITER
-        # cache the mandelbrot array so we don't have to reallocate it unless width/height changes
-        #### !!! mbc = params._mandelbrot_cache
-        mbc = None
-        if mbc is None or mbc[0] != xn or mbc[1] != yn:
-            mandelbrot = np.zeros((yn, xn, 3), dtype=np.uint8)
-            params._mandelbrot_cache = (xn, yn, mandelbrot)
+        frame = params.get_frame()
+        xn, yn = params.width, params.height
+        mandelbrot = np.empty((yn, xn, 3), dtype=np.uint8)
+        if params is frame:
+            cl.enqueue_copy(self.queue, mandelbrot, self.buffers.image_buf)
         else:
-            mandelbrot = mbc[2]
-
-        # Prepare data
-        palette = params.iter_to_color()  # shape=(maxiter,3) dtype=np.uint8
-
-        # Allocate memory on the GPU
-        output_buf_size = xn * yn * 3  # width * height * 3 channels * sizeof(uint8)
-        iter_buf_size = xn * yn * ITER_STATE_ITEM_SIZE  # (uint32 iter_count + fp_digit z_real + fp_digit z_imag)
-        output_buf_size += iter_buf_size
-        if OPENCL_DEBUG:
-            debug_size = DEBUG_INFO_SIZE * (xn * yn);
-            output_buf_size = output_buf_size + debug_size;
-        output_buf_np = np.zeros((output_buf_size,), dtype=np.uint8)
-        # Restore the iterbuf
-        if self.iter_state is None \
-           or self.iter_state.params.xmin != xmin \
-               or self.iter_state.params.ymin != ymin \
-                   or self.iter_state.params.width != xn \
-                       or self.iter_state.params.height != yn:
-            print('iter_state initialized')
-            iter_buf = np.zeros((xn,yn,ITER_STATE_ITEM_SIZE), dtype=np.uint8)
-            self.iter_state = IterState(params, iter_buf)
+            row = frame.height - params.frame_y - yn
+            cl.enqueue_copy(self.queue, mandelbrot, self.buffers.image_buf,
+                            buffer_origin=(params.frame_x * 3, row), host_origin=(0, 0),
+                            region=(xn * 3, yn),
+                            buffer_pitches=(frame.width * 3,), host_pitches=(xn * 3,))
+        return mandelbrot
+
+    def read_frame_counts(self):
+        '''
+        the count plane of the whole frame's state
+        returns shape=(height, width) dtype=np.int32, kernel orientation (row 0 is ymin)
+        '''
+        buffers = self.buffers
+        counts = np.empty((buffers.height, buffers.width), dtype=np.int32)
+        cl.enqueue_copy(self.queue, counts, buffers.state_buf)
+        return counts
+
+    def read_counts(self, params: MandelbrotParams):
+        '''
+        copy the iteration counts of this tile back from the device state
+        returns shape=(params.height, params.width) dtype=np.int32, top row first like the image
+        pixels found inside the main cardioid or the period-2 bulb are ITER_INTERIOR
+        '''
+        frame = params.get_frame()
+        xn, yn = params.width, params.height
+        counts = np.empty((yn, xn), dtype=np.int32)
+        cl.enqueue_copy(self.queue, counts, self.buffers.state_buf,
+                        buffer_origin=(params.frame_x * 4, params.frame_y), host_origin=(0, 0),
+                        region=(xn * 4, yn),
+                        buffer_pitches=(frame.width * 4,), host_pitches=(xn * 4,))
+        return counts[::-1]
+
+    def recolor_opencl(self, params: MandelbrotParams):
+        '''
+        repaint the whole frame with the palette of params, from the counts already
+        on the device. no iterations are run.
+        returns the rgb frame like mandelbrot_set_opencl, or None if the device state
+        doesn't belong to this frame (call mandelbrot_set_opencl instead)
+        '''
+        if self.cpu_backend is not None:
+            return self.cpu_backend.recolor(params)
+        frame = params.get_frame()
+        iter_state = self.iter_state
+        if iter_state is None or not iter_state.matches(frame) or not iter_state.maxiter:
+            return None
+        buffers = self.buffers
+        maxiter = iter_state.maxiter
+        c_palette = self.upload_palette(params, maxiter)
+        self.get_utility_kernel('colorize')(self.queue, (frame.width, frame.height), None,
+                             buffers.state_buf, c_palette, buffers.image_buf,
+                             np.int32(maxiter), np.int32(frame.width), np.int32(frame.height))
+        iter_state.image_key = buffers.palette_key
+        iter_state.exposed = []
+        return self.read_image(frame)
+
+    def read_iter_state(self):
+        '''
+        copy the iteration state of the current frame to the host (for debugging)
+        returns shape=(ITER_STATE_PLANES, height, width) dtype=np.uint32
+        in the format of the kernel self.iter_state.kernel
+        '''
+        state, ready = self.enqueue_read_iter_state()
+        ready.wait()
+        return state
+
+    def enqueue_read_iter_state(self):
+        '''
+        read_iter_state() without waiting: returns (state, event). state is filled
+        once event completes. the queue is in order, so later kernels don't change it
+        '''
+        buffers = self.buffers
+        state = np.empty((ITER_STATE_PLANES, buffers.height, buffers.width), dtype=np.uint32)
+        ready = cl.enqueue_copy(self.queue, state, buffers.state_buf, is_blocking=False)
+        self.queue.flush()
+        return state, ready
+
+    # export PYOPENCL_CTX='0:1'
+    def mandelbrot_set_opencl(self, params: MandelbrotParams, horizon=2.0, output='rgb'):
+        '''
+        returns a numpy array with shape=(params.height, params.width, 3) and dtype=np.uint8
+
+        with output='counts' returns the iteration counts instead, shape=(params.height, params.width)
+        dtype=np.int32 (see read_counts). color them with cpu_backend.colorize_counts() or recolor_opencl()
+
+        params may be a tile from MandelbrotParams.tile_params(). the buffers and iteration
+        state are kept on the device for the whole frame and reused by every pass
+
+        the kernel is the cheapest one precise enough for the frame's step size (select_kernel).
+        without an OpenCL device this runs on the host instead, see cpu_backend.py.
+        with use_subdivision set this is mandelbrot_set_subdivided
+        '''
+        if params.stride > 1:
+            return self.mandelbrot_set_preview(params, horizon, output)
+        if self.use_subdivision:
+            return self.mandelbrot_set_subdivided(params, horizon, output)
+        if self.cpu_backend is not None:
+            return self.cpu_backend.mandelbrot_set(params, horizon, output)
+        kernel, maxiter, args = self.prepare_launch(params, horizon)
+        frame = params.get_frame()
+        step_size = (frame.xmax - frame.xmin) / frame.width
+
+        # Execute the kernel over this tile of the frame. if the image is already painted
+        # for this maxiter and palette, only the exposed parts of the tile are launched
+        iter_state = self.iter_state
+        image_key = self.buffers.palette_key
+        tile = (params.frame_x, params.frame_y, params.width, params.height)
+        if iter_state.image_key == image_key:
+            rects = [rect_intersect(tile, r) for r in iter_state.exposed]
+            rects = [r for r in rects if r is not None]
         else:
-            print('iter_state reused')
-            output_buf_np[(xn * yn * 3):] = self.iter_state.iter_buf.flatten().view(np.uint8)
-
-        output_buf_test_pos = (xn * yn * 3) + ((300 * xn) + 400) * ITER_STATE_ITEM_SIZE
-        if 0:  # Debug iter state
-            iter_count, z_real, z_imag = unpack_iter_state(output_buf_np[output_buf_test_pos:output_buf_test_pos+ITER_STATE_ITEM_SIZE])
-            print(f'iter_count(400,300) (pre kernel): {iter_count}  z_real: {z_real}  z_imag: {z_imag}')
-        output_buf = cl.Buffer(self.ctx, cl.mem_flags.READ_WRITE | cl.mem_flags.COPY_HOST_PTR, hostbuf=output_buf_np)
-        c_palette = cl.Buffer(self.ctx, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR, hostbuf=palette)
-
-        # Execute the kernel
-        shape = (xn, yn)
-        if self.use_tfm:
-            # call tfm with high-precision xmin, ymin, step_size
-            step_size_hi, step_size_lo = double_to_fp_int_array(step_size)
-            xmin_hi, xmin_lo = double_to_fp_int_array(xmin)
-            ymin_hi, ymin_lo = double_to_fp_int_array(ymin)
-            print(step_size, step_size_hi, step_size_lo)
-            print(xmin, xmin_hi, xmin_lo)
-            print(ymin, ymin_hi, ymin_lo)
-            print(f'mandelbrot_set_opencl: maxiter: {maxiter}  step_size: {step_size:.8g}')
-            self.prg.mandelbrot(self.queue, shape, None, output_buf, c_palette,
-                                np.int32(maxiter), np.float32(horizon*horizon), np.int32(xn), np.int32(yn),
-                                np.uint64(xmin_hi), np.uint64(xmin_lo),
-                                np.uint64(ymin_hi), np.uint64(ymin_lo),
-                                np.uint64(step_size_hi), np.uint64(step_size_lo),
-                                )
+            rects = [tile]
+        print(f'mandelbrot_set_opencl: kernel: {kernel}  maxiter: {maxiter}  step_size: {step_size:.8g}  '
+              f'rects: {len(rects)}')
+        if iter_state.complete >= maxiter:
+            # every pixel is done already, e.g. the state came from the render cache. only paint
+            if rects:
+                self.colorize_tile(params, maxiter)
         else:
-            # call non-tfm with float32 for xmin, ymin, step_size
-            self.prg.mandelbrot(self.queue, shape, None, output_buf, c_palette,
-                                np.int32(maxiter), np.float32(horizon*horizon), np.int32(xn), np.int32(yn),
-                                np.float32(xmin), np.float32(ymin), np.float32(step_size)
-                                )
-
-        # Read results back to host
-        cl.enqueue_copy(self.queue, mandelbrot, output_buf)
-        # read iter state back and store for next time
-        cl.enqueue_copy(self.queue, self.iter_state.iter_buf, output_buf, src_offset=(xn*yn*3))
-        # DEBUG
-        if OPENCL_DEBUG:
-            debug_array = np.zeros((xn,yn,DEBUG_INFO_SIZE), dtype=np.uint8)
-            cl.enqueue_copy(self.queue, debug_array, output_buf, src_offset=(xn * yn * 3))
-            for i in range(100):
-                x, y, c_real, c_imag, i, d1, d2, d3, i1, i2, i3, i4, i5 = parse_debug_info(debug_array[i][0])
-                print(f'({x}, {y}): {c_real}, {c_imag} => {i}  d1: {d1}  d2: {d2}  d3: {d3}')
-                print(f'  {i1} {i2} {i3} {i4} {i5}')
-        if 0:  # DEBUG THE iter_buf state
+            for (x, y, w, h) in rects:
+                self.get_kernel(kernel)(self.queue, (w, h), None, *args, global_offset=(x, y))
+        self.mark_painted(tile, image_key)
+        self.mark_iterated(params, maxiter)
+
+        iter_state.maxiter = max(iter_state.maxiter, maxiter)
+        if output == 'counts':
+            return self.read_counts(params)
+        # Only the rgb image comes back to the host. the iteration state stays on the device
+        mandelbrot = self.read_image(params)
+        if 0:  # DEBUG THE iteration state
+            state = self.read_iter_state()
             y = 300
             for x in range(400, 410):
-                iter_count, z_real, z_imag = unpack_iter_state(self.iter_state.iter_buf[y][x])
+                iter_count, z_real, z_imag = unpack_iter_state(state, x, y, kernel)
                 print(f'({y}, {x}): iter_count: {iter_count}  z_real: {z_real}  z_imag: {z_imag}')
-        # Cleanup
-        output_buf.release()
-        # Return
         return mandelbrot
 
+    def prepare_launch(self, params: MandelbrotParams, horizon):
+        '''
+        get the device ready to iterate the frame of params: the kernel for its step size,
+        buffers, palette, reference orbit and iteration state
+        returns (kernel, maxiter, args) where args are the kernel's arguments
+        '''
+        frame = params.get_frame()
+        xn, yn, maxiter = frame.width, frame.height, params.maxiter
+        step_size = (frame.xmax - frame.xmin) / xn
+        if maxiter >= MAX_MAXITER:
+            print(f'WARNING: maxiter: {maxiter} greater than limit {MAX_MAXITER}. reducing to limit')
+            maxiter = MAX_MAXITER
+        kernel = self.select_kernel(step_size)
+        buffers = self.device_buffers(frame)
+        c_palette = self.upload_palette(params, maxiter)
+        if kernel == 'perturb':
+            ref_orbit_buf = self.upload_reference(frame, maxiter, horizon)
+        self.restore_iter_state(frame, kernel)
+
+        args = (buffers.image_buf, c_palette, buffers.state_buf,
+                np.int32(maxiter), np.float32(horizon*horizon), np.int32(xn), np.int32(yn))
+        if kernel == 'perturb':
+            # call perturbation with the reference orbit and the reference position in pixels
+            ref_x, ref_y = self.reference.pixel_position(frame)
+            ref_c_real, ref_c_imag = self.reference.center()
+            args += (ref_orbit_buf, np.int32(self.reference.length),
+                     np.float64(ref_x), np.float64(ref_y), np.float64(step_size),
+                     np.float64(ref_c_real), np.float64(ref_c_imag))
+        elif kernel == 'tfm':
+            # call tfm with high-precision xmin, ymin, step_size and the periodicity check tolerance
+            step_size_hi, step_size_lo = double_to_fp_int_array(step_size)
+            xmin_hi, xmin_lo = double_to_fp_int_array(frame.xmin)
+            ymin_hi, ymin_lo = double_to_fp_int_array(frame.ymin)
+            tolerance_hi, tolerance_lo = double_to_fp_int_array(fp_numpy.period_tolerance(step_size))
+            args += (np.uint64(xmin_hi), np.uint64(xmin_lo),
+                     np.uint64(ymin_hi), np.uint64(ymin_lo),
+                     np.uint64(step_size_hi), np.uint64(step_size_lo),
+                     np.uint64(tolerance_hi), np.uint64(tolerance_lo))
+        elif kernel == 'fp64':
+            args += (np.float64(frame.xmin), np.float64(frame.ymin), np.float64(step_size))
+        elif kernel == 'dblfloat':
+            # call dblfloat with (high, low) float pairs
+            args += double_to_dblfloat(frame.xmin) + double_to_dblfloat(frame.ymin) + double_to_dblfloat(step_size)
+        else:
+            # call float32 with float32 for xmin, ymin, step_size
+            args += (np.float32(frame.xmin), np.float32(frame.ymin), np.float32(step_size))
+        return kernel, maxiter, args
+
+    def mark_painted(self, tile, image_key):
+        '''
+        track which parts of the image are painted for this maxiter and palette,
+        after the kernel has painted tile (x, y, width, height)
+        '''
+        iter_state = self.iter_state
+        buffers = self.buffers
+        if tile == (0, 0, buffers.width, buffers.height):
+            iter_state.image_key = image_key
+            iter_state.exposed = []
+        elif iter_state.image_key == image_key:
+            iter_state.exposed = [p for r in iter_state.exposed for p in rect_subtract(r, tile)]
+        else:
+            iter_state.image_key = None
+            iter_state.exposed = None
+
+    def mark_iterated(self, params: MandelbrotParams, maxiter):
+        '''
+        track how far the whole frame is iterated, after the kernel has iterated the tile
+        of params to maxiter. a frame done to its own maxiter goes in the render cache
+        '''
+        iter_state = self.iter_state
+        frame = params.get_frame()
+        if maxiter > iter_state.complete:
+            if iter_state.pass_maxiter != maxiter:
+                iter_state.pass_maxiter = maxiter
+                iter_state.unfinished = [(0, 0, frame.width, frame.height)]
+            tile = (params.frame_x, params.frame_y, params.width, params.height)
+            iter_state.unfinished = [p for r in iter_state.unfinished for p in rect_subtract(r, tile)]
+            if not iter_state.unfinished:
+                iter_state.complete = maxiter
+        if iter_state.complete >= min(frame.maxiter, MAX_MAXITER):
+            self.cache_iter_state()
+
+    def mandelbrot_set_subdivided(self, params: MandelbrotParams, horizon=2.0, output='rgb', min_size=MIN_SIZE):
+        '''
+        mandelbrot_set_opencl with Mariani-Silver subdivision, see subdivide.py. only the borders
+        of rectangles are iterated, and uniform ones are filled. each level of rectangles is
+        one kernel launch over the tile, the pixels outside the level are parked meanwhile
+        with ITER_DEFERRED, a count the kernels take as finished
+        '''
+        if self.cpu_backend is not None:
+            cpu_backend = self.cpu_backend
+            def iterate_cpu(mask):
+                cpu_backend.mandelbrot_set(params, horizon, 'counts', mask)
+                return cpu_backend.iter_state.counts
+            fill, filled = subdivide(params, iterate_cpu, min_size)
+            return cpu_backend.fill_counts(params, fill, filled, output)
+        kernel, maxiter, args = self.prepare_launch(params, horizon)
+        buffers = self.buffers
+        iter_state = self.iter_state
+        tile = (params.frame_x, params.frame_y, params.width, params.height)
+        print(f'mandelbrot_set_subdivided: kernel: {kernel}  maxiter: {maxiter}')
+        counts = self.read_frame_counts()
+        def iterate(mask):
+            self.launch_masked(params, kernel, args, counts, mask)
+            return counts
+        try:
+            fill, filled = subdivide(params, iterate, min_size)
+            counts[filled] = fill[filled]
+        finally:
+            # the parked counts must never stay in the state
+            cl.enqueue_copy(self.queue, buffers.state_buf, counts)
+        self.colorize_tile(params, maxiter)
+        self.mark_painted(tile, buffers.palette_key)
+        self.mark_iterated(params, maxiter)
+        iter_state.maxiter = max(iter_state.maxiter, maxiter)
+        if output == 'counts':
+            return self.read_counts(params)
+        return self.read_image(params)
+
+    def launch_masked(self, params: MandelbrotParams, kernel, args, counts, mask):
+        '''
+        one kernel launch over the tile of params that only iterates the pixels where mask is set.
+        the others are parked meanwhile with ITER_DEFERRED, a count the kernels take as finished
+        counts are the frame's counts from read_frame_counts(): they are updated where mask is set,
+        and the caller must copy them back to the state when done
+        '''
+        cl.enqueue_copy(self.queue, self.buffers.state_buf, np.where(mask, counts, ITER_DEFERRED).astype(np.int32))
+        self.get_kernel(kernel)(self.queue, (params.width, params.height), None, *args,
+                                global_offset=(params.frame_x, params.frame_y))
+        counts[mask] = self.read_frame_counts()[mask]
+
+    def colorize_tile(self, params: MandelbrotParams, maxiter):
+        '''
+        paint the tile of params from the counts in the state. after launch_masked, the kernels
+        only painted what they iterated
+        '''
+        frame = params.get_frame()
+        buffers = self.buffers
+        self.get_utility_kernel('colorize')(self.queue, (params.width, params.height), None,
+                                            buffers.state_buf, buffers.palette_buf, buffers.image_buf,
+                                            np.int32(maxiter), np.int32(frame.width), np.int32(frame.height),
+                                            global_offset=(params.frame_x, params.frame_y))
+
+    def mandelbrot_set_preview(self, params: MandelbrotParams, horizon=2.0, output='rgb'):
+        '''
+        mandelbrot_set_opencl for a preview level from MandelbrotParams.preview_iter: only the
+        pixels on a grid of params.stride are iterated, and every stride x stride block of the
+        tile is returned in the color (or count) of its grid pixel.
+        the grid pixels are iterated in the frame's state like any other, so the finer levels and
+        the full resolution passes carry on from them instead of iterating them again
+        '''
+        frame = params.get_frame()
+        stride = params.stride
+        mask = np.zeros((frame.height, frame.width), dtype=np.bool_)
+        mask[::stride, ::stride] = True
+        if self.cpu_backend is not None:
+            tile_output = self.cpu_backend.mandelbrot_set(params, horizon, output, mask)
+        else:
+            kernel, maxiter, args = self.prepare_launch(params, horizon)
+            print(f'mandelbrot_set_preview: kernel: {kernel}  maxiter: {maxiter}  stride: {stride}')
+            counts = self.read_frame_counts()
+            try:
+                self.launch_masked(params, kernel, args, counts, mask)
+            finally:
+                cl.enqueue_copy(self.queue, self.buffers.state_buf, counts)
+            self.colorize_tile(params, maxiter)
+            # the image is only right on the grid, so the next pass has to paint all of it
+            self.iter_state.image_key = None
+            self.iter_state.exposed = None
+            self.iter_state.maxiter = max(self.iter_state.maxiter, maxiter)
+            tile_output = self.read_counts(params) if output == 'counts' else self.read_image(params)
+        # each pixel takes its block's grid pixel. rows are top first, the grid is bottom first
+        x0, y0, xn, yn = params.frame_x, params.frame_y, params.width, params.height
+        cols = (x0 + np.arange(xn)) // stride * stride - x0
+        rows = (y0 + np.arange(yn)[::-1]) // stride * stride - y0
+        cols = np.clip(cols, 0, xn - 1)
+        rows = np.clip(yn - 1 - rows, 0, yn - 1)
+        return tile_output[rows[:, np.newaxis], cols]
+
     def mandelbrot_image(self, params):
         #mandelbrot = mandelbrot_set(params)
         mandelbrot = self.mandelbrot_set_opencl(params)
@@ -230,8 +865,9 @@ class MandelbrotFuncs:
         #return grayscale_as_rgb
         return normalized
 
-def generate_sample(filename):
-    m = MandelbrotFuncs()
+def generate_sample(filename, m=None):
+    if m is None:
+        m = MandelbrotFuncs()
     #image_dims: (int,int), mbrot_center: (float, float) = (-0.5,0), mbrot_width: float = 2.0):
     mbrot_center = (-0.5, 0)
     mbrot_width = 2.0
@@ -247,9 +883,10 @@ def generate_sample(filename):
     image.save(filename, format='JPEG', quality=95)
     return params
 
-def test_zoom(params, filename):
+def test_zoom(params, filename, m=None):
     params.zoom_by_bbox(0,600, 0, 400)
-    m = MandelbrotFuncs()
+    if m is None:
+        m = MandelbrotFuncs()
     m.mandelbrot_image(params)
     image_array = m.mandelbrot_image(params)
     from PIL import Image, ImageTk
@@ -270,8 +907,9 @@ def test(profile=True):
         p = Stats(profile_stats_file)
         p.sort_stats('cumulative').print_stats(10)
     else:
-        params = generate_sample(sample_filename)
-        test_zoom(params, 'x2.jpg')
+        m = MandelbrotFuncs()
+        params = generate_sample(sample_filename, m)
+        test_zoom(params, 'x2.jpg', m)
 
 
 if __name__ == '__main__':
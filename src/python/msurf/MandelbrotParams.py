@@ -1,10 +1,35 @@
+import ast
+from functools import lru_cache
 import numpy as np
 from math import pi, cos, log
 
 
+ITER_STEP = 100  # iterations added by each progressive pass. sync with opencl kernel
+PREVIEW_STRIDES = (8, 4, 2)  # coarse to fine preview levels before the first full resolution pass
+
+@lru_cache(maxsize=32)
+def palette_for(maxiter, palette_r, palette_g, palette_b):
+    '''
+    the rgb color of each iteration count, log scaled. shape=(maxiter, 3) dtype=np.uint8
+    cached, so the returned array is read-only
+    '''
+    print(f'palette_for: maxiter={maxiter}  rgb=({palette_r}, {palette_g}, {palette_b})')
+    factor = np.log(np.arange(1, maxiter + 1, dtype=np.float64)) / log(maxiter + 1)
+    rgb = np.array([palette_r, palette_g, palette_b], dtype=np.float64)
+    palette = (factor[:, np.newaxis] * rgb).astype(np.uint8)
+    palette.flags.writeable = False
+    return palette
+
+
 class MandelbrotParams:
     # used by mandelbrot_set_opencl. (width, height, np.array)
     _mandelbrot_cache = None
+    # set by tile_params(): the full frame this tile belongs to and the tile offset within it
+    frame = None
+    frame_x = 0
+    frame_y = 0
+    # set by preview_iter(): only every stride-th pixel in x and y is iterated, see MandelbrotFuncs.mandelbrot_set_preview
+    stride = 1
     xmin = 0
     xmax = 0
     ymin = 0
@@ -92,6 +117,18 @@ class MandelbrotParams:
         self.ymin = ycenter - new_yheight / 2
         self.ymax = ycenter + new_yheight / 2
 
+    def pan(self, dx, dy):
+        """
+        Move the view by whole pixels, keeping the pixel grid aligned so the
+        previous render can be reused.
+
+        :param dx, dy: pixel offset in image space (y grows downward)
+        """
+        step_size = self.step_size()
+        dx, dy = int(dx), int(dy)
+        self.update_bounds(self.xmin + dx * step_size, self.xmax + dx * step_size,
+                           self.ymin - dy * step_size, self.ymax - dy * step_size)
+
     def zoom_by_bbox(self, x1, x2, y1, y2):
         """
         Zoom into the Mandelbrot based on a bounding box around the pixel image
@@ -138,36 +175,88 @@ class MandelbrotParams:
         y1 = self.height - int((ypos - self.ymin) / yheight * self.height)
         return x1, y1
 
-    def iter_to_color(self):
+    def step_size(self):
+        return (self.xmax - self.xmin) / self.width
+
+    def grid_offset(self, other, tolerance=1e-3):
+        '''
+        if other has the same dimensions and step size, and its pixel grid lines up
+        with ours, return (x, y): the position of our pixel (0, 0) in other's pixels.
+        x, y are in the kernel's orientation (y grows with the imaginary part)
+        returns None if the grids don't line up or don't overlap
+        '''
+        if self.width != other.width or self.height != other.height:
+            return None
+        step_size = self.step_size()
+        if abs(step_size - other.step_size()) > step_size * 1e-9:
+            return None
+        xoffset = (self.xmin - other.xmin) / step_size
+        yoffset = (self.ymin - other.ymin) / step_size
+        x, y = round(xoffset), round(yoffset)
+        if abs(xoffset - x) > tolerance or abs(yoffset - y) > tolerance:
+            return None
+        if abs(x) >= self.width or abs(y) >= self.height:
+            return None
+        return x, y
+
+    def zoom_grid(self, other, tolerance=1e-3):
         '''
-        returns an array for the color,size of each iteration
-        [((blue, green, red), pixel_size_of_dot) ... ]
+        if our step size is other's step size times a power of two (other than 1) and
+        the pixel grids line up, return (num, den, x, y) such that our pixel (px, py) is
+        other's pixel ((px * num + x) / den, (py * num + y) / den) whenever that divides exactly.
+        zooming in by 2**k gives (1, 2**k, x, y), zooming out gives (2**k, 1, x, y)
+        returns None if the grids don't line up or the frames don't overlap
         '''
-        print(f'iter_to_color: rgb=({self.palette_r}, {self.palette_g}, {self.palette_b})')
-        maxiter = self.maxiter
-        palette = np.zeros((maxiter, 3), dtype=np.uint8)
-        for i in range(maxiter):
-            factor = log(i + 1) / log(maxiter + 1)
-            palette[i][0] = int(self.palette_r * factor)
-            palette[i][1] = int(self.palette_g * factor)
-            palette[i][2] = int(self.palette_b * factor)
-        return palette
+        if self.width != other.width or self.height != other.height:
+            return None
+        step_size = self.step_size()
+        ratio = other.step_size() / step_size
+        k = round(log(ratio, 2))
+        if k == 0 or abs(ratio - 2.0 ** k) > ratio * 1e-9:
+            return None
+        if self.xmax <= other.xmin or self.xmin >= other.xmax or self.ymax <= other.ymin or self.ymin >= other.ymax:
+            return None
+        if k > 0:
+            num, den = 1, 2 ** k
+            unit = step_size  # offset in our pixels
+        else:
+            num, den = 2 ** -k, 1
+            unit = other.step_size()  # offset in other's pixels
+        xoffset = (self.xmin - other.xmin) / unit
+        yoffset = (self.ymin - other.ymin) / unit
+        x, y = round(xoffset), round(yoffset)
+        if abs(xoffset - x) > tolerance or abs(yoffset - y) > tolerance:
+            return None
+        return num, den, x, y
+
+    def iter_to_color(self, maxiter=None):
+        '''
+        returns an array with the (red, green, blue) of each iteration
+        shape=(maxiter, 3) dtype=np.uint8. read-only, shared by every call with the same colors
+
+        :param maxiter: defaults to self.maxiter
+        '''
+        if maxiter is None:
+            maxiter = self.maxiter
+        return palette_for(int(maxiter), int(self.palette_r), int(self.palette_g), int(self.palette_b))
 
     def set_palette(self, r, g, b):
         self.palette_r = r
         self.palette_g = g
         self.palette_b = b
 
-    def tile_params(self, x, y, tile_size):
+    def tile_params(self, x, y, tile_size, tile_height=None):
         '''
         x and y are relative to our width and height
-        tile_size is the width and height of the tile
+        tile_size is the width and height of the tile, or only the width if tile_height is given
 
         returns the new params along with tile_x (remaining x pixels) and tile_y (remaining y pixels)
         '''
         # Define the bounds for this tile in the complex plane
+        if tile_height is None:
+            tile_height = tile_size
         tile_x = min(tile_size, self.width - x)  # remaining tile extent
-        tile_y = min(tile_size, self.height - y)
+        tile_y = min(tile_height, self.height - y)
         step_size = (self.xmax - self.xmin) / self.width
         tile_xmin = self.xmin + (x * step_size)
         tile_xmax = tile_xmin + (tile_x * step_size)
@@ -179,18 +268,45 @@ class MandelbrotParams:
         tile_params.palette_r = self.palette_r
         tile_params.palette_g = self.palette_g
         tile_params.palette_b = self.palette_b
+        # remember the frame so device buffers and iteration state are shared by all tiles
+        tile_params.frame = self.get_frame()
+        tile_params.frame_x = self.frame_x + x
+        tile_params.frame_y = self.frame_y + y
         return tile_params, tile_x, tile_y
 
-    def tile_iter(self, tile_size):
+    def get_frame(self):
+        '''
+        returns the full frame params. for a tile this is the params it was cut from
+        '''
+        return self if self.frame is None else self.frame
+
+    def preview_iter(self, strides=PREVIEW_STRIDES):
+        '''
+        return a generator of coarse to fine previews of this display, one tile of the whole
+        display per stride, for the first pass's maxiter. a preview tile only iterates every
+        stride-th pixel and comes back upscaled. the pixels are kept in the iteration state,
+        so the finer levels and the passes after them never compute a pixel twice
+        value is
+          (x, y, tile_params, tile_width, tile_height)
+        '''
+        for stride in strides:
+            tile_params, tile_width, tile_height = self.tile_params(0, 0, self.width, self.height)
+            tile_params.maxiter = min(ITER_STEP, self.maxiter)
+            tile_params.stride = stride
+            yield (0, 0, tile_params, tile_width, tile_height)
+
+    def tile_iter(self, tile_size, preview=False):
         '''
         return a generator that will loop over tiles in this display
         ordering is [(x0, y0), (x1, y0), (x2, y0) ... (xN-1, yN-1)]
+        with preview the tiles of preview_iter() come first
         value is
           (x, y, tile_params, tile_width, tile_height)
         '''
+        if preview:
+            yield from self.preview_iter()
         x = 0
         y = 0
-        ITER_STEP = 100  # sync with opencl kernel
         cur_iter = 0
         while cur_iter < self.maxiter:
             while True:
@@ -226,7 +342,7 @@ class MandelbrotParams:
 
     @classmethod
     def from_bookmark_string(self, bookmark_string, width, height):
-        d = eval(bookmark_string)  # !!! UNSAFE !!!
+        d = ast.literal_eval(bookmark_string.strip())  # a dict of numbers, see bookmark_string
         step_size = d['step_size']
         xcenter = d['xcenter']
         ycenter = d['ycenter']
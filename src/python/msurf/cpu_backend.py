@@ -0,0 +1,332 @@
+'''
+NumPy backend for machines without a usable OpenCL device.
+
+Same output contract as MandelbrotFuncs.mandelbrot_set_opencl: rgb tiles top row
+first, or iteration counts where a negative count escaped after -count iterations.
+Pixels inside the main cardioid or the period-2 bulb are found before iterating and
+get ITER_INTERIOR.
+The counts and z of the whole frame are kept on the host so progressive passes
+continue where the last one stopped, and a pan keeps the overlap.
+
+Only the pixels still iterating are worked on. They are gathered into compact
+arrays once per call, iterated in place in chunks of COMPACT_INTERVAL iterations,
+and after every chunk the escaped and finished ones are dropped. |z|**2 is
+compared with horizon**2, so there is no sqrt.
+
+Below DEEP_STEP_SIZE doubles run out of precision and the pixels are iterated in
+fixed point with fp_numpy instead, the same arithmetic as the tfm kernel.
+'''
+
+from copy import copy
+import fp_numpy
+from MandelbrotParams import MandelbrotParams
+import numpy as np
+
+
+COMPACT_INTERVAL = 16  # iterations between compactions of the active set
+DEEP_STEP_SIZE = 2e-12  # same as the limit of the fp64 kernel in MandelbrotFuncs.PRECISION_TIERS
+ITER_INTERIOR = fp_numpy.ITER_INTERIOR  # count of a pixel known to be inside, see mandelbrot_common.cl
+PERIOD_TOLERANCE = 1e-14  # periodicity check, like mandelbrot_kernel_fp64.cl
+
+def colorize_counts(counts, params: MandelbrotParams, maxiter=None):
+    '''
+    rgb for an iteration count array, like the colorize kernel
+    returns shape=counts.shape + (3,) dtype=np.uint8
+    '''
+    if maxiter is None:
+        maxiter = params.maxiter
+    # lookup table with one extra black entry for the inside
+    lut = np.zeros((maxiter + 1, 3), dtype=np.uint8)
+    lut[:maxiter] = params.iter_to_color(maxiter)
+    index = np.where(counts < 0, -counts, maxiter)
+    np.minimum(index, maxiter, out=index)
+    return lut[index]
+
+def iterate_active(counts, z_real, z_imag, c_real, c_imag, maxiter, horizon_squared):
+    '''
+    iterate the compacted pixels in place until each escapes or reaches maxiter.
+    all arrays are 1d and the same length. counts are the iterations done so far (>= 0)
+    on return counts are -n for pixels that escaped after n iterations, n (== maxiter)
+    for the ones still inside, and z_real, z_imag hold z for the ones still inside.
+    pixels found to be periodic, as in the kernels (mandelbrot_common.cl), get ITER_INTERIOR
+    returns nothing, the inputs are updated
+    '''
+    size = len(counts)
+    # work on copies that shrink as pixels drop out. pos maps them back to the inputs
+    pos = np.arange(size)
+    n = counts.copy()
+    zr = z_real.copy()
+    zi = z_imag.copy()
+    cr = c_real.copy()
+    ci = c_imag.copy()
+    # periodicity check: the saved point of every orbit, saved again after 1, 2, 4... steps
+    sr = z_real.copy()
+    si = z_imag.copy()
+    periodic = np.zeros(size, dtype=np.bool_)
+    steps, window = 0, 1
+    # scratch, preallocated once. views of the first live entries are used
+    zr2 = np.empty(size, dtype=np.float64)
+    zi2 = np.empty(size, dtype=np.float64)
+    magnitude = np.empty(size, dtype=np.float64)
+    inside = np.empty(size, dtype=np.bool_)
+    distance = np.empty(size, dtype=np.float64)
+    near = np.empty(size, dtype=np.bool_)
+    live = size
+    with np.errstate(over='ignore', invalid='ignore'):
+        while live:
+            # every pixel can take this many steps without passing maxiter
+            chunk = min(COMPACT_INTERVAL, int(maxiter - n[:live].max()))
+            _zr, _zi, _cr, _ci, _n = zr[:live], zi[:live], cr[:live], ci[:live], n[:live]
+            _zr2, _zi2, _mag, _inside = zr2[:live], zi2[:live], magnitude[:live], inside[:live]
+            _sr, _si, _periodic, _dist, _near = sr[:live], si[:live], periodic[:live], distance[:live], near[:live]
+            for _ in range(chunk):
+                np.multiply(_zr, _zr, out=_zr2)
+                np.multiply(_zi, _zi, out=_zi2)
+                # nan (from inf - inf) compares false, so escaped pixels stay escaped
+                np.add(_zr2, _zi2, out=_mag)
+                np.less_equal(_mag, horizon_squared, out=_inside)
+                _n += _inside
+                # z_imag = 2 * z_real * z_imag + c_imag
+                np.multiply(_zr, _zi, out=_zi)
+                _zi *= 2.0
+                _zi += _ci
+                # z_real = z_real**2 - z_imag**2 + c_real
+                np.subtract(_zr2, _zi2, out=_zr)
+                _zr += _cr
+                # |z_real - saved_real| < tolerance and |z_imag - saved_imag| < tolerance,
+                # only for pixels still counting
+                np.subtract(_zr, _sr, out=_dist)
+                np.abs(_dist, out=_dist)
+                np.less(_dist, PERIOD_TOLERANCE, out=_near)
+                _near &= _inside
+                np.subtract(_zi, _si, out=_dist)
+                np.abs(_dist, out=_dist)
+                _near &= _dist < PERIOD_TOLERANCE
+                _periodic |= _near
+                steps += 1
+                if steps == window:
+                    _sr[:] = _zr
+                    _si[:] = _zi
+                    steps = 0
+                    window *= 2
+            # escaped pixels stopped counting at the first check they failed. the ones
+            # that passed every check have z_n and count n, like the kernels
+            np.multiply(_zr, _zr, out=_zr2)
+            np.multiply(_zi, _zi, out=_zi2)
+            np.add(_zr2, _zi2, out=_mag)
+            np.less_equal(_mag, horizon_squared, out=_inside)
+            # a periodic pixel is inside, whatever it did in the rest of the chunk
+            escaped = ~_inside & (_n < maxiter) & ~_periodic
+            done = escaped | (_n >= maxiter) | _periodic
+            if done.any():
+                done_pos = pos[:live][done]
+                counts[done_pos] = np.where(_periodic[done], ITER_INTERIOR,
+                                            np.where(escaped[done], -_n[done], _n[done]))
+                finished = done & ~escaped & ~_periodic
+                z_real[pos[:live][finished]] = _zr[finished]
+                z_imag[pos[:live][finished]] = _zi[finished]
+                keep = ~done
+                live_next = int(keep.sum())
+                for a in (pos, n, zr, zi, cr, ci, sr, si, periodic):
+                    a[:live_next] = a[:live][keep]
+                live = live_next
+
+def in_interior(c_real, c_imag):
+    '''
+    True where c is inside the main cardioid or the period-2 bulb, so never escapes
+    '''
+    x = c_real - 0.25
+    y2 = c_imag * c_imag
+    q = x * x + y2
+    return (4.0 * q * (q + x) <= y2) | ((c_real + 1.0) ** 2 + y2 <= 0.0625)
+
+def precision_for(step_size):
+    '''
+    'fp64' (float64 z) or 'tfm' (fixed point z, see fp_numpy)
+    '''
+    return 'tfm' if step_size < DEEP_STEP_SIZE else 'fp64'
+
+def zeros_z(precision, shape):
+    '''
+    z_real or z_imag of shape pixels: float64, or 3 uint32 planes like the tfm kernel's state
+    '''
+    if precision == 'tfm':
+        return np.zeros((fp_numpy.STATE_DIGITS,) + tuple(shape), dtype=np.uint32)
+    return np.zeros(shape, dtype=np.float64)
+
+def pixel_c_fixed(frame: MandelbrotParams, xs, ys):
+    '''
+    c of the pixels (xs, ys) of frame in fp_numpy fixed point, (c_real, c_imag).
+    c = step_size * x + xmin, like the tfm kernel
+    '''
+    step_size = (frame.xmax - frame.xmin) / frame.width
+    xs, ys = np.atleast_1d(xs), np.atleast_1d(ys)
+    step = fp_numpy.from_double(np.full(len(xs), step_size))
+    c_real = fp_numpy.add(fp_numpy.mul_d(step, xs), fp_numpy.from_double(np.full(len(xs), frame.xmin)))
+    c_imag = fp_numpy.add(fp_numpy.mul_d(step, ys), fp_numpy.from_double(np.full(len(xs), frame.ymin)))
+    return c_real, c_imag
+
+def iterate_pixels(precision, frame: MandelbrotParams, xs, ys, counts, z_real, z_imag, maxiter, horizon):
+    '''
+    iterate the pixels (xs, ys) of frame, in place. z_real and z_imag are in the format of
+    zeros_z, with the pixels along the last axis. see iterate_active
+    pixels that haven't started and are inside the main cardioid or the period-2 bulb
+    get ITER_INTERIOR instead
+    '''
+    step_size = (frame.xmax - frame.xmin) / frame.width
+    if precision == 'tfm':
+        c_real, c_imag = pixel_c_fixed(frame, xs, ys)
+        interior = fp_numpy.in_interior(c_real, c_imag)
+    else:
+        c_real = step_size * xs + frame.xmin
+        c_imag = step_size * ys + frame.ymin
+        interior = in_interior(c_real, c_imag)
+    interior &= counts == 0
+    counts[interior] = ITER_INTERIOR
+    active = np.nonzero(~interior)[0]
+    n = counts[active]
+    if precision == 'tfm':
+        zr = fp_numpy.from_state_planes(z_real[..., active])
+        zi = fp_numpy.from_state_planes(z_imag[..., active])
+        fp_numpy.iterate_active(n, zr, zi, c_real.take(active), c_imag.take(active), maxiter, horizon * horizon,
+                                fp_numpy.period_tolerance(step_size))
+        z_real[..., active] = fp_numpy.to_state_planes(zr)
+        z_imag[..., active] = fp_numpy.to_state_planes(zi)
+    else:
+        zr, zi = z_real[active], z_imag[active]
+        iterate_active(n, zr, zi, c_real[active], c_imag[active], maxiter, horizon * horizon)
+        z_real[active] = zr
+        z_imag[active] = zi
+    counts[active] = n
+
+def render_counts(params: MandelbrotParams, horizon=2.0):
+    '''
+    iteration counts of params (a frame or a tile) from scratch, with no saved state.
+    the pixel positions are the frame's, so tiles match a whole-frame render
+    returns shape=(params.height, params.width) dtype=np.int32, kernel orientation (row 0 is ymin)
+    '''
+    frame = params.get_frame()
+    precision = precision_for(frame.step_size())
+    ys, xs = np.indices((params.height, params.width)).reshape(2, -1)
+    xs += params.frame_x
+    ys += params.frame_y
+    counts = np.zeros(len(xs), dtype=np.int32)
+    z_real = zeros_z(precision, (len(xs),))
+    z_imag = zeros_z(precision, (len(xs),))
+    iterate_pixels(precision, frame, xs, ys, counts, z_real, z_imag, params.maxiter, horizon)
+    return counts.reshape(params.height, params.width)
+
+class CpuIterState:
+    '''
+    host iteration state of one frame, like IterState and the device state planes
+    counts: shape=(height, width) dtype=np.int32, kernel orientation (row 0 is ymin)
+    z_real, z_imag: see zeros_z. precision is the format, 'fp64' or 'tfm'
+    '''
+    maxiter = 0  # largest maxiter iterated to so far
+    def __init__(self, params, precision):
+        self.params = copy(params)
+        self.precision = precision
+        shape = (params.height, params.width)
+        self.counts = np.zeros(shape, dtype=np.int32)
+        self.z_real = zeros_z(precision, shape)
+        self.z_imag = zeros_z(precision, shape)
+
+    def matches(self, params):
+        p = self.params
+        return p.xmin == params.xmin and p.xmax == params.xmax and p.ymin == params.ymin \
+            and p.width == params.width and p.height == params.height
+
+    def shift(self, params, offset):
+        '''
+        the new frame's pixel (x, y) is the old frame's pixel (x + offset[0], y + offset[1])
+        keep the overlap, clear the rest
+        '''
+        xoffset, yoffset = offset
+        xn, yn = params.width, params.height
+        # destination and source slices of the overlap
+        dx, sx = slice(max(0, -xoffset), min(xn, xn - xoffset)), slice(max(0, xoffset), min(xn, xn + xoffset))
+        dy, sy = slice(max(0, -yoffset), min(yn, yn - yoffset)), slice(max(0, yoffset), min(yn, yn + yoffset))
+        for name in ('counts', 'z_real', 'z_imag'):
+            old = getattr(self, name)
+            new = np.zeros_like(old)
+            new[..., dy, dx] = old[..., sy, sx]
+            setattr(self, name, new)
+        self.params = copy(params)
+
+class CpuBackend:
+    '''
+    host replacement for the OpenCL path of MandelbrotFuncs
+    '''
+    iter_state = None
+
+    def restore_iter_state(self, frame: MandelbrotParams, precision):
+        iter_state = self.iter_state
+        if iter_state is not None and iter_state.precision != precision:
+            iter_state = None
+        if iter_state is not None and not iter_state.matches(frame):
+            offset = frame.grid_offset(iter_state.params)
+            if offset is not None:
+                print(f'CpuBackend: shift_iter_state: offset: {offset}')
+                iter_state.shift(frame, offset)
+        if iter_state is None or not iter_state.matches(frame):
+            print('CpuBackend: iter_state initialized')
+            self.iter_state = CpuIterState(frame, precision)
+        return self.iter_state
+
+    def mandelbrot_set(self, params: MandelbrotParams, horizon=2.0, output='rgb', mask=None):
+        '''
+        see MandelbrotFuncs.mandelbrot_set_opencl
+        mask: only iterate the pixels of the tile where it is set. shape=(frame.height, frame.width),
+        kernel orientation. see MandelbrotFuncs.mandelbrot_set_subdivided
+        '''
+        frame = params.get_frame()
+        maxiter = params.maxiter
+        step_size = (frame.xmax - frame.xmin) / frame.width
+        precision = precision_for(step_size)
+        iter_state = self.restore_iter_state(frame, precision)
+        x0, y0, xn, yn = params.frame_x, params.frame_y, params.width, params.height
+        tile_counts = iter_state.counts[y0:y0 + yn, x0:x0 + xn]
+        todo = (tile_counts >= 0) & (tile_counts < maxiter)
+        if mask is not None:
+            todo &= mask[y0:y0 + yn, x0:x0 + xn]
+        ys, xs = np.nonzero(todo)
+        print(f'CpuBackend.mandelbrot_set: {precision}  maxiter: {maxiter}  step_size: {step_size:.8g}  '
+              f'active: {len(xs)}')
+        if len(xs):
+            ys += y0
+            xs += x0
+            counts = iter_state.counts[ys, xs]
+            z_real = iter_state.z_real[..., ys, xs]
+            z_imag = iter_state.z_imag[..., ys, xs]
+            iterate_pixels(precision, frame, xs, ys, counts, z_real, z_imag, maxiter, horizon)
+            iter_state.counts[ys, xs] = counts
+            iter_state.z_real[..., ys, xs] = z_real
+            iter_state.z_imag[..., ys, xs] = z_imag
+        iter_state.maxiter = max(iter_state.maxiter, maxiter)
+        return self.tile_output(params, output)
+
+    def fill_counts(self, params: MandelbrotParams, fill, filled, output='rgb'):
+        '''
+        set the counts of the pixels where filled is set to fill, like MandelbrotFuncs.mandelbrot_set_subdivided.
+        returns the tile like mandelbrot_set
+        '''
+        self.iter_state.counts[filled] = fill[filled]
+        return self.tile_output(params, output)
+
+    def tile_output(self, params: MandelbrotParams, output):
+        x0, y0, xn, yn = params.frame_x, params.frame_y, params.width, params.height
+        # top row first, like the device image
+        tile_counts = self.iter_state.counts[y0:y0 + yn, x0:x0 + xn][::-1]
+        if output == 'counts':
+            return tile_counts.copy()
+        return colorize_counts(tile_counts, params, params.maxiter)
+
+    def recolor(self, params: MandelbrotParams):
+        '''
+        see MandelbrotFuncs.recolor_opencl
+        '''
+        frame = params.get_frame()
+        iter_state = self.iter_state
+        if iter_state is None or not iter_state.matches(frame) or not iter_state.maxiter:
+            return None
+        return colorize_counts(iter_state.counts[::-1], params, iter_state.maxiter)
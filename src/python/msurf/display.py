@@ -3,19 +3,31 @@ export PYOPENCL_CTX=':1'
 '''
 
 from copy import copy
+from cpu_backend import pixel_c_fixed, precision_for
 import cv2
 from decimal import Decimal
+import fp_numpy
 import itertools
 from MandelbrotFuncs import MandelbrotFuncs
 from MandelbrotParams import MandelbrotParams
-import math
 import numpy as np
+from orbit import Orbits
+from orbit_analysis import find_cycle
 from PIL import Image, ImageTk
+from render_worker import RenderWorker
 from scipy.ndimage import label, find_objects
 import tkinter as tk
 from tkinter import filedialog, simpledialog
+from tile_scheduler import TileScheduler
 
 CLEAR_EVENT = 'CLEAR_EVENT'
+POLL_MS = 20  # how often finished tiles are collected from the render thread
+ORBIT_LINES = 1000  # orbit steps drawn ahead of the current point
+# longest orbit searched for a cycle, by precision. tfm orbits are much slower to compute
+ORBIT_ANALYSIS_STEPS = {'fp64': 1 << 22, 'tfm': 1 << 11}
+# orbit steps computed per step of the cycle search, a few tens of ms each. see CurPointState.analyze_step
+ANALYSIS_CHUNK = {'fp64': 1 << 16, 'tfm': 64}
+ANALYSIS_MS = 1  # between steps of the cycle search, so Tk gets to handle events
 
 def rgb_to_hex(rgb):
     """
@@ -38,21 +50,28 @@ class CurPointState:
 
     orig is the starting point
     steps is the number of iterations since the starting point
-    history is a pre-calculated list of iteration positions
+    orbit holds the iteration positions, computed as far as they are looked at (see orbit.py)
+    precision is 'fp64' or 'tfm', see cpu_backend.precision_for. with 'tfm' pass the
+    seed as fixed_seed too, (c_real, c_imag) from cpu_backend.pixel_c_fixed
 
-    escape_count is length(history) and is the number of iterations
-    before abs(z) > 2.0 -- or maxiter if it doesn't escape
+    escape_count is the number of iterations before abs(z) > 2.0 -- or maxiter
+    if it doesn't escape. None until the orbit has been computed that far
     '''
     orig = 0 + 0j
     steps = 0
-    history = None
-    escape_count = None  # cache for calc_escape
+    orbit = None
+    cycle = None  # see analyze_step()
+    analyzed = 0  # orbit steps searched for a cycle
+    analysis_done = False
+    analysis_length = 0  # orbit steps the next search covers
     maxiter = 256
-    def __init__(self, xpos, ypos, maxiter=256):
+    def __init__(self, xpos, ypos, maxiter=256, precision='fp64', fixed_seed=None):
         self.orig = xpos + ypos * 1j
         self.maxiter = maxiter
-        self.history = []
-        self._calc_escape()
+        self.orbit = Orbits([self.orig], maxiter, precision, fixed_seeds=fixed_seed)
+        # the rest of the orbit is computed as it is stepped through, or searched for a cycle
+        self.orbit.compute(ORBIT_LINES)
+        self.analysis_length = min(ORBIT_LINES, self.analysis_limit())
 
     def go_left(self):
         '''
@@ -65,34 +84,60 @@ class CurPointState:
         '''
         calc next iter
         '''
-        if self.steps < self.escape_count:
+        if self.orbit.has(0, self.steps + 1):
             self.steps += 1
 
     def z(self):
-        return self.history[self.steps]
+        return self.orbit.history[0, self.steps]
 
     def next_n(self, offset, n):
-        return self.history[self.steps + offset:self.steps + offset + n]
+        return self.orbit.window(0, self.steps + offset, n)
 
-    def _calc_escape(self):
+    @property
+    def escape_count(self):
+        return self.orbit.escape_count(0)
+
+    def analysis_limit(self):
+        return min(self.maxiter + 1, ORBIT_ANALYSIS_STEPS[self.orbit.precision])
+
+    def analyze_step(self):
         '''
-        return number of reps for escape (limited by maxiter)
+        one step of the search for the cycle the orbit converges to (orbit_analysis.find_cycle):
+        compute up to ANALYSIS_CHUNK more of the orbit, and search it each time it reaches the
+        next of the doubling lengths up to ORBIT_ANALYSIS_STEPS, so an early cycle doesn't compute
+        the whole orbit. returns true once the search is over. self.cycle is the result, None
+        if the orbit escapes or has none
         '''
-        self.escape_count = 0
-        c = self.orig
-        z = c
-        self.history.append(z)
-        for i in range(self.maxiter):
-            z = z * z + c
-            if abs(z) > 2.0:
-                break
-            self.history.append(z)
-            self.escape_count += 1
+        if self.analysis_done:
+            return True
+        computed = self.orbit.computed()
+        if computed < self.analysis_length:
+            self.orbit.compute(min(computed + ANALYSIS_CHUNK[self.orbit.precision], self.analysis_length))
+            if self.orbit.computed() < self.analysis_length:
+                return False
+        orbit = self.orbit.window(0, 0, self.analysis_length)
+        self.analyzed = len(orbit)
+        self.cycle = find_cycle(orbit)
+        limit = self.analysis_limit()
+        if self.cycle is not None or len(orbit) < self.analysis_length or self.analysis_length == limit:
+            self.analysis_done = True
+        else:
+            self.analysis_length = min(2 * self.analysis_length, limit)
+        return self.analysis_done
 
     def message(self):
         s = 'steps: ' + str(self.steps)
-        s += '  escape: ' + str(self.escape_count)
+        if self.escape_count is None:
+            s += '  escape: >' + str(self.orbit.lengths[0] - 1)
+        else:
+            s += '  escape: ' + str(self.escape_count)
         s += '  cur: (' + str(self.z().real) + ', ' + str(self.z().imag) + ')'
+        if self.cycle is not None:
+            s += '  ' + str(self.cycle)
+        elif not self.analysis_done:
+            s += '  looking for a cycle'
+        elif not self.orbit.escaped[0]:
+            s += '  no cycle in ' + str(self.analyzed)
         return s
 
 class ImageProcessor:
@@ -359,6 +404,10 @@ class RGBInputDialog(tk.Toplevel):
 
 
 class InteractiveImageDisplay:
+    # config
+    # the keyboard zoom factor. a power of two (2.0) lets MandelbrotFuncs reuse the pixels
+    # already computed (MandelbrotParams.zoom_grid), other factors recompute the frame
+    zoom_step = 1.25
     # state
     width = None
     height = None
@@ -369,6 +418,7 @@ class InteractiveImageDisplay:
     cur_point_state = None
     cur_point_rect = None
     cur_point_lines = None
+    analyzing = False  # analyze_cur_point is scheduled
     # resize state
     _is_resizing = None
     _master_dims_vs_image_dims = None
@@ -392,7 +442,11 @@ class InteractiveImageDisplay:
         self.master = master
         self.width = width
         self.height = height
-        self.mandelbrot_funcs = MandelbrotFuncs()
+        self.mandelbrot_funcs = MandelbrotFuncs(use_render_cache=True)
+        self.tile_scheduler = TileScheduler()
+        # tiles are rendered off the Tk thread. see display_tiles
+        self.render_worker = RenderWorker(self.mandelbrot_funcs)
+        self.polling = False
 
         # Create canvas
         self.canvas = tk.Canvas(master, width=width, height=height)
@@ -410,6 +464,11 @@ class InteractiveImageDisplay:
         self.canvas.bind("<ButtonPress-1>", self.on_button_press)
         self.canvas.bind("<B1-Motion>", self.on_move_press)
         self.canvas.bind("<ButtonRelease-1>", self.on_button_release)
+        # drag with the right button (button 2 on Mac) to pan
+        self.canvas.bind("<ButtonPress-2>", self.on_pan_press)
+        self.canvas.bind("<ButtonRelease-2>", self.on_pan_release)
+        # render the tiles under the cursor first
+        self.canvas.bind("<Motion>", self.on_motion)
 
         # Bind key events
         self.master.bind('<Command-r>', self.key_handler)
@@ -440,6 +499,10 @@ class InteractiveImageDisplay:
         button = tk.Button(self.button_frame, text="Set Max Iterations", command=self.set_maxiter_dialog)
         button.pack(side=tk.LEFT)
 
+        # Mariani-Silver subdivision on/off, see MandelbrotFuncs.mandelbrot_set_subdivided
+        self.subdivide_button = tk.Button(self.button_frame, text="Subdivide: off", command=self.toggle_subdivision)
+        self.subdivide_button.pack(side=tk.LEFT, padx=(5, 0))
+
         # Add a button to draw bounding box around largest black region
         button = tk.Button(self.button_frame, text="Draw Bounding Box", command=self.toggle_draw_bounding_box)
         button.pack(side=tk.LEFT)
@@ -490,17 +553,11 @@ class InteractiveImageDisplay:
             # this will be run on the first reload_image() and after set_width_height() is called
             self.image = Image.new('RGB', (self.width, self.height), (50,50,50))  # ~grey
             self.photo = ImageTk.PhotoImage(self.image)
+            self.canvas.config(width=self.width, height=self.height)
             self.image_on_canvas = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
         # Generate, normalize and convert to image
-        # assume ~10M calculations per second
-        # set tile_size to max of one second per tile
-        time_limit = 1.0  # sec
-        operations_per_second = 10000000
-        pixels_per_second = (time_limit * operations_per_second) / self.params.maxiter
-        tile_size = int(math.sqrt(pixels_per_second))
-        tile_size = 10000
-        gen = self.params.tile_iter(tile_size)
-        self.generate_and_display_tiles(gen)
+        # a coarse preview is shown first, see MandelbrotParams.preview_iter
+        self.submit_render(preview=True)
         # Update status text position
         self.canvas.coords(self.status_text, self.width - 10, self.height - 10)
         self.canvas.tag_raise(self.status_text)
@@ -512,25 +569,50 @@ class InteractiveImageDisplay:
         #print(f'reload_image(): master after complete: {self.master.winfo_width()} {self.master.winfo_height()}')
         #print(f'reload_image: _master_dims_vs_image_dims: {self._master_dims_vs_image_dims}')
 
-    def generate_and_display_tiles(self, tile_iter):
-        try:
-            x, y, tile_params, tile_width, tile_height = next(tile_iter)
-            tile_array = self.mandelbrot_funcs.mandelbrot_set_opencl(tile_params)
+    def submit_render(self, preview=False):
+        '''
+        render self.params on the render thread, instead of whatever it is doing
+        '''
+        # tile sizes come from the measured render time, see tile_scheduler
+        # the copy keeps the render from seeing later zooms and recolors. they start a new generation
+        gen = self.tile_scheduler.tiles(copy(self.params), preview=preview)
+        self.render_worker.submit(gen, self.tile_scheduler.record)
+        if not self.polling:
+            self.polling = True
+            self.display_tiles()
+
+    def display_tiles(self):
+        '''
+        paste the tiles the render thread has finished. reschedules itself until the
+        current render is done
+        '''
+        busy = self.render_worker.busy()  # before poll(), so the last tiles aren't missed
+        tiles = self.render_worker.poll()
+        for x, y, tile_params, tile_array, tile_width, tile_height in tiles:
             tile_image = Image.fromarray(tile_array, 'RGB')
             image_x = x
             image_y = (self.height - y - tile_height)
             print(f'size: ({self.width}, {self.height})  image pos: ({image_x}, {image_y})  tile: {tile_params.get_params()}')
             # PIL.Image.paste. box is a 2-tuple giving upper left
             self.image.paste(tile_image, (image_x, image_y))
-            # draw image
-            self.photo = ImageTk.PhotoImage(self.image)
-            self.canvas.config(width=self.width, height=self.height)
-            self.canvas.itemconfig(self.image_on_canvas, image=self.photo)
-            self.canvas.update_idletasks()  # Force an update to show the tile immediately
-            self.master.after(10, self.generate_and_display_tiles, tile_iter)
-        except StopIteration:
-            pass
+            self.blit(tile_image, image_x, image_y)
+        if busy:
+            self.master.after(POLL_MS, self.display_tiles)
+        else:
+            self.polling = False
 
+    def blit(self, tile_image, image_x, image_y):
+        '''
+        draw a tile into the PhotoImage on the canvas, which stays the same object.
+        only the tile's pixels are converted and copied, not the frame's
+        '''
+        tile_photo = ImageTk.PhotoImage(tile_image)
+        # tk photo copy: https://www.tcl.tk/man/tcl8.6/TkCmd/photo.htm#M17
+        self.photo.tk.call(str(self.photo), 'copy', str(tile_photo), '-to', image_x, image_y)
+
+    def on_motion(self, event):
+        # the scheduler is in kernel orientation, row 0 at the bottom
+        self.tile_scheduler.set_focus(event.x, self.height - 1 - event.y)
 
     def on_resize(self, event):
         #print(f'on_resize({event})')
@@ -567,6 +649,8 @@ class InteractiveImageDisplay:
         self.params.width = width
         self.params.height = height
         self.params.zoom_by_bbox(0, width, 0, height)  # reset complex plane bbox
+        # tiles in flight are for the old size
+        self.render_worker.cancel()
         # clear these so they will be recreated in reload_image()
         self.image = None
         self.photo = None
@@ -602,7 +686,16 @@ class InteractiveImageDisplay:
             # clear current rect
             self.canvas.delete(self.rect)
             xpos, ypos = self.params.image_to_complex(x1, y1)
-            self.cur_point_state = CurPointState(xpos, ypos, maxiter=self.params.maxiter)
+            step_size = (self.params.xmax - self.params.xmin) / self.params.width
+            precision = precision_for(step_size)
+            fixed_seed = None
+            if precision == 'tfm':
+                # neighbouring pixels round to the same float64 c this deep. place the pixel
+                # in fixed point like the tfm kernel, kernel rows count up from ymin
+                fixed_seed = pixel_c_fixed(self.params, int(x1), self.params.height - 1 - int(y1))
+                xpos, ypos = (float(fp_numpy.to_double(c)[0]) for c in fixed_seed)
+            self.cur_point_state = CurPointState(xpos, ypos, maxiter=self.params.maxiter,
+                                                 precision=precision, fixed_seed=fixed_seed)
             self.show_cur_point()
             return
 
@@ -622,6 +715,18 @@ class InteractiveImageDisplay:
         # Update the rectangle's coordinates
         self.canvas.coords(self.rect, self.start_x, self.start_y, current_x, current_y)
 
+    def on_pan_press(self, event):
+        """Start of a pan"""
+        self.pan_start = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+
+    def on_pan_release(self, event):
+        """End of a pan. Move the view by whole pixels so the old render can be reused"""
+        dx = int(self.pan_start[0] - self.canvas.canvasx(event.x))
+        dy = int(self.pan_start[1] - self.canvas.canvasy(event.y))
+        if dx or dy:
+            self.params.pan(dx, dy)
+            self.reload_image()
+
     def key_handler(self, event):
         """
         Handle key press events. This method is designed to be overridden
@@ -653,16 +758,15 @@ class InteractiveImageDisplay:
             self.cur_point_state.go_left()
             self.show_cur_point()
         elif event.keysym == 'equal':  # !!! also check Command bitmask
-            self.params.zoom(0.80)
+            self.params.zoom(1.0 / self.zoom_step)
             self.reload_image()
         elif event.keysym == 'minus':
-            self.params.zoom(1.25)
+            self.params.zoom(self.zoom_step)
             self.reload_image()
 
     def show_cur_point(self):
         z = self.cur_point_state.z()
         x, y = self.params.complex_to_image(z.real, z.imag)
-        orig_x, orig_y = x, y
         message = self.cur_point_state.message()
         out_of_bounds = False
         # print(f'iter_cur_point: orig=({z})  new=({x}, {y})')
@@ -679,12 +783,15 @@ class InteractiveImageDisplay:
                 self.canvas.delete(line)
         else:
             self.cur_point_lines = []
-        loop_len = 0
-        DIST_MAX = 0.0
         increment = 255.0/self.params.maxiter
         r = g = 255
         b = 0
-        for point2 in self.cur_point_state.next_n(1, self.params.maxiter):
+        num_lines = min(self.params.maxiter, ORBIT_LINES)
+        cycle = self.cur_point_state.cycle
+        if cycle is not None:
+            # once around the cycle is enough
+            num_lines = min(num_lines, max(cycle.start - self.cur_point_state.steps, 0) + cycle.period)
+        for point2 in self.cur_point_state.next_n(1, num_lines):
             if out_of_bounds:
                 break;
             x2, y2 = self.params.complex_to_image(point2.real, point2.imag)
@@ -694,11 +801,6 @@ class InteractiveImageDisplay:
             else:
                 line = self.canvas.create_line(x, y, x2, y2, fill=rgb_to_hex((r,g,b)))
                 self.cur_point_lines.append(line)
-            loop_len += 1
-            dist_to_orig = math.sqrt((x2 - orig_x)**2 + (y2 - orig_y))
-            if dist_to_orig < DIST_MAX:
-                message = f'Loop : {loop_len}  dist_to_orig: {dist_to_orig:.4f} ' + message
-                break
             r = max(r - increment, 30)
             g = r
             b = min(b + increment, 255)
@@ -706,6 +808,24 @@ class InteractiveImageDisplay:
 
 
         self.update_status(message)
+        if not self.cur_point_state.analysis_done and not self.analyzing:
+            self.analyzing = True
+            self.master.after(ANALYSIS_MS, self.analyze_cur_point)
+
+    def analyze_cur_point(self):
+        '''
+        one step of the cycle search of the current point (CurPointState.analyze_step), then the
+        next from master.after until it is over, so a long orbit doesn't block Tk. the orbit
+        and the status are redrawn with the result
+        '''
+        state = self.cur_point_state
+        if state is None:
+            self.analyzing = False
+        elif state.analyze_step():
+            self.analyzing = False
+            self.show_cur_point()
+        else:
+            self.master.after(ANALYSIS_MS, self.analyze_cur_point)
 
     def set_maxiter_dialog(self):
         """
@@ -784,6 +904,16 @@ class InteractiveImageDisplay:
         self.debug_points = []
 
 
+    def toggle_subdivision(self):
+        '''
+        switch the render mode between every pixel and subdivision, and render again
+        '''
+        with self.render_worker.lock:
+            funcs = self.mandelbrot_funcs
+            funcs.use_subdivision = not funcs.use_subdivision
+        self.subdivide_button.config(text='Subdivide: ' + ('on' if funcs.use_subdivision else 'off'))
+        self.reload_image()
+
     def toggle_draw_bounding_box(self, event=None):
         self.clear_debug_points()
         if event != CLEAR_EVENT and self.black_bounding_box_axis_line is None:
@@ -825,7 +955,30 @@ class InteractiveImageDisplay:
         print(f'set_param_palette({r}, {g}, {b})')
         self.toggle_rgb_dialog()
         self.params.set_palette(r,g,b)
-        self.reload_image()
+        self.recolor_image()
+
+    def recolor_image(self):
+        '''
+        repaint with the current palette from the iteration counts already computed.
+        falls back to reload_image() if there is nothing to recolor
+        a render in flight has the old palette: it is cancelled, its finished tiles are
+        in the counts, and the rest is submitted again with the new palette
+        '''
+        rendering = self.render_worker.busy()
+        self.render_worker.cancel()  # drops the tiles not pasted yet, they have the old palette
+        with self.render_worker.lock:
+            image_array = self.mandelbrot_funcs.recolor_opencl(self.params)
+        if image_array is None or self.image is None:
+            self.reload_image()
+            return
+        self.image = Image.fromarray(image_array, 'RGB')
+        self.photo.paste(self.image)  # the whole frame changed, same size
+        if rendering:
+            self.submit_render()
+        if self.showing_palette:
+            # redraw the palette window with the new colors
+            self.toggle_color_palette()
+            self.toggle_color_palette()
 
     def save_bookmark(self):
         bookmark_string = self.params.bookmark_string()
@@ -0,0 +1,347 @@
+'''
+Vectorized fixed point in the fp_int format of src/c/tfm_opencl.c, on NumPy arrays.
+
+A value is sign and magnitude. The magnitude is an integer in 32 bit digits
+(dp[0] lowest), scaled by 2**FP_SCALE_BITS: value = magnitude / 2**64. The
+functions follow the C ones digit for digit, so a grid of pixels iterated here
+gives the same bits as mandelbrot_kernel_tfm.cl:
+
+- add, sub, mul_d and mul_2d are exact
+- mul_scaled and sqr_scaled keep the lowest FP_SIZE - 1 digits of the product
+  (like fp_mul's pa limit) and drop the low FP_SCALE_SHIFT_FP_DIGITS (fp_rshd),
+  truncating the magnitude
+- zero is never negative (fp_clamp)
+
+Conversions match double_to_fp_int_array (hi, lo) and the state planes read by
+unpack_iter_state. See iterate_active for the CPU deep zoom loop.
+'''
+
+import numpy as np
+
+
+DIGIT_BIT = 32
+FP_SIZE = 6  # digits in an fp_int
+FP_SCALE_BITS = 64
+FP_SCALE_SHIFT_FP_DIGITS = FP_SCALE_BITS // DIGIT_BIT
+STATE_DIGITS = 3  # digits kept in the iteration state planes, and used by default
+STATE_SIGN_BIT = 0x80000000  # sign in the top bit of dp[2] in the state and hi
+ITER_INTERIOR = 0x7FFFFFFF  # count of a pixel known to be inside, see mandelbrot_common.cl
+PERIOD_TOLERANCE = 2.0 ** -56  # largest periodicity check tolerance, see period_tolerance
+PERIOD_TOLERANCE_PIXELS = 2.0 ** -10  # periodicity check tolerance in pixels at deep zooms
+DIGIT_MASK = np.uint64(0xFFFFFFFF)
+SHIFT = np.uint64(DIGIT_BIT)
+
+class FpArray:
+    '''
+    an array of fixed point numbers
+    digits: shape=(ndigits,) + shape dtype=np.uint64, each digit < 2**32, dp[0] first
+    neg: shape=shape dtype=bool
+    '''
+    __slots__ = ('digits', 'neg')
+
+    def __init__(self, digits, neg):
+        self.digits = digits
+        # fp_clamp: zero is positive
+        self.neg = neg & digits.any(axis=0)
+
+    @property
+    def shape(self):
+        return self.neg.shape
+
+    def __len__(self):
+        return len(self.neg)
+
+    def take(self, index):
+        '''
+        FpArray of self[index], index is anything numpy indexing takes
+        '''
+        return FpArray(self.digits[:, index], self.neg[index])
+
+    def put(self, index, value):
+        '''
+        self[index] = value
+        '''
+        self.digits[:, index] = value.digits
+        self.neg[index] = value.neg
+
+    def copy(self):
+        return FpArray(self.digits.copy(), self.neg.copy())
+
+def zeros(shape, ndigits=STATE_DIGITS):
+    return FpArray(np.zeros((ndigits,) + tuple(np.atleast_1d(shape)), dtype=np.uint64),
+                   np.zeros(shape, dtype=np.bool_))
+
+def from_double(values, ndigits=STATE_DIGITS):
+    '''
+    exact conversion, truncating below 2**-64 like fp_from_double
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.floor(np.abs(values) * 2.0 ** FP_SCALE_BITS)
+    digits = np.empty((ndigits,) + values.shape, dtype=np.uint64)
+    # peel digits off the top. each step is exact: the remainder keeps the low bits of the mantissa
+    for i in range(ndigits - 1, -1, -1):
+        scale = 2.0 ** (DIGIT_BIT * i)
+        digit = np.floor(magnitude / scale)
+        magnitude -= digit * scale
+        digits[i] = digit.astype(np.uint64)
+    return FpArray(digits, values < 0)
+
+def to_double(x: FpArray):
+    '''
+    nearest double (apart from rounding in the sum)
+    '''
+    value = np.zeros(x.shape, dtype=np.float64)
+    for i in range(len(x.digits) - 1, -1, -1):
+        value += x.digits[i].astype(np.float64) * 2.0 ** (DIGIT_BIT * i - FP_SCALE_BITS)
+    return np.where(x.neg, -value, value)
+
+def from_hi_lo(hi, lo, ndigits=STATE_DIGITS):
+    '''
+    from double_to_fp_int_array's (hi, lo) uint64 pair, like fp_from_hi_lo in the tfm kernel
+    '''
+    hi = np.asarray(hi, dtype=np.uint64)
+    lo = np.asarray(lo, dtype=np.uint64)
+    digits = np.zeros((ndigits,) + np.broadcast(hi, lo).shape, dtype=np.uint64)
+    digits[0] = lo & DIGIT_MASK
+    digits[1] = lo >> SHIFT
+    digits[2] = hi & DIGIT_MASK
+    return FpArray(digits, (hi >> np.uint64(63)) != 0)
+
+def to_hi_lo(x: FpArray):
+    '''
+    (hi, lo) uint64 arrays, the encoding of double_to_fp_int_array
+    '''
+    hi = x.digits[2].copy()
+    hi[x.neg] |= np.uint64(1 << 63)
+    lo = (x.digits[1] << SHIFT) | x.digits[0]
+    return hi, lo
+
+def from_state_planes(planes):
+    '''
+    planes: the 3 uint32 planes of z_real or z_imag in the iteration state (dp[0..2])
+    '''
+    planes = np.asarray(planes, dtype=np.uint32)
+    digits = planes.astype(np.uint64)
+    digits[2] &= np.uint64(STATE_SIGN_BIT - 1)
+    return FpArray(digits, (planes[2] & STATE_SIGN_BIT) != 0)
+
+def to_state_planes(x: FpArray):
+    '''
+    3 uint32 planes, like store_state_fp. digits above dp[2] are dropped
+    '''
+    planes = x.digits[:STATE_DIGITS].astype(np.uint32)
+    planes[2][x.neg] |= np.uint32(STATE_SIGN_BIT)
+    return planes
+
+def _digit_count(a: FpArray, b: FpArray):
+    return max(len(a.digits), len(b.digits))
+
+def _widen(x: FpArray, ndigits):
+    if len(x.digits) >= ndigits:
+        return x.digits
+    pad = np.zeros((ndigits - len(x.digits),) + x.shape, dtype=np.uint64)
+    return np.concatenate([x.digits, pad])
+
+def cmp_mag(a: FpArray, b: FpArray):
+    '''
+    -1, 0 or 1 for |a| < |b|, |a| == |b|, |a| > |b|, like fp_cmp_mag
+    '''
+    ndigits = _digit_count(a, b)
+    da, db = _widen(a, ndigits), _widen(b, ndigits)
+    result = np.zeros(np.broadcast(a.neg, b.neg).shape, dtype=np.int8)
+    for i in range(ndigits - 1, -1, -1):
+        undecided = result == 0
+        result[undecided & (da[i] > db[i])] = 1
+        result[undecided & (da[i] < db[i])] = -1
+    return result
+
+def cmp(a: FpArray, b: FpArray):
+    '''
+    -1, 0 or 1 for a < b, a == b, a > b, like fp_cmp
+    '''
+    mag = cmp_mag(a, b)
+    return np.where(a.neg != b.neg, np.where(a.neg, -1, 1), np.where(a.neg, -mag, mag)).astype(np.int8)
+
+def _add_mag(da, db):
+    out = np.empty_like(da)
+    carry = np.zeros(da.shape[1:], dtype=np.uint64)
+    for i in range(len(da)):
+        t = da[i] + db[i] + carry
+        out[i] = t & DIGIT_MASK
+        carry = t >> SHIFT
+    return out
+
+def _sub_mag(da, db):
+    '''
+    da - db, da >= db
+    '''
+    out = np.empty_like(da)
+    borrow = np.zeros(da.shape[1:], dtype=np.uint64)
+    for i in range(len(da)):
+        t = (da[i] | np.uint64(1 << DIGIT_BIT)) - db[i] - borrow
+        out[i] = t & DIGIT_MASK
+        borrow = np.uint64(1) - (t >> SHIFT)
+    return out
+
+def add(a: FpArray, b: FpArray):
+    '''
+    a + b, like fp_add. the result has as many digits as the wider input
+    '''
+    ndigits = _digit_count(a, b)
+    da, db = _widen(a, ndigits), _widen(b, ndigits)
+    same_sign = a.neg == b.neg
+    a_bigger = cmp_mag(a, b) >= 0
+    big = np.where(a_bigger, da, db)
+    small = np.where(a_bigger, db, da)
+    digits = np.where(same_sign, _add_mag(da, db), _sub_mag(big, small))
+    # different signs: the sign of the bigger magnitude
+    neg = np.where(same_sign | a_bigger, a.neg, b.neg)
+    return FpArray(digits, neg)
+
+def negate(a: FpArray):
+    return FpArray(a.digits, ~a.neg)
+
+def sub(a: FpArray, b: FpArray):
+    '''
+    a - b, like fp_sub
+    '''
+    return add(a, negate(b))
+
+def mul_d(a: FpArray, d):
+    '''
+    a * d for a digit d (array or scalar, < 2**32), like fp_mul_d. the top carry is dropped
+    if a has no room for it
+    '''
+    d = np.asarray(d, dtype=np.uint64)
+    digits = np.empty(np.broadcast(a.digits, d).shape, dtype=np.uint64)
+    carry = np.uint64(0)
+    for i in range(len(a.digits)):
+        t = a.digits[i] * d + carry
+        digits[i] = t & DIGIT_MASK
+        carry = t >> SHIFT
+    return FpArray(digits, a.neg.copy())
+
+def mul_2d(a: FpArray, bits):
+    '''
+    a * 2**bits for 0 <= bits < 32, like fp_mul_2d
+    '''
+    bits = np.uint64(bits)
+    digits = np.empty_like(a.digits)
+    carry = np.uint64(0)
+    for i in range(len(a.digits)):
+        t = (a.digits[i] << bits) | carry
+        digits[i] = t & DIGIT_MASK
+        carry = t >> SHIFT
+    return FpArray(digits, a.neg.copy())
+
+def mul_scaled(a: FpArray, b: FpArray):
+    '''
+    a * b / 2**64, like fp_mul_scaled
+    '''
+    ndigits = _digit_count(a, b)
+    da, db = _widen(a, ndigits), _widen(b, ndigits)
+    # product columns, only the ones fp_mul keeps. each 64 bit partial product is split
+    # into its two digits so the column sums can't overflow
+    columns = min(2 * ndigits, FP_SIZE - 1)
+    acc = np.zeros((columns + 1,) + a.shape, dtype=np.uint64)
+    for i in range(ndigits):
+        for j in range(ndigits):
+            if i + j >= columns:
+                continue
+            p = da[i] * db[j]
+            acc[i + j] += p & DIGIT_MASK
+            acc[i + j + 1] += p >> SHIFT
+    carry = np.zeros(a.shape, dtype=np.uint64)
+    product = np.empty((columns,) + a.shape, dtype=np.uint64)
+    for k in range(columns):
+        t = acc[k] + carry
+        product[k] = t & DIGIT_MASK
+        carry = t >> SHIFT
+    # fp_rshd by FP_SCALE_SHIFT_FP_DIGITS, keeping ndigits digits
+    digits = np.zeros((ndigits,) + a.shape, dtype=np.uint64)
+    kept = product[FP_SCALE_SHIFT_FP_DIGITS:FP_SCALE_SHIFT_FP_DIGITS + ndigits]
+    digits[:len(kept)] = kept
+    return FpArray(digits, a.neg != b.neg)
+
+def sqr_scaled(a: FpArray):
+    '''
+    a * a / 2**64, like fp_sqr_scaled
+    '''
+    return mul_scaled(a, a)
+
+def in_interior(c_real: FpArray, c_imag: FpArray):
+    '''
+    True where c is inside the main cardioid or the period-2 bulb, like fp_in_interior
+    in the tfm kernel
+    '''
+    shape = c_real.shape
+    # cardioid: 4 * q * (q + x) <= y**2 with x = c_real - 1/4, q = x**2 + y**2
+    x = sub(c_real, from_double(np.full(shape, 0.25)))
+    y2 = sqr_scaled(c_imag)
+    q = add(sqr_scaled(x), y2)
+    cardioid = cmp(mul_2d(mul_scaled(q, add(q, x)), 2), y2) <= 0
+    # bulb: (c_real + 1)**2 + y**2 <= 1/16
+    bulb_x = add(c_real, from_double(np.full(shape, 1.0)))
+    bulb = cmp(add(sqr_scaled(bulb_x), y2), from_double(np.full(shape, 0.0625))) <= 0
+    return cardioid | bulb
+
+def period_tolerance(step_size):
+    '''
+    the periodicity check tolerance for pixels step_size apart, like the tfm kernel's
+    period_tolerance argument. PERIOD_TOLERANCE, or a fraction of the pixel size when that
+    is smaller, so neighbouring orbits near the boundary aren't taken for one cycle.
+    never below the last fraction bit, where only an exact return counts
+    '''
+    return min(PERIOD_TOLERANCE, max(step_size * PERIOD_TOLERANCE_PIXELS, 2.0 ** -FP_SCALE_BITS))
+
+def iterate_active(counts, z_real, z_imag, c_real, c_imag, maxiter, horizon_squared,
+                   tolerance=PERIOD_TOLERANCE):
+    '''
+    the loop of mandelbrot_kernel_tfm.cl on 1d arrays of pixels. z_real, z_imag, c_real
+    and c_imag are FpArray, counts the iterations done so far (>= 0)
+    on return counts are -n for pixels that escaped after n iterations, n (== maxiter)
+    for the ones still inside, and z_real, z_imag hold z for the ones still inside.
+    pixels found to be periodic get ITER_INTERIOR, with the same check as the kernel:
+    tolerance is period_tolerance(step_size).
+    returns nothing, the inputs are updated. escaped and finished pixels are dropped
+    from the working set as soon as they're done
+    '''
+    horizon_squared = from_double(np.float32(horizon_squared))
+    period_tolerance = from_double(np.full(len(counts), tolerance))
+    pos = np.arange(len(counts))
+    n = counts.copy()
+    zr, zi, cr, ci = z_real.copy(), z_imag.copy(), c_real, c_imag
+    sr, si = zr, zi
+    steps, window = 0, 1
+    zr2 = sqr_scaled(zr)
+    zi2 = sqr_scaled(zi)
+    periodic = np.zeros(len(pos), dtype=np.bool_)
+    while len(pos):
+        # the kernel stops at maxiter without checking
+        escaped = (cmp(add(zr2, zi2), horizon_squared) > 0) & (n < maxiter) & ~periodic
+        done = escaped | (n >= maxiter) | periodic
+        if done.any():
+            counts[pos[done]] = np.where(periodic[done], ITER_INTERIOR, np.where(escaped[done], -n[done], n[done]))
+            finished = done & ~escaped & ~periodic
+            z_real.put(pos[finished], zr.take(finished))
+            z_imag.put(pos[finished], zi.take(finished))
+            keep = ~done
+            pos, n, periodic = pos[keep], n[keep], periodic[keep]
+            zr, zi, cr, ci, zr2, zi2, sr, si, period_tolerance = (
+                x.take(keep) for x in (zr, zi, cr, ci, zr2, zi2, sr, si, period_tolerance))
+            if not len(pos):
+                break
+        # z_imag = 2 * z_real * z_imag + c_imag
+        zi = add(mul_scaled(mul_2d(zr, 1), zi), ci)
+        # z_real = z_real**2 - z_imag**2 + c_real
+        zr = add(sub(zr2, zi2), cr)
+        zr2 = sqr_scaled(zr)
+        zi2 = sqr_scaled(zi)
+        # periodicity check, see mandelbrot_common.cl
+        periodic = (cmp_mag(sub(zr, sr), period_tolerance) < 0) & (cmp_mag(sub(zi, si), period_tolerance) < 0)
+        steps += 1
+        if steps == window:
+            sr, si = zr, zi
+            steps = 0
+            window *= 2
+        n += 1
@@ -0,0 +1,14 @@
+/* Recolor the frame from the iteration counts in the state, without iterating.
+ * same rules as the mandelbrot kernels: a negative count is a finished pixel that escaped
+ * after -count iterations. anything else is still inside, so black.
+ * counts is plane STATE_COUNT of the state (mandelbrot_common.cl)
+ */
+__kernel void colorize(__global const int *counts, __global const char *palette,
+                       __global char *output,
+                       const int maxiter, const int width, const int height) {
+    const int x = get_global_id(0);
+    const int y = get_global_id(1);
+    int iter_count = counts[y * width + x];
+    iter_count = (iter_count < 0) ? -iter_count : maxiter;
+    set_output_color(output, palette, width, height, x, y, iter_count, maxiter);
+}
@@ -0,0 +1,103 @@
+/* Shared by every mandelbrot program. prepended to the kernel source by MandelbrotFuncs
+ *
+ * iteration state. structure-of-arrays, STATE_PLANES uint planes of width * height
+ * plane 0: iteration count (int). negative when the pixel is done, ITER_INTERIOR
+ *          when it is known to be inside without iterating
+ * planes 1-6: the kernel's own z (or dz) representation, see each kernel.
+ * the state of one kernel means nothing to another
+ */
+#define STATE_COUNT   0
+#define STATE_PLANES  7
+/* count of a pixel known to be inside: in the main cardioid or the period-2 bulb, or
+ * its orbit was found to be periodic. larger than any maxiter, so it is never iterated
+ * again and always painted black
+ *
+ * periodicity check (Brent): the kernels save z after 1, 2, 4, 8... iterations of a
+ * launch and compare every new z with the saved one. a match within the kernel's
+ * PERIOD_TOLERANCE on both parts means the orbit has settled on an attracting cycle.
+ * the saved point isn't kept in the state, each launch starts a new one */
+#define ITER_INTERIOR 0x7FFFFFFF
+
+void set_output_color(__global char *output, __global const char *palette,
+                      const int width, const int height,
+                      const int x, const int y,
+                      int iter_count, const int maxiter);
+void set_output_color(__global char *output, __global const char *palette,
+                      const int width, const int height,
+                      const int x, const int y,
+                      int iter_count, const int maxiter) {
+    // 8-bit rgb output
+    // the output buffer is displayed buffer[0] = top
+    // so we use (height - y - 1) for indexing
+    int o_ix = ((height - y - 1) * width + x) * 3;
+    iter_count = min(iter_count, maxiter);  // cached values larger
+    if (iter_count == maxiter) {
+        output[o_ix] = 0;
+        output[o_ix + 1] = 0;
+        output[o_ix + 2] = 0;
+    } else {
+        output[o_ix] = palette[iter_count * 3 + 0];
+        output[o_ix + 1] = palette[iter_count * 3 + 1];
+        output[o_ix + 2] = palette[iter_count * 3 + 2];
+    }
+}
+
+/* 1 if c is inside the main cardioid or the period-2 bulb, so it never escapes
+ * cardioid: q * (q + x - 1/4) <= y**2 / 4 with q = (x - 1/4)**2 + y**2
+ * bulb: (x + 1)**2 + y**2 <= 1/16
+ */
+int in_interior_float(const float c_real, const float c_imag);
+int in_interior_float(const float c_real, const float c_imag) {
+    float x = c_real - 0.25f;
+    float y2 = c_imag * c_imag;
+    float q = x * x + y2;
+    float bulb_x = c_real + 1.0f;
+    return 4.0f * q * (q + x) <= y2 || bulb_x * bulb_x + y2 <= 0.0625f;
+}
+
+float load_state_float(__global const uint *state, const size_t plane_size,
+                       const int plane, const size_t arrpos);
+float load_state_float(__global const uint *state, const size_t plane_size,
+                       const int plane, const size_t arrpos) {
+    return as_float(state[plane * plane_size + arrpos]);
+}
+
+void store_state_float(__global uint *state, const size_t plane_size,
+                       const int plane, const size_t arrpos, const float value);
+void store_state_float(__global uint *state, const size_t plane_size,
+                       const int plane, const size_t arrpos, const float value) {
+    state[plane * plane_size + arrpos] = as_uint(value);
+}
+
+#ifdef cl_khr_fp64
+#pragma OPENCL EXTENSION cl_khr_fp64 : enable
+/* in_interior_float in double. margin > 0 only accepts points at least that far
+ * inside (in the units of the tests), for a c that is only known approximately */
+int in_interior_double(const double c_real, const double c_imag, const double margin);
+int in_interior_double(const double c_real, const double c_imag, const double margin) {
+    double x = c_real - 0.25;
+    double y2 = c_imag * c_imag;
+    double q = x * x + y2;
+    double bulb_x = c_real + 1.0;
+    return 4.0 * q * (q + x) - y2 <= -margin || bulb_x * bulb_x + y2 - 0.0625 <= -margin;
+}
+
+/* a double takes two planes, low word first */
+double load_state_double(__global const uint *state, const size_t plane_size,
+                         const int plane, const size_t arrpos);
+double load_state_double(__global const uint *state, const size_t plane_size,
+                         const int plane, const size_t arrpos) {
+    ulong lo = state[plane * plane_size + arrpos];
+    ulong hi = state[(plane + 1) * plane_size + arrpos];
+    return as_double((hi << 32) | lo);
+}
+
+void store_state_double(__global uint *state, const size_t plane_size,
+                        const int plane, const size_t arrpos, const double value);
+void store_state_double(__global uint *state, const size_t plane_size,
+                        const int plane, const size_t arrpos, const double value) {
+    ulong bits = as_ulong(value);
+    state[plane * plane_size + arrpos] = (uint)bits;
+    state[(plane + 1) * plane_size + arrpos] = (uint)(bits >> 32);
+}
+#endif
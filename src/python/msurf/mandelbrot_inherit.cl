@@ -0,0 +1,42 @@
+/* Carry pixels over from the previous frame after an aligned zoom by a power of two.
+ * new pixel (x, y) is old pixel ((x * scale_num + offset_x) / scale_den, ...) when that
+ * divides exactly and lands inside the old frame. those copy their iteration state and
+ * rgb value. every other pixel is zeroed so the mandelbrot kernel computes it.
+ *
+ * state is STATE_PLANES planes of width * height uint (mandelbrot_common.cl), image is rgb
+ * top row first. the planes are copied as they are, whichever kernel wrote them
+ */
+__kernel void inherit_pixels(__global const uint *old_state, __global const char *old_image,
+                             __global uint *state, __global char *image,
+                             const int width, const int height,
+                             const int scale_num, const int scale_den,
+                             const int offset_x, const int offset_y) {
+    const int x = get_global_id(0);
+    const int y = get_global_id(1);
+    const size_t plane_size = width * height;
+    const size_t arrpos = y * width + x;
+    const int o_ix = ((height - y - 1) * width + x) * 3;
+    int sx = x * scale_num + offset_x;
+    int sy = y * scale_num + offset_y;
+    int found = (sx % scale_den == 0) && (sy % scale_den == 0);
+    sx /= scale_den;
+    sy /= scale_den;
+    found = found && sx >= 0 && sx < width && sy >= 0 && sy < height;
+    if (found) {
+        const size_t src_pos = sy * width + sx;
+        const int src_ix = ((height - sy - 1) * width + sx) * 3;
+        for (int plane = 0; plane < STATE_PLANES; plane++) {
+            state[plane * plane_size + arrpos] = old_state[plane * plane_size + src_pos];
+        }
+        image[o_ix] = old_image[src_ix];
+        image[o_ix + 1] = old_image[src_ix + 1];
+        image[o_ix + 2] = old_image[src_ix + 2];
+    } else {
+        for (int plane = 0; plane < STATE_PLANES; plane++) {
+            state[plane * plane_size + arrpos] = 0;
+        }
+        image[o_ix] = 0;
+        image[o_ix + 1] = 0;
+        image[o_ix + 2] = 0;
+    }
+}
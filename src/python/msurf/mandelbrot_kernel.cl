@@ -1,25 +1,61 @@
 /* opencl has a "mad" - multiply and add - function */
 #define fmaf(mul1, mul2, add1) mad((mul1), (mul2), (add1))
+
+/* iteration state planes, see mandelbrot_common.cl
+ * plane 1: z_real (float bits)
+ * plane 4: z_imag (float bits)
+ */
+#define STATE_Z_REAL  1
+#define STATE_Z_IMAG  4
+
+/* periodicity check tolerance, see mandelbrot_common.cl */
+#define PERIOD_TOLERANCE 1e-6f
+
 __kernel void mandelbrot(__global char *output,
                          __global char *palette,
+                         __global uint *state,
                          const int maxiter, const float horizon_squared, const int width, const int height,
                          const float xmin, const float ymin, const float step_size
     ) {
     const int x = get_global_id(0);
     const int y = get_global_id(1);
+    const size_t plane_size = width * height;
+    const size_t arrpos = y * width + x;
+    int iter_count = (int)state[STATE_COUNT * plane_size + arrpos];
+    if (iter_count >= maxiter || iter_count < 0) {
+        // we've already reached maxiter. No more processing
+        set_output_color(output, palette, width, height, x, y, abs(iter_count), maxiter);
+        return;
+    }
 
     // fmaf(a, b, c) is equivalent to (a * b) + c, but with better rounding
     const float c_real = fmaf(step_size, x, xmin);
     const float c_imag = fmaf(step_size, y, ymin);
+    if (iter_count == 0 && in_interior_float(c_real, c_imag)) {
+        // inside the main cardioid or the period-2 bulb. iterating would only run to maxiter
+        set_output_color(output, palette, width, height, x, y, maxiter, maxiter);
+        state[STATE_COUNT * plane_size + arrpos] = ITER_INTERIOR;
+        return;
+    }
 
-    float z_real = 0.0f;
-    float z_imag = 0.0f;
-    float z_real_squared = 0.0f;
-    float z_imag_squared = 0.0f;
-    int i;
+    float z_real = load_state_float(state, plane_size, STATE_Z_REAL, arrpos);
+    float z_imag = load_state_float(state, plane_size, STATE_Z_IMAG, arrpos);
+    float z_real_squared = z_real * z_real;
+    float z_imag_squared = z_imag * z_imag;
 
-    for(i = 0; i < maxiter; i++) {
-        if(z_real_squared + z_imag_squared > horizon_squared) break;
+    // periodicity check, see mandelbrot_common.cl
+    float saved_real = z_real;
+    float saved_imag = z_imag;
+    int period_steps = 0;
+    int period_window = 1;
+    int periodic = 0;
+
+    int found = 0;
+    for(; iter_count < maxiter; iter_count++) {
+        if(z_real_squared + z_imag_squared > horizon_squared) {
+            found = 1;
+            break;
+        }
 
         z_imag = fmaf(2.0f * z_real, z_imag, c_imag);
         //z_imag = 2.0f * z_real * z_imag + c_imag;
@@ -27,22 +63,30 @@ __kernel void mandelbrot(__global char *output,
 
         z_real_squared = z_real * z_real;
         z_imag_squared = z_imag * z_imag;
+
+        if (fabs(z_real - saved_real) < PERIOD_TOLERANCE && fabs(z_imag - saved_imag) < PERIOD_TOLERANCE) {
+            periodic = 1;
+            break;
+        }
+        if (++period_steps == period_window) {
+            saved_real = z_real;
+            saved_imag = z_imag;
+            period_steps = 0;
+            period_window *= 2;
+        }
     }
-    // 8-bit rgb output
-    // the output buffer is displayed buffer[0] = top
-    // so we use (height - y - 1) for indexing
-    int row = height - y - 1;
-    int row_width = width * 3;  // 3 channels, one byte each
-    int col_pos = x * 3;
-    int o_ix = row * row_width + col_pos;
-    //int value = (i * 255) / maxiter;
-    if (i == maxiter) {
-        output[o_ix] = 0;
-        output[o_ix + 1] = 0;
-        output[o_ix + 2] = 0;
-    } else {
-        output[o_ix] = palette[i*3 + 0];
-        output[o_ix + 1] = palette[i*3 + 1];
-        output[o_ix + 2] = palette[i*3 + 2];
+    if (periodic) {
+        // inside, never iterate it again
+        iter_count = ITER_INTERIOR;
+    }
+    set_output_color(output, palette, width, height, x, y, iter_count, maxiter);
+
+    // store state for next time
+    if (found) {
+        // mark as done
+        iter_count = -iter_count;
     }
+    state[STATE_COUNT * plane_size + arrpos] = (uint)iter_count;
+    store_state_float(state, plane_size, STATE_Z_REAL, arrpos, z_real);
+    store_state_float(state, plane_size, STATE_Z_IMAG, arrpos, z_imag);
 }
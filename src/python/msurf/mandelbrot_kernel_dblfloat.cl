@@ -1,3 +1,9 @@
+/* Emulated double precision: each value is the unevaluated sum of two floats,
+ * about 48 bits of mantissa. for devices without cl_khr_fp64
+ * the error terms need a fused multiply-add and no contraction of the sums
+ */
+#pragma OPENCL FP_CONTRACT OFF
+
 // Define the double structure
 typedef struct DoubleStruct {
     float high;
@@ -23,10 +29,10 @@ static dblfloat double_multiply(dblfloat a, dblfloat b) {
     dblfloat t, z;
     float sum;
     t.high = a.high * b.high;
-    t.low = fmaf (a.high, b.high, -t.high);
-    t.low = fmaf (a.low, b.low, t.low);
-    t.low = fmaf (a.high, b.low, t.low);
-    t.low = fmaf (a.low, b.high, t.low);
+    t.low = fma (a.high, b.high, -t.high);
+    t.low = fma (a.low, b.low, t.low);
+    t.low = fma (a.high, b.low, t.low);
+    t.low = fma (a.low, b.high, t.low);
     /* normalize result */
     sum = t.high + t.low;
     z.low = (t.high - sum) + t.low;
@@ -36,26 +42,14 @@ static dblfloat double_multiply(dblfloat a, dblfloat b) {
 
 static dblfloat double_add(dblfloat a, dblfloat b) {
     dblfloat result;
-    
-    // Add high parts
+    // Knuth's two-sum of the high parts: high_sum + error is exactly a.high + b.high
     float high_sum = a.high + b.high;
-    
-    // Add low parts
-    float low_sum = a.low + b.low;
-    
-    // If low_sum overflows or underflows, we need to carry over to high_sum
-    float tmp = high_sum;
-    high_sum += low_sum;
-    // Check if we've overflowed or underflowed in high_sum due to low_sum addition
-    if (fabs(high_sum) < fabs(tmp)) { // Overflow or underflow detected
-        // Adjust by renormalizing
-        float correction = (high_sum - tmp) - low_sum;
-        low_sum -= correction;
-    }
-    
-    // Store result
-    result.high = high_sum;
-    result.low = low_sum;
+    float virtual_b = high_sum - a.high;
+    float error = (a.high - (high_sum - virtual_b)) + (b.high - virtual_b);
+    // add the low parts into the error, then renormalize
+    error += a.low + b.low;
+    result.high = high_sum + error;
+    result.low = error - (result.high - high_sum);
     return result;
 }
 
@@ -85,14 +79,66 @@ __kernel void k_dblfloat_add(__global float *output, const float a_high, const f
     output[1] = result.low;
 }
 
+/* iteration state planes, see mandelbrot_common.cl
+ * planes 1-2: z_real high, low (float bits)
+ * planes 4-5: z_imag high, low (float bits)
+ */
+#define STATE_Z_REAL  1
+#define STATE_Z_IMAG  4
+
+/* periodicity check tolerance, see mandelbrot_common.cl */
+#define PERIOD_TOLERANCE 1e-13f
+
+dblfloat load_state_dblfloat(__global const uint *state, const size_t plane_size,
+                             const int plane, const size_t arrpos);
+dblfloat load_state_dblfloat(__global const uint *state, const size_t plane_size,
+                             const int plane, const size_t arrpos) {
+    dblfloat result;
+    result.high = load_state_float(state, plane_size, plane, arrpos);
+    result.low = load_state_float(state, plane_size, plane + 1, arrpos);
+    return result;
+}
+
+void store_state_dblfloat(__global uint *state, const size_t plane_size,
+                          const int plane, const size_t arrpos, const dblfloat value);
+void store_state_dblfloat(__global uint *state, const size_t plane_size,
+                          const int plane, const size_t arrpos, const dblfloat value) {
+    store_state_float(state, plane_size, plane, arrpos, value.high);
+    store_state_float(state, plane_size, plane + 1, arrpos, value.low);
+}
+
+/* in_interior_float (mandelbrot_common.cl) in dblfloat */
+static int in_interior_dblfloat(dblfloat c_real, dblfloat c_imag) {
+    const dblfloat quarter = {0.25f, 0.0f};
+    const dblfloat one = {1.0f, 0.0f};
+    const dblfloat four = {4.0f, 0.0f};
+    const dblfloat sixteenth = {0.0625f, 0.0f};
+    dblfloat x = double_minus(c_real, quarter);
+    dblfloat y2 = double_multiply(c_imag, c_imag);
+    dblfloat q = double_add(double_multiply(x, x), y2);
+    dblfloat cardioid = double_minus(double_multiply(double_multiply(four, q), double_add(q, x)), y2);
+    dblfloat bulb_x = double_add(c_real, one);
+    dblfloat bulb = double_minus(double_add(double_multiply(bulb_x, bulb_x), y2), sixteenth);
+    return cardioid.high <= 0.0f || bulb.high <= 0.0f;
+}
+
 __kernel void mandelbrot(__global char *output,
                          __global char *palette,
-                         const int maxiter, const float horizon, const int width, const int height,
+                         __global uint *state,
+                         const int maxiter, const float horizon_squared, const int width, const int height,
                          const float xmin_high, const float xmin_low,
                          const float ymin_high, const float ymin_low,
                          const float step_size_high, const float step_size_low) {
     const int x = get_global_id(0);
     const int y = get_global_id(1);
+    const size_t plane_size = width * height;
+    const size_t arrpos = y * width + x;
+    int iter_count = (int)state[STATE_COUNT * plane_size + arrpos];
+    if (iter_count >= maxiter || iter_count < 0) {
+        // we've already reached maxiter. No more processing
+        set_output_color(output, palette, width, height, x, y, abs(iter_count), maxiter);
+        return;
+    }
 
     const dblfloat xmin = {xmin_high, xmin_low};
     const dblfloat ymin = {ymin_high, ymin_low};
@@ -102,37 +148,62 @@ __kernel void mandelbrot(__global char *output,
 
     const dblfloat c_real = double_add(double_multiply(step_size, dblfloat_x), xmin);
     const dblfloat c_imag = double_add(double_multiply(step_size, dblfloat_y), ymin);
+    if (iter_count == 0 && in_interior_dblfloat(c_real, c_imag)) {
+        // inside the main cardioid or the period-2 bulb. iterating would only run to maxiter
+        set_output_color(output, palette, width, height, x, y, maxiter, maxiter);
+        state[STATE_COUNT * plane_size + arrpos] = ITER_INTERIOR;
+        return;
+    }
 
-    dblfloat z_real = {0.0f, 0.0f};
-    dblfloat z_imag = {0.0f, 0.0f};
-    dblfloat z_real_squared = {0.0f, 0.0f};
-    dblfloat z_imag_squared = {0.0f, 0.0f};
+    dblfloat z_real = load_state_dblfloat(state, plane_size, STATE_Z_REAL, arrpos);
+    dblfloat z_imag = load_state_dblfloat(state, plane_size, STATE_Z_IMAG, arrpos);
+    dblfloat z_real_squared = double_multiply(z_real, z_real);
+    dblfloat z_imag_squared = double_multiply(z_imag, z_imag);
     const dblfloat two = {2.0f, 0.0f};
-    int i;
 
-    for(i = 0; i < maxiter; i++) {
-        if(double_add(z_real_squared, z_imag_squared).high > horizon * horizon) break;
+    // periodicity check, see mandelbrot_common.cl
+    dblfloat saved_real = z_real;
+    dblfloat saved_imag = z_imag;
+    int period_steps = 0;
+    int period_window = 1;
+    int periodic = 0;
+
+    int found = 0;
+    for(; iter_count < maxiter; iter_count++) {
+        if(double_add(z_real_squared, z_imag_squared).high > horizon_squared) {
+            found = 1;
+            break;
+        }
         z_imag = double_add(double_multiply(double_multiply(two, z_real), z_imag), c_imag);
         z_real = double_add(double_minus(z_real_squared, z_imag_squared), c_real);
 
         z_real_squared = double_multiply(z_real, z_real);
         z_imag_squared = double_multiply(z_imag, z_imag);
+
+        if (fabs(double_minus(z_real, saved_real).high) < PERIOD_TOLERANCE &&
+            fabs(double_minus(z_imag, saved_imag).high) < PERIOD_TOLERANCE) {
+            periodic = 1;
+            break;
+        }
+        if (++period_steps == period_window) {
+            saved_real = z_real;
+            saved_imag = z_imag;
+            period_steps = 0;
+            period_window *= 2;
+        }
     }
-    // 8-bit rgb output
-    // the output buffer is displayed buffer[0] = top
-    // so we use (height - y - 1) for indexing
-    int row = height - y - 1;
-    int row_width = width * 3;  // 3 channels, one byte each
-    int col_pos = x * 3;
-    int o_ix = row * row_width + col_pos;
-    //int value = (i * 255) / maxiter;
-    if (i == maxiter) {
-        output[o_ix] = 0;
-        output[o_ix + 1] = 0;
-        output[o_ix + 2] = 0;
-    } else {
-        output[o_ix] = palette[i*3 + 0];
-        output[o_ix + 1] = palette[i*3 + 1];
-        output[o_ix + 2] = palette[i*3 + 2];
+    if (periodic) {
+        // inside, never iterate it again
+        iter_count = ITER_INTERIOR;
+    }
+    set_output_color(output, palette, width, height, x, y, iter_count, maxiter);
+
+    // store state for next time
+    if (found) {
+        // mark as done
+        iter_count = -iter_count;
     }
+    state[STATE_COUNT * plane_size + arrpos] = (uint)iter_count;
+    store_state_dblfloat(state, plane_size, STATE_Z_REAL, arrpos, z_real);
+    store_state_dblfloat(state, plane_size, STATE_Z_IMAG, arrpos, z_imag);
 }
@@ -0,0 +1,89 @@
+/* Native double precision kernel. needs cl_khr_fp64, enabled in mandelbrot_common.cl */
+
+/* iteration state planes, see mandelbrot_common.cl
+ * planes 1-2: z_real (double, low and high words)
+ * planes 4-5: z_imag (double, low and high words)
+ */
+#define STATE_Z_REAL  1
+#define STATE_Z_IMAG  4
+
+/* periodicity check tolerance, see mandelbrot_common.cl */
+#define PERIOD_TOLERANCE 1e-14
+
+__kernel void mandelbrot(__global char *output,
+                         __global char *palette,
+                         __global uint *state,
+                         const int maxiter, const float horizon_squared, const int width, const int height,
+                         const double xmin, const double ymin, const double step_size
+    ) {
+    const int x = get_global_id(0);
+    const int y = get_global_id(1);
+    const size_t plane_size = width * height;
+    const size_t arrpos = y * width + x;
+    int iter_count = (int)state[STATE_COUNT * plane_size + arrpos];
+    if (iter_count >= maxiter || iter_count < 0) {
+        // we've already reached maxiter. No more processing
+        set_output_color(output, palette, width, height, x, y, abs(iter_count), maxiter);
+        return;
+    }
+
+    const double c_real = fma(step_size, (double)x, xmin);
+    const double c_imag = fma(step_size, (double)y, ymin);
+    if (iter_count == 0 && in_interior_double(c_real, c_imag, 0.0)) {
+        // inside the main cardioid or the period-2 bulb. iterating would only run to maxiter
+        set_output_color(output, palette, width, height, x, y, maxiter, maxiter);
+        state[STATE_COUNT * plane_size + arrpos] = ITER_INTERIOR;
+        return;
+    }
+
+    double z_real = load_state_double(state, plane_size, STATE_Z_REAL, arrpos);
+    double z_imag = load_state_double(state, plane_size, STATE_Z_IMAG, arrpos);
+    double z_real_squared = z_real * z_real;
+    double z_imag_squared = z_imag * z_imag;
+
+    // periodicity check, see mandelbrot_common.cl
+    double saved_real = z_real;
+    double saved_imag = z_imag;
+    int period_steps = 0;
+    int period_window = 1;
+    int periodic = 0;
+
+    int found = 0;
+    for(; iter_count < maxiter; iter_count++) {
+        if(z_real_squared + z_imag_squared > horizon_squared) {
+            found = 1;
+            break;
+        }
+
+        z_imag = fma(2.0 * z_real, z_imag, c_imag);
+        z_real = z_real_squared - z_imag_squared + c_real;
+
+        z_real_squared = z_real * z_real;
+        z_imag_squared = z_imag * z_imag;
+
+        if (fabs(z_real - saved_real) < PERIOD_TOLERANCE && fabs(z_imag - saved_imag) < PERIOD_TOLERANCE) {
+            periodic = 1;
+            break;
+        }
+        if (++period_steps == period_window) {
+            saved_real = z_real;
+            saved_imag = z_imag;
+            period_steps = 0;
+            period_window *= 2;
+        }
+    }
+    if (periodic) {
+        // inside, never iterate it again
+        iter_count = ITER_INTERIOR;
+    }
+    set_output_color(output, palette, width, height, x, y, iter_count, maxiter);
+
+    // store state for next time
+    if (found) {
+        // mark as done
+        iter_count = -iter_count;
+    }
+    state[STATE_COUNT * plane_size + arrpos] = (uint)iter_count;
+    store_state_double(state, plane_size, STATE_Z_REAL, arrpos, z_real);
+    store_state_double(state, plane_size, STATE_Z_IMAG, arrpos, z_imag);
+}
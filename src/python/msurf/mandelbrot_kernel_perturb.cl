@@ -0,0 +1,89 @@
+/* Perturbation kernel. see perturbation.py
+ * every pixel iterates dz, its difference from a high precision reference orbit,
+ * in double precision. needs cl_khr_fp64, enabled in mandelbrot_common.cl
+ */
+
+/* iteration state planes, see mandelbrot_common.cl
+ * planes 1-2: dz real (double, low and high words)
+ * plane 3: position in the reference orbit
+ * planes 4-5: dz imag (double, low and high words)
+ */
+#define STATE_DZ_REAL  1
+#define STATE_REF_POS  3
+#define STATE_DZ_IMAG  4
+
+/* c is only known to about 1e-16 in double (the reference c is rounded), so the
+ * interior test only takes pixels this far inside, see in_interior_double */
+#define INTERIOR_MARGIN 1e-12
+
+/* ref_orbit: Z_0 .. Z_(ref_len - 1)
+ * ref_x, ref_y: position of the reference c in this frame's pixels
+ * ref_c_real, ref_c_imag: the reference c, rounded to double. only for the interior test
+ */
+__kernel void mandelbrot(__global char *output,
+                         __global char *palette,
+                         __global uint *state,
+                         const int maxiter, const float horizon_squared, const int width, const int height,
+                         __global const double2 *ref_orbit, const int ref_len,
+                         const double ref_x, const double ref_y, const double step_size,
+                         const double ref_c_real, const double ref_c_imag
+    ) {
+    const int x = get_global_id(0);
+    const int y = get_global_id(1);
+    const size_t plane_size = width * height;
+    const size_t arrpos = y * width + x;
+    int iter_count = (int)state[STATE_COUNT * plane_size + arrpos];
+    if (iter_count >= maxiter || iter_count < 0) {
+        // we've already reached maxiter. No more processing
+        set_output_color(output, palette, width, height, x, y, abs(iter_count), maxiter);
+        return;
+    }
+    double dz_real = load_state_double(state, plane_size, STATE_DZ_REAL, arrpos);
+    double dz_imag = load_state_double(state, plane_size, STATE_DZ_IMAG, arrpos);
+    int ref_pos = (int)state[STATE_REF_POS * plane_size + arrpos];
+    const double dc_real = (x - ref_x) * step_size;
+    const double dc_imag = (y - ref_y) * step_size;
+    if (iter_count == 0 && in_interior_double(ref_c_real + dc_real, ref_c_imag + dc_imag, INTERIOR_MARGIN)) {
+        // inside the main cardioid or the period-2 bulb. iterating would only run to maxiter
+        set_output_color(output, palette, width, height, x, y, maxiter, maxiter);
+        state[STATE_COUNT * plane_size + arrpos] = ITER_INTERIOR;
+        return;
+    }
+
+    int found = 0;
+    for(; iter_count < maxiter; iter_count++) {
+        double2 ref = ref_orbit[ref_pos];
+        double z_real = ref.x + dz_real;
+        double z_imag = ref.y + dz_imag;
+        double z_squared = z_real * z_real + z_imag * z_imag;
+        if (z_squared > horizon_squared) {
+            found = 1;
+            break;
+        }
+        // rebase when dz is bigger than z (glitch) or at the end of the reference orbit
+        if (z_squared < dz_real * dz_real + dz_imag * dz_imag || ref_pos == ref_len - 1) {
+            dz_real = z_real;
+            dz_imag = z_imag;
+            ref_pos = 0;
+            ref = ref_orbit[0];
+        }
+        // dz = (2 * Z + dz) * dz + dc
+        double t_real = 2.0 * ref.x + dz_real;
+        double t_imag = 2.0 * ref.y + dz_imag;
+        double new_real = t_real * dz_real - t_imag * dz_imag + dc_real;
+        dz_imag = t_real * dz_imag + t_imag * dz_real + dc_imag;
+        dz_real = new_real;
+        ref_pos++;
+    }
+    set_output_color(output, palette, width, height, x, y, iter_count, maxiter);
+
+    // store state for next time
+    if (found) {
+        // mark as done
+        iter_count = -iter_count;
+    }
+    state[STATE_COUNT * plane_size + arrpos] = (uint)iter_count;
+    store_state_double(state, plane_size, STATE_DZ_REAL, arrpos, dz_real);
+    store_state_double(state, plane_size, STATE_DZ_IMAG, arrpos, dz_imag);
+    state[STATE_REF_POS * plane_size + arrpos] = (uint)ref_pos;
+}
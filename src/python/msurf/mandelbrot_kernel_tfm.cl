@@ -25,57 +25,98 @@ void fp_from_hi_lo(fp_int *dest, uint64_t val_hi, uint64_t val_lo) {
     fp_clamp(dest);
 }
 
-void set_output_color(__global char *output, __global char *palette,
-                      const int width, const int height,
-                      const int x, const int y,
-                      const int iter_count, const int maxiter);
-void set_output_color(__global char *output, __global char *palette,
-                      const int width, const int height,
-                      const int x, const int y,
-                      int iter_count, const int maxiter) {
-    // 8-bit rgb output
-    // the output buffer is displayed buffer[0] = top
-    // so we use (height - y - 1) for indexing
-    int row = height - y - 1;
-    int row_width = width * 3;  // 3 channels, one byte each
-    int col_pos = x * 3;
-    int o_ix = row * row_width + col_pos;
-    iter_count = min(iter_count, maxiter);  // cached values larger
-    //int value = (i * 255) / maxiter;
-    if (iter_count == maxiter) {
-        output[o_ix] = 0;
-        output[o_ix + 1] = 0;
-        output[o_ix + 2] = 0;
-    } else {
-        output[o_ix] = palette[iter_count * 3 + 0];
-        output[o_ix + 1] = palette[iter_count * 3 + 1];
-        output[o_ix + 2] = palette[iter_count * 3 + 2];
+/* iteration state planes, see mandelbrot_common.cl
+ * planes 1-3: z_real dp[0..2]
+ * planes 4-6: z_imag dp[0..2]
+ * only 3 digits are needed since |z| stays below 2**31. the sign is kept in the
+ * top bit of dp[2], the same as the hi/lo encoding of double_to_fp_int_array
+ */
+#define STATE_Z_REAL  1
+#define STATE_Z_IMAG  4
+#define STATE_SIGN_BIT 0x80000000
+
+/* the periodicity check tolerance (see mandelbrot_common.cl) is the period_tolerance
+ * argument: a fraction of the pixel size, so it stays below the spacing of neighbouring
+ * pixels at any depth. see fp_numpy.period_tolerance */
+
+void load_state_fp(fp_int *dest, __global const uint *state, const size_t plane_size,
+                   const int plane, const size_t arrpos);
+void load_state_fp(fp_int *dest, __global const uint *state, const size_t plane_size,
+                   const int plane, const size_t arrpos) {
+    uint hi = state[(plane + 2) * plane_size + arrpos];
+    fp_zero(dest);
+    dest->used = 3;
+    dest->sign = (hi & STATE_SIGN_BIT) ? FP_NEG : FP_ZPOS;
+    dest->dp[2] = hi & ~STATE_SIGN_BIT;
+    dest->dp[1] = state[(plane + 1) * plane_size + arrpos];
+    dest->dp[0] = state[plane * plane_size + arrpos];
+    fp_clamp(dest);
+}
+
+void store_state_fp(__global uint *state, const size_t plane_size,
+                    const int plane, const size_t arrpos, const fp_int *src);
+void store_state_fp(__global uint *state, const size_t plane_size,
+                    const int plane, const size_t arrpos, const fp_int *src) {
+    uint hi = (src->used > 2) ? src->dp[2] : 0;
+    if (src->sign == FP_NEG) {
+        hi |= STATE_SIGN_BIT;
+    }
+    state[plane * plane_size + arrpos] = (src->used > 0) ? src->dp[0] : 0;
+    state[(plane + 1) * plane_size + arrpos] = (src->used > 1) ? src->dp[1] : 0;
+    state[(plane + 2) * plane_size + arrpos] = hi;
+}
+
+/* in_interior_float (mandelbrot_common.cl) in fp_int */
+int fp_in_interior(const fp_int *c_real, const fp_int *c_imag);
+int fp_in_interior(const fp_int *c_real, const fp_int *c_imag) {
+    fp_int x, y2, q, temp_fp;
+    // x = c_real - 1/4
+    fp_from_float(&temp_fp, 0.25f);
+    fp_sub(c_real, &temp_fp, &x);
+    // q = x**2 + y**2
+    fp_sqr_scaled(c_imag, &y2);
+    fp_sqr_scaled(&x, &q);
+    fp_add(&q, &y2, &q);
+    // cardioid: 4 * q * (q + x) <= y**2
+    fp_add(&q, &x, &temp_fp);
+    fp_mul_scaled(&q, &temp_fp, &temp_fp);
+    fp_mul_2d(&temp_fp, 2, &temp_fp);
+    if (fp_cmp(&temp_fp, &y2) != FP_GT) {
+        return 1;
     }
+    // bulb: (c_real + 1)**2 + y**2 <= 1/16
+    fp_from_float(&temp_fp, 1.0f);
+    fp_add(c_real, &temp_fp, &x);
+    fp_sqr_scaled(&x, &q);
+    fp_add(&q, &y2, &q);
+    fp_from_float(&temp_fp, 0.0625f);
+    return fp_cmp(&q, &temp_fp) != FP_GT;
 }
 
 __kernel void mandelbrot(__global char *output,
                          __global char *palette,
+                         __global uint *state,
                          const int maxiter, const float horizon_squared, const int width, const int height,
                          const uint64_t xmin_hi, const uint64_t xmin_lo,
                          const uint64_t ymin_hi, const uint64_t ymin_lo,
-                         const uint64_t step_size_hi, const uint64_t step_size_lo
+                         const uint64_t step_size_hi, const uint64_t step_size_lo,
+                         const uint64_t period_tolerance_hi, const uint64_t period_tolerance_lo
     ) {
     const int x = get_global_id(0);
     const int y = get_global_id(1);
     int iter_count = 0;
     fp_int z_real, z_imag, z_real_squared, z_imag_squared, c_real, c_imag, temp_fp, horizon_squared_fp;
     // load current state
-    size_t image_offset = width * height * 3;  // length of image data
-    size_t arrpos = y * width + x;  // my index
-    size_t state_offset = image_offset + 68 * arrpos;  // my state offset
-    memcpy(&iter_count, output + state_offset, 4);  // restore iterator position
+    const size_t plane_size = width * height;
+    const size_t arrpos = y * width + x;  // my index within each plane
+    iter_count = (int)state[STATE_COUNT * plane_size + arrpos];  // restore iterator position
     if (iter_count >= maxiter || iter_count < 0) {
         // we've already reached maxiter. No more processing
         set_output_color(output, palette, width, height, x, y, abs(iter_count), maxiter);
         return;
     }
-    memcpy(&z_real, output + state_offset + 4, 32);  // fp_digit must be 32 bytes
-    memcpy(&z_imag, output + state_offset + 36, 32); // dp[6]*uint32 + used (int32) + sign (int32)
+    load_state_fp(&z_real, state, plane_size, STATE_Z_REAL, arrpos);
+    load_state_fp(&z_imag, state, plane_size, STATE_Z_IMAG, arrpos);
     // end load current state
 
     // initialize the c_real and c_imag values based on x,y position
@@ -94,11 +135,26 @@ __kernel void mandelbrot(__global char *output,
     // c_imag = (step_size * y) + ymin
     fp_from_hi_lo(&temp_fp, ymin_hi, ymin_lo);
     fp_add(&c_imag, &temp_fp, &c_imag);
+    if (iter_count == 0 && fp_in_interior(&c_real, &c_imag)) {
+        // inside the main cardioid or the period-2 bulb. iterating would only run to maxiter
+        set_output_color(output, palette, width, height, x, y, maxiter, maxiter);
+        state[STATE_COUNT * plane_size + arrpos] = ITER_INTERIOR;
+        return;
+    }
 
     // begin
     fp_sqr_scaled(&z_real, &z_real_squared);
     fp_sqr_scaled(&z_imag, &z_imag_squared);
 
+    // periodicity check, see mandelbrot_common.cl
+    fp_int saved_real, saved_imag, period_tolerance_fp;
+    fp_copy(&z_real, &saved_real);
+    fp_copy(&z_imag, &saved_imag);
+    fp_from_hi_lo(&period_tolerance_fp, period_tolerance_hi, period_tolerance_lo);
+    int period_steps = 0;
+    int period_window = 1;
+    int periodic = 0;
+
     int found = 0;
     for(; iter_count < maxiter; iter_count++) {
         // check (z_real_squared + z_imag_squared) < horizon_squared
@@ -121,6 +177,22 @@ __kernel void mandelbrot(__global char *output,
         fp_sqr_scaled(&z_real, &z_real_squared);
         // z_imag_squared = z_imag * z_imag
         fp_sqr_scaled(&z_imag, &z_imag_squared);
+
+        // |z_real - saved_real| < tolerance and |z_imag - saved_imag| < tolerance
+        fp_sub(&z_real, &saved_real, &temp_fp);
+        if (fp_cmp_mag(&temp_fp, &period_tolerance_fp) == FP_LT) {
+            fp_sub(&z_imag, &saved_imag, &temp_fp);
+            if (fp_cmp_mag(&temp_fp, &period_tolerance_fp) == FP_LT) {
+                periodic = 1;
+                break;
+            }
+        }
+        if (++period_steps == period_window) {
+            fp_copy(&z_real, &saved_real);
+            fp_copy(&z_imag, &saved_imag);
+            period_steps = 0;
+            period_window *= 2;
+        }
     }
     // debug
     /*
@@ -136,10 +208,14 @@ __kernel void mandelbrot(__global char *output,
         output[o_ix2 + 2] = 250;
         //int sentinel = fp_to_float(&z_real) * 1000;
         int sentinel = 99;
-        memcpy(output + state_offset, &sentinel, 4);
+        state[STATE_COUNT * plane_size + arrpos] = sentinel;
         return;
     }
     */
+    if (periodic) {
+        // inside, never iterate it again
+        iter_count = ITER_INTERIOR;
+    }
     set_output_color(output, palette, width, height, x, y, iter_count, maxiter);
 
     // store state for next time
@@ -147,9 +223,9 @@ __kernel void mandelbrot(__global char *output,
         // mark as done
         iter_count = -iter_count;
     }
-    memcpy(output + state_offset, &iter_count, 4);
-    memcpy(output + state_offset + 4, &z_real, 32);
-    memcpy(output + state_offset + 36, &z_imag, 32);
+    state[STATE_COUNT * plane_size + arrpos] = (uint)iter_count;
+    store_state_fp(state, plane_size, STATE_Z_REAL, arrpos, &z_real);
+    store_state_fp(state, plane_size, STATE_Z_IMAG, arrpos, &z_imag);
     // end store state
 
 }
@@ -12,13 +12,22 @@ The ``maxiter`` gives the precision of the computation. ``maxiter=200`` should
 take a few seconds on most modern laptops.
 """
 
-from math import floor, cos, pi
+from math import cos, pi
 import numpy as np
 from MP4Writer import MP4Writer
 
 
 class MBrotProcessor:
-    traceArray = None
+    # the squares painted on the frames, one per tracked point and iteration, set by mandelbrot_set():
+    # trace_x, trace_y, trace_n are the pixel and iteration of each, sorted by frame then iteration.
+    # frame f has trace_offsets[f]:trace_offsets[f + 1]. trace_colors and trace_sizes are by iteration.
+    # see trace_frame()
+    trace_x = None
+    trace_y = None
+    trace_n = None
+    trace_offsets = None
+    trace_colors = None
+    trace_sizes = None
 
     def __init__(self):
         pass
@@ -49,32 +58,22 @@ class MBrotProcessor:
 
 
     def mandelbrot_set(self, xmin, xmax, ymin, ymax, xn, yn, maxiter, horizon=2.0, num_frames=200):
-        DONE = [0] * num_frames
         def point_to_index(x, y):
             '''
-            x,y are points on the real plane
-            returns indexes into the pixel array
+            x,y are arrays of points on the real plane
+            returns arrays of indexes into the pixel array, clipped to it
             '''
             x_inc = (xmax - xmin) / xn
             y_inc = (ymax - ymin) / yn
-            x_index = floor((x - xmin) / x_inc)
-            y_index = floor((y - ymin) / y_inc)
-            # assert(x_index >= 0 and x_index < xn)
-            # assert(y_index >= 0 and y_index < yn)
-            x_index = max(0, x_index)
-            x_index = min(xn - 1, x_index)
-            y_index = max(0, y_index)
-            y_index = min(yn - 1, y_index)
+            x_index = np.clip(np.floor((x - xmin) / x_inc), 0, xn - 1).astype(int)
+            y_index = np.clip(np.floor((y - ymin) / y_inc), 0, yn - 1).astype(int)
             return (x_index, y_index)
         # C is a 2d array of points on the real plane
         X = np.linspace(xmin, xmax, xn).astype(np.float32)
         Y = np.linspace(ymin, ymax, yn).astype(np.float32)
         C = X + Y[:, None] * 1j
-        # trace array is array of pixels showing the progression of the selected point
-        # towards the attractor
-        # trace array is [num_frames, xn, yn, 3]
-        # last position is blue=0 | green=1 | red=2
-        self.traceArray = np.zeros((num_frames,)+C.shape+(3,), dtype=np.uint8)
+        # traces show the progression of the selected point towards the attractor
+        # kept as squares instead of [num_frames, yn, xn, 3] pixels: they are a tiny part of each frame
         #
         print(C.shape)
         # N is the count of repetitions before reaching the horizon
@@ -96,38 +95,71 @@ class MBrotProcessor:
         ry_by_frame = np.linspace(bulb2_radius, bulb2_outer_radius, num_frames) * \
             np.sin(np.linspace(0, reps * 2 * pi, num_frames)) + bulb2_center[1]
         print(rx_by_frame[0], ry_by_frame[0])
-        index_by_frame = [point_to_index(x,y) for (x,y) in np.vstack([rx_by_frame, ry_by_frame]).T]
+        index_x, index_y = point_to_index(rx_by_frame, ry_by_frame)
+        # a frame is done once its point reaches the edge
+        done = np.zeros(num_frames, dtype=np.bool_)
+        color_size = self.iter_to_color(maxiter)
+        self.trace_colors = np.array([color for color, size in color_size], dtype=np.uint8)
+        self.trace_sizes = np.array([size for color, size in color_size], dtype=int)
+        stamp_frames, stamp_x, stamp_y, stamp_n = [], [], [], []
         # the main iteration loop
-        iter_index_to_color_size = self.iter_to_color(maxiter)
         for n in range(maxiter):
-            color, size = iter_index_to_color_size[n]
             points_in_bounds = abs(Z) < horizon
             N[points_in_bounds] = n
             Z[points_in_bounds] = Z[points_in_bounds]**2 + C[points_in_bounds]
-            # loop over all points of interest, adding them frame-by-frame to trace
+            # the points of interest of all the frames at once
             # one frame == a single point of interest
-            for frame in range(num_frames):
-                if not DONE[frame]:
-                    x_index, y_index = index_by_frame[frame]
-                    v = Z[y_index, x_index]  # x,y reversed
-                    x, y = point_to_index(v.real, v.imag)
-                    if (x != x_index or y != y_index):
-                        print(f'n: {n}  fr: {frame}  index: ({x_index}, {y_index})  v:({v.real:.3f}, {v.imag:.3f}) point: ({x}, {y})')
-                    if x == 0 or x == xn-1:
-                        DONE[frame] = 1
-                    elif y == 0 or y == yn-1:
-                        DONE[frame] = 1
-                    else:
-                        x1 = max(0, x - size)
-                        x2 = min(xn-1, x + size)
-                        y1 = max(0, y - size)
-                        y2 = min(yn-1, y + size)
-                        for i in range(x1, x2):
-                            for j in range(y1, y2):
-                                self.traceArray[frame, j, i] = color
+            frames = np.nonzero(~done)[0]
+            v = Z[index_y[frames], index_x[frames]]  # x,y reversed
+            x, y = point_to_index(v.real, v.imag)
+            edge = (x == 0) | (x == xn - 1) | (y == 0) | (y == yn - 1)
+            done[frames[edge]] = True
+            keep = ~edge
+            stamp_frames.append(frames[keep])
+            stamp_x.append(x[keep])
+            stamp_y.append(y[keep])
+            stamp_n.append(np.full(np.count_nonzero(keep), n))
+        # group the squares by frame, keeping the iteration order within each
+        frames = np.concatenate(stamp_frames)
+        order = np.argsort(frames, kind='stable')
+        self.trace_x = np.concatenate(stamp_x)[order]
+        self.trace_y = np.concatenate(stamp_y)[order]
+        self.trace_n = np.concatenate(stamp_n)[order]
+        self.trace_offsets = np.searchsorted(frames[order], np.arange(num_frames + 1))
+        print(f'traces: {len(frames)} squares on {num_frames} frames')
         N[N == maxiter-1] = 0
         return Z, N
 
+    def trace_frame(self, frame, base):
+        '''
+        frame of the animation: the squares of the frame's point over base, a (yn, xn, 3) uint8 image.
+        a later square covers an earlier one, and each channel is the max of base and the square
+        '''
+        image = base.copy()
+        lo, hi = self.trace_offsets[frame], self.trace_offsets[frame + 1]
+        sizes = self.trace_sizes[self.trace_n[lo:hi]]
+        if hi == lo or sizes.max() <= 0:
+            return image
+        yn, xn = base.shape[:2]
+        # every pixel of every square: x - size <= px < x + size, clipped to 0 <= px < xn - 1. same for y
+        d = np.arange(-sizes.max(), sizes.max())
+        in_square = (d >= -sizes[:, None]) & (d < sizes[:, None])
+        px = self.trace_x[lo:hi, None] + d
+        py = self.trace_y[lo:hi, None] + d
+        in_x = in_square & (px >= 0) & (px < xn - 1)
+        in_y = in_square & (py >= 0) & (py < yn - 1)
+        inside = in_y[:, :, None] & in_x[:, None, :]
+        stamp = np.broadcast_to(np.arange(hi - lo)[:, None, None], inside.shape)[inside]
+        pixel = (py[:, :, None] * xn + px[:, None, :])[inside]
+        # the last square on each pixel wins
+        order = np.lexsort((stamp, pixel))
+        pixel, stamp = pixel[order], stamp[order]
+        last = np.r_[pixel[1:] != pixel[:-1], True]
+        pixel, stamp = pixel[last], stamp[last]
+        colors = self.trace_colors[self.trace_n[lo:hi][stamp]]
+        image.reshape(-1, 3)[pixel] = np.maximum(base.reshape(-1, 3)[pixel], colors)
+        return image
+
 
 def main():
     # retina display 2880 x 1800
@@ -170,23 +202,14 @@ def main():
     print(M.shape, M.dtype)
     w = MP4Writer('x.mp4', fps, xn, yn, is_color=True)
     for frame in range(num_frames):
-        trace = mb.traceArray[frame]
-        # xdim, ydim = np.where(trace > 0)
-        # has_values = np.column_stack((xdim, ydim))
-        # has_values = list(zip(xdim, ydim))
-        # print(n, has_values)
+        # composite each frame as it is written, only one is ever in memory
+        x = mb.trace_frame(frame, M)
         # convert 3D to 4D with first axis as time/frames
-        #x = np.copy(np.expand_dims(M, axis=0))
-        x = np.copy(M)
-        x = np.maximum(x, trace)
         x = np.expand_dims(x, axis=0)
         if frame == 0:
             print(x.shape)
         w.write_frames(x)
-    '''
-    w.write_frames(mb.traceArray)
     w.commit()
-    '''
 
 #mb = MBrotProcessor()
 #mb.mbrot2(-1.76, 0.01, do_print=True)
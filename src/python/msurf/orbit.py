@@ -0,0 +1,181 @@
+'''
+Orbit engine: the histories c, z_1, z_2 ... of the orbits of seed points c, where
+z_1 = c * c + c, up to maxiter or the first point past the horizon (not kept).
+This is the orbit CurPointState shows in the display.
+
+All the seeds are iterated together on NumPy arrays, CHUNK iterations at a time
+and only as far as the history is read, into arrays preallocated for maxiter.
+np.empty doesn't touch the memory, so looking at the start of an orbit costs the
+same with maxiter in the millions.
+
+precision 'fp64' iterates in float64. 'tfm' iterates in the fixed point of
+fp_numpy, the arithmetic of the tfm kernel, for points at a deep zoom where a
+float64 orbit goes wrong (see cpu_backend.precision_for). the history is float64
+either way. a deep seed doesn't fit in a float64 either: pass it as fixed_seeds,
+like cpu_backend.pixel_c_fixed places the pixels of a frame.
+
+    orbits = Orbits(seeds, maxiter)
+    orbits.window(0, 100, 50)  # points 100 to 149 of the first seed's orbit
+'''
+
+import fp_numpy
+import numpy as np
+
+
+CHUNK = {'fp64': 4096, 'tfm': 256}  # iterations per compute() step
+
+class Orbits:
+    '''
+    history[i, :lengths[i]] are the points of seed i computed so far.
+    seeds still iterating all have the same length, the others are done
+    '''
+    def __init__(self, seeds, maxiter, precision='fp64', horizon=2.0, fixed_seeds=None):
+        '''
+        fixed_seeds: (c_real, c_imag) fp_numpy arrays iterated instead of seeds with 'tfm'.
+        seeds are then only their nearest float64 values, for history[:, 0]
+        '''
+        seeds = np.atleast_1d(np.asarray(seeds, dtype=np.complex128))
+        self.maxiter = maxiter
+        self.precision = precision
+        self.horizon = horizon
+        self.history = np.empty((len(seeds), maxiter + 1), dtype=np.complex128)
+        self.history[:, 0] = seeds
+        self.lengths = np.ones(len(seeds), dtype=np.int64)
+        self.escaped = np.zeros(len(seeds), dtype=np.bool_)
+        # the seeds still iterating and their last z
+        self.active = np.arange(len(seeds))
+        if precision == 'tfm':
+            if fixed_seeds is not None:
+                self.c_real, self.c_imag = fixed_seeds
+            else:
+                self.c_real = fp_numpy.from_double(seeds.real)
+                self.c_imag = fp_numpy.from_double(seeds.imag)
+            self.z_real = self.c_real.copy()
+            self.z_imag = self.c_imag.copy()
+            self.z_real_squared = fp_numpy.sqr_scaled(self.z_real)
+            self.z_imag_squared = fp_numpy.sqr_scaled(self.z_imag)
+            self.horizon_squared = fp_numpy.from_double(np.float64(horizon * horizon))
+        else:
+            self.c_real, self.c_imag = seeds.real.copy(), seeds.imag.copy()
+            self.z_real, self.z_imag = seeds.real.copy(), seeds.imag.copy()
+
+    def computed(self):
+        '''
+        length of the seeds still iterating
+        '''
+        return int(self.lengths[self.active[0]]) if len(self.active) else self.maxiter + 1
+
+    def compute(self, end):
+        '''
+        compute every orbit to end points, or to its end if that comes first
+        '''
+        end = min(end, self.maxiter + 1)
+        while len(self.active) and self.computed() < end:
+            count = min(CHUNK[self.precision], end - self.computed())
+            if self.precision == 'tfm':
+                self.steps_tfm(count)
+            else:
+                self.steps_fp64(count)
+
+    def steps_fp64(self, count):
+        '''
+        in real arithmetic like the kernels. it rounds like python's complex z * z + c,
+        numpy's complex multiply doesn't always
+        '''
+        if len(self.active) == 1:
+            return self.steps_fp64_single(count)
+        active = self.active
+        zr, zi, cr, ci = self.z_real, self.z_imag, self.c_real, self.c_imag
+        n = self.computed()
+        for _ in range(count):
+            zr, zi = zr * zr - zi * zi + cr, 2.0 * zr * zi + ci
+            out = np.hypot(zr, zi) > self.horizon
+            if out.any():
+                self.escaped[active[out]] = True
+                self.lengths[active[out]] = n
+                keep = ~out
+                active, zr, zi, cr, ci = active[keep], zr[keep], zi[keep], cr[keep], ci[keep]
+                if not len(active):
+                    break
+            self.history[active, n] = zr + 1j * zi
+            n += 1
+        self.lengths[active] = n
+        self.active = active
+        self.z_real, self.z_imag, self.c_real, self.c_imag = zr, zi, cr, ci
+
+    def steps_fp64_single(self, count):
+        '''
+        steps_fp64 for a single seed, the usual case: plain floats are many times
+        faster than numpy calls on arrays of one
+        '''
+        index = self.active[0]
+        zr, zi = float(self.z_real[0]), float(self.z_imag[0])
+        cr, ci = float(self.c_real[0]), float(self.c_imag[0])
+        horizon = self.horizon
+        start = self.computed()
+        points = []
+        for _ in range(count):
+            zr, zi = zr * zr - zi * zi + cr, 2.0 * zr * zi + ci
+            z = complex(zr, zi)
+            if abs(z) > horizon:
+                self.escaped[index] = True
+                self.active = self.active[:0]
+                break
+            points.append(z)
+        self.history[index, start:start + len(points)] = points
+        self.lengths[index] = start + len(points)
+        self.z_real[0], self.z_imag[0] = zr, zi
+
+    def steps_tfm(self, count):
+        '''
+        the loop of fp_numpy.iterate_active, keeping every z
+        '''
+        active = self.active
+        zr, zi, cr, ci = self.z_real, self.z_imag, self.c_real, self.c_imag
+        zr2, zi2 = self.z_real_squared, self.z_imag_squared
+        n = self.computed()
+        for _ in range(count):
+            # z_imag = 2 * z_real * z_imag + c_imag
+            zi = fp_numpy.add(fp_numpy.mul_scaled(fp_numpy.mul_2d(zr, 1), zi), ci)
+            # z_real = z_real**2 - z_imag**2 + c_real
+            zr = fp_numpy.add(fp_numpy.sub(zr2, zi2), cr)
+            zr2 = fp_numpy.sqr_scaled(zr)
+            zi2 = fp_numpy.sqr_scaled(zi)
+            out = fp_numpy.cmp(fp_numpy.add(zr2, zi2), self.horizon_squared) > 0
+            if out.any():
+                self.escaped[active[out]] = True
+                self.lengths[active[out]] = n
+                keep = ~out
+                active = active[keep]
+                zr, zi, cr, ci, zr2, zi2 = (x.take(keep) for x in (zr, zi, cr, ci, zr2, zi2))
+                if not len(active):
+                    break
+            self.history[active, n] = fp_numpy.to_double(zr) + 1j * fp_numpy.to_double(zi)
+            n += 1
+        self.lengths[active] = n
+        self.active = active
+        self.z_real, self.z_imag, self.c_real, self.c_imag = zr, zi, cr, ci
+        self.z_real_squared, self.z_imag_squared = zr2, zi2
+
+    def done(self, index):
+        return bool(self.escaped[index]) or self.lengths[index] == self.maxiter + 1
+
+    def escape_count(self, index):
+        '''
+        iterations before seed index escaped, or maxiter. None while still unknown
+        '''
+        return int(self.lengths[index]) - 1 if self.done(index) else None
+
+    def has(self, index, step):
+        '''
+        whether the orbit of seed index has a point step
+        '''
+        self.compute(step + 1)
+        return step < self.lengths[index]
+
+    def window(self, index, start, n):
+        '''
+        points start to start + n of the orbit of seed index, fewer past its end
+        '''
+        self.compute(start + n)
+        return self.history[index, start:min(start + n, self.lengths[index])]
@@ -0,0 +1,72 @@
+'''
+Cycle analysis of an orbit, an array of points like Orbits.history (orbit.py).
+
+find_cycle is Brent's cycle detection with a tolerance instead of equality. The
+saved point sits at 0, 1, 3, 7 ... (2^k - 1), and the 2^k points after it are
+compared to it in one numpy operation, so the work is linear in the length of
+the orbit with only log2(len(orbit)) numpy calls. A point within the tolerance
+of the saved point gives the period. Then:
+
+- the cycle starts at the first point that is within the tolerance of the point
+  one period later
+- the multiplier is |product of 2 z| over one trip around the cycle, the derivative
+  of the trip. below 1 the cycle is attracting, and the orbit converges onto it
+
+    cycle = find_cycle(orbit)
+    if cycle is not None:
+        print(cycle)  # period: 3  start: 27  dist: 4.1e-11  attracting
+'''
+
+import numpy as np
+
+
+TOLERANCE = 1e-10  # points closer than this are the same point of the cycle
+
+class Cycle:
+    '''
+    period: points in the cycle
+    start: index of the first point on the cycle
+    distance: how far the point at start is from the one a period later
+    multiplier: |derivative| of one trip around the cycle. attracting if < 1
+    '''
+    def __init__(self, period, start, distance, multiplier):
+        self.period = period
+        self.start = start
+        self.distance = distance
+        self.multiplier = multiplier
+
+    @property
+    def attracting(self):
+        return self.multiplier < 1.0
+
+    def __str__(self):
+        return (f'period: {self.period}  start: {self.start}  dist: {self.distance:.1e}  '
+                f'{"attracting" if self.attracting else "repelling"}')
+
+def find_period(orbit, tolerance=TOLERANCE):
+    '''
+    Brent: the period of the cycle the orbit reaches, or None if it doesn't come back within tolerance
+    '''
+    saved, window = 0, 1
+    while saved + 1 < len(orbit):
+        ahead = orbit[saved + 1:saved + 1 + window]
+        close = np.flatnonzero(np.abs(ahead - orbit[saved]) < tolerance)
+        if len(close):
+            return int(close[0]) + 1
+        saved += window
+        window *= 2
+    return None
+
+def find_cycle(orbit, tolerance=TOLERANCE):
+    '''
+    the Cycle the orbit converges to, or None
+    '''
+    orbit = np.asarray(orbit)
+    period = find_period(orbit, tolerance)
+    if period is None:
+        return None
+    distances = np.abs(orbit[period:] - orbit[:-period])
+    start = int(np.argmax(distances < tolerance))  # there is one, find_period found it
+    with np.errstate(divide='ignore'):
+        log_multiplier = np.sum(np.log(2.0 * np.abs(orbit[start:start + period])))
+    return Cycle(period, start, float(distances[start]), float(np.exp(log_multiplier)))
@@ -0,0 +1,117 @@
+'''
+Perturbation theory support for deep zooms.
+
+One reference orbit Z_n is computed exactly on the host with Python ints
+(fixed point, scaled by 2**bits). Every pixel then iterates only its
+difference dz_n from the reference in double precision on the device:
+
+    z_n = Z_n + dz_n
+    dz_n+1 = (2 * Z_n + dz_n) * dz_n + dc
+
+where dc is the pixel's offset from the reference c. When |z_n| < |dz_n| the
+delta has lost its precision (a "glitch"), so the pixel rebases: dz = z_n and
+it restarts at Z_0. The same happens when it runs off the end of the
+reference orbit. See mandelbrot_kernel_perturb.cl
+'''
+
+from math import ceil, log2
+import numpy as np
+
+
+def to_fixed(value, bits):
+    '''
+    exact conversion of a float to a fixed point int scaled by 2**bits
+    (floors if value has more than bits fractional bits)
+    '''
+    numerator, denominator = float(value).as_integer_ratio()
+    return (numerator << bits) // denominator
+
+def bits_for_step_size(step_size):
+    '''
+    fixed point precision needed for a reference orbit at this step size.
+    keep 40 bits below the pixel size
+    '''
+    return max(64, ceil(-log2(step_size)) + 40)
+
+class ReferenceOrbit:
+    '''
+    a reference orbit at c = (cx + cy*i) / 2**bits
+
+    orbit is the orbit as complex128 for the device. it ends with the first point
+    outside the horizon, or continues up to the requested maxiter
+    '''
+    def __init__(self, cx, cy, bits, horizon=2.0):
+        self.cx = cx
+        self.cy = cy
+        self.bits = bits
+        self.horizon_squared = to_fixed(horizon * horizon, bits)
+        # current point, fixed point
+        self.zr = 0
+        self.zi = 0
+        self.escaped = False
+        self.orbit = np.zeros((1,), dtype=np.complex128)  # Z_0 = 0
+        self.length = 1
+
+    @classmethod
+    def for_frame(cls, frame, horizon=2.0):
+        '''
+        reference at the center pixel of the frame
+        '''
+        step_size = frame.step_size()
+        bits = bits_for_step_size(step_size)
+        step_fixed = to_fixed(step_size, bits)
+        cx = to_fixed(frame.xmin, bits) + (frame.width // 2) * step_fixed
+        cy = to_fixed(frame.ymin, bits) + (frame.height // 2) * step_fixed
+        return cls(cx, cy, bits, horizon)
+
+    def extend(self, maxiter):
+        '''
+        make the orbit at least maxiter + 1 long, unless it escapes first
+        '''
+        if self.escaped or self.length > maxiter:
+            return
+        bits = self.bits
+        orbit = np.zeros((maxiter + 1,), dtype=np.complex128)
+        orbit[:self.length] = self.orbit[:self.length]
+        zr, zi, cx, cy = self.zr, self.zi, self.cx, self.cy
+        n = self.length
+        while n <= maxiter:
+            zr2 = (zr * zr) >> bits
+            zi2 = (zi * zi) >> bits
+            zi = ((zr * zi) >> (bits - 1)) + cy
+            zr = zr2 - zi2 + cx
+            orbit[n] = complex(zr / (1 << bits), zi / (1 << bits))
+            n += 1
+            if ((zr * zr + zi * zi) >> bits) > self.horizon_squared:
+                self.escaped = True
+                break
+        self.zr, self.zi = zr, zi
+        self.orbit = orbit[:n]
+        self.length = n
+
+    def center(self):
+        '''
+        the reference c as the nearest doubles (real, imag)
+        '''
+        scale = 1 << self.bits
+        return self.cx / scale, self.cy / scale
+
+    def pixel_position(self, frame):
+        '''
+        where the reference c is in the frame's pixels. (x, y) as floats,
+        may be outside the frame
+        '''
+        step_fixed = to_fixed(frame.step_size(), self.bits)
+        x = (self.cx - to_fixed(frame.xmin, self.bits)) / step_fixed
+        y = (self.cy - to_fixed(frame.ymin, self.bits)) / step_fixed
+        return x, y
+
+    def usable_for(self, frame):
+        '''
+        True if this reference has enough precision for the frame and isn't too far away.
+        the device state is relative to the reference, so reusing it keeps the state valid
+        '''
+        if self.bits < bits_for_step_size(frame.step_size()):
+            return False
+        x, y = self.pixel_position(frame)
+        return -frame.width <= x <= 2 * frame.width and -frame.height <= y <= 2 * frame.height
@@ -0,0 +1,89 @@
+'''
+OpenCL program sources and an on-disk cache of compiled program binaries.
+
+Compiling the TFM program takes seconds. After the first build the binary for the
+device is saved in cache_dir(), named by a hash of the source, the device and the
+build options, and later builds load it instead of compiling.
+
+Set MSURF_KERNEL_CACHE to use another directory, or to an empty string to turn the
+cache off.
+'''
+
+import hashlib
+import os
+import pyopencl as cl
+
+
+CACHE_DIR_ENV = 'MSURF_KERNEL_CACHE'
+PACKAGE_DIR = os.path.dirname(os.path.realpath(__file__))
+# the TFM library is copied into the package by setup.py. in a source checkout it is
+# still in the repository's include/ and src/c/
+SOURCE_DIRS = (
+    PACKAGE_DIR,
+    os.path.join(PACKAGE_DIR, '..', '..', '..', 'include'),
+    os.path.join(PACKAGE_DIR, '..', '..', '..', 'src', 'c'),
+)
+
+def read_source(filename):
+    '''
+    contents of a kernel source file, from the package data
+    '''
+    for source_dir in SOURCE_DIRS:
+        path = os.path.join(source_dir, filename)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return f.read()
+    raise FileNotFoundError(f'kernel source {filename} not found in {SOURCE_DIRS}')
+
+def cache_dir():
+    '''
+    directory for program binaries, or '' if caching is off
+    '''
+    path = os.environ.get(CACHE_DIR_ENV)
+    if path is None:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        path = os.path.join(base, 'msurf', 'kernels')
+    return path
+
+def program_key(source, device, options):
+    '''
+    hex digest identifying one build: the source, the device and driver, and the options
+    '''
+    digest = hashlib.sha256()
+    for part in (source, device.platform.name, device.platform.version, device.name,
+                 device.version, device.driver_version, ' '.join(options)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def build_program(ctx, source, options=()):
+    '''
+    build source for the context's device, loading the binary from the cache when
+    there is one and saving it when there isn't
+    '''
+    options = list(options)
+    path = cache_dir()
+    if not path or len(ctx.devices) != 1:
+        return cl.Program(ctx, source).build(options=options)
+    device = ctx.devices[0]
+    binary_path = os.path.join(path, program_key(source, device, options) + '.bin')
+    if os.path.exists(binary_path):
+        try:
+            with open(binary_path, 'rb') as f:
+                binary = f.read()
+            return cl.Program(ctx, [device], [binary]).build(options=options)
+        except (OSError, cl.Error) as e:
+            # unreadable or rejected by the driver. rebuild and overwrite it
+            print(f'build_program: ignoring cached binary {binary_path}: {e}')
+    prg = cl.Program(ctx, source).build(options=options)
+    try:
+        os.makedirs(path, exist_ok=True)
+        # write to a temporary name first so other processes never load half a file
+        tmp_path = f'{binary_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(prg.get_info(cl.program_info.BINARIES)[0])
+        os.replace(tmp_path, binary_path)
+        print(f'build_program: cached {binary_path}')
+    except OSError as e:
+        print(f'build_program: could not cache binary in {path}: {e}')
+    return prg
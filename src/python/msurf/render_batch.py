@@ -0,0 +1,169 @@
+'''
+Headless batch renderer: msurf-render
+
+Renders the views of a manifest to image files, without Tk. One line per view:
+
+    # comment
+    poster.png  {'xcenter': -0.75, 'ycenter': 0.0, 'step_size': 0.0025, 'maxiter': 1000}
+    thumb.jpg   160x120  -2.0 1.0 -1.0 1.0 500
+
+- the output file, relative to --out-dir. the format comes from the extension
+- optionally WIDTHxHEIGHT, otherwise --width and --height
+- the view: a bookmark string from MandelbrotParams.bookmark_string (the display's
+  mandelbrot_bookmark.txt), or xmin xmax ymin ymax [maxiter] like MandelbrotParams.from_bounds
+
+Every view is rendered by one MandelbrotFuncs, so the kernels are built once. Without
+an OpenCL device, or with --cpu-workers, the views are rendered on every core by a
+tile_pool.TilePool instead. --subdivide renders them with Mariani-Silver subdivision
+(MandelbrotFuncs.mandelbrot_set_subdivided), on OpenCL or the NumPy backend. The
+encoding and writing run in a thread pool while the next view renders. A file is
+written under a temporary name and renamed when complete, so a rerun skips the views
+that are done (resume) unless --force is given.
+
+    msurf-render views.txt --out-dir posters --jobs 4
+'''
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from MandelbrotFuncs import MandelbrotFuncs
+from MandelbrotParams import MandelbrotParams
+import os
+from PIL import Image
+import sys
+from tile_pool import TilePool
+import time
+
+
+DEFAULT_WIDTH = 1200
+DEFAULT_HEIGHT = 800
+DEFAULT_MAXITER = 1000
+JPEG_QUALITY = 95
+
+class ManifestError(ValueError):
+    pass
+
+def parse_view(line, width, height, maxiter=DEFAULT_MAXITER):
+    '''
+    one manifest line (see the module docstring) to (filename, params)
+    '''
+    filename, view = (line.split(None, 1) + [''])[:2]
+    size, rest = (view.split(None, 1) + [''])[:2]
+    if 'x' in size and size.replace('x', '', 1).isdigit():
+        width, height = (int(v) for v in size.split('x'))
+        view = rest
+    view = view.strip()
+    if not view:
+        raise ManifestError(f'expected "filename [WIDTHxHEIGHT] view": {line!r}')
+    if view.startswith('{'):
+        return filename, MandelbrotParams.from_bookmark_string(view, width, height)
+    values = view.split()
+    if len(values) not in (4, 5):
+        raise ManifestError(f'expected a bookmark string or xmin xmax ymin ymax [maxiter]: {line!r}')
+    xmin, xmax, ymin, ymax = (float(v) for v in values[:4])
+    if len(values) == 5:
+        maxiter = int(values[4])
+    return filename, MandelbrotParams.from_bounds(xmin, xmax, ymin, ymax, width, height, maxiter)
+
+def read_manifest(path, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, maxiter=DEFAULT_MAXITER):
+    '''
+    returns [(filename, params)] for the views of the manifest at path
+    '''
+    views = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            try:
+                views.append(parse_view(line, width, height, maxiter))
+            except (ValueError, SyntaxError, KeyError, TypeError) as e:
+                raise ManifestError(f'{path}:{line_number}: {e}') from e
+    return views
+
+def write_image(image_array, path):
+    '''
+    worker: encode and write one image. the rename makes it appear complete or not at all
+    '''
+    root, ext = os.path.splitext(path)
+    tmp_path = f'{root}.tmp{ext}'  # keep the extension, PIL picks the format from it
+    image = Image.fromarray(image_array, 'RGB')
+    if ext.lower() in ('.jpg', '.jpeg'):
+        image.save(tmp_path, quality=JPEG_QUALITY)
+    else:
+        image.save(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+def render_batch(views, out_dir='.', jobs=4, force=False, funcs=None, cpu_workers=0, subdivide=False):
+    '''
+    render [(filename, params)] into out_dir. returns the paths written
+    views whose file exists are skipped unless force
+    cpu_workers > 0 renders on that many processes instead of OpenCL. so does a funcs
+    without an OpenCL device, on every core, unless subdivide
+    subdivide renders with funcs.mandelbrot_set_subdivided, see subdivide.py
+    '''
+    pool = None
+    if cpu_workers > 0:
+        pool = TilePool(cpu_workers)
+    else:
+        if funcs is None:
+            funcs = MandelbrotFuncs()
+        funcs.use_subdivision = subdivide
+        if funcs.cpu_backend is not None and not subdivide:
+            pool = TilePool()
+    start = time.time()
+    written = []
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            pending = []
+            for i, (filename, params) in enumerate(views):
+                path = os.path.join(out_dir, filename)
+                if not force and os.path.exists(path):
+                    print(f'render_batch: [{i + 1}/{len(views)}] {path} exists, skipped')
+                    continue
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                view_start = time.time()
+                if pool is not None:
+                    image_array, _ = pool.render(params)
+                else:
+                    image_array = funcs.mandelbrot_set_opencl(params)
+                print(f'render_batch: [{i + 1}/{len(views)}] {path}  {params.width}x{params.height}  '
+                      f'maxiter: {params.maxiter}  {time.time() - view_start:.2f}s')
+                pending.append(executor.submit(write_image, image_array, path))
+                # don't let the images pile up if the writers fall behind
+                while len(pending) > 2 * jobs:
+                    written.append(pending.pop(0).result())
+            written += [future.result() for future in pending]
+    finally:
+        if pool is not None:
+            pool.close()
+    print(f'render_batch: wrote {len(written)} of {len(views)} views in {time.time() - start:.2f}s')
+    return written
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='msurf-render', description='Render the views of a manifest to image files.')
+    parser.add_argument('manifest', help='one view per line: filename [WIDTHxHEIGHT] bookmark-string | xmin xmax ymin ymax [maxiter]')
+    parser.add_argument('--out-dir', default='.', help='directory for the images (default: current)')
+    parser.add_argument('--width', type=int, default=DEFAULT_WIDTH, help=f'default image width (default: {DEFAULT_WIDTH})')
+    parser.add_argument('--height', type=int, default=DEFAULT_HEIGHT, help=f'default image height (default: {DEFAULT_HEIGHT})')
+    parser.add_argument('--maxiter', type=int, default=DEFAULT_MAXITER,
+                        help=f'maxiter for views given by bounds without one (default: {DEFAULT_MAXITER})')
+    parser.add_argument('--jobs', type=int, default=4, help='image writer threads (default: 4)')
+    parser.add_argument('--force', action='store_true', help='render views whose file already exists')
+    parser.add_argument('--cpu-workers', type=int, default=0,
+                        help='render on this many processes instead of OpenCL (default: 0, OpenCL if there is a device)')
+    parser.add_argument('--subdivide', action='store_true',
+                        help='Mariani-Silver subdivision: fill rectangles whose border has one count instead of iterating them')
+    args = parser.parse_args(argv)
+    if args.subdivide and args.cpu_workers:
+        parser.error('--subdivide renders in this process, it can\'t be used with --cpu-workers')
+    try:
+        views = read_manifest(args.manifest, args.width, args.height, args.maxiter)
+    except (OSError, ManifestError) as e:
+        print(f'msurf-render: {e}', file=sys.stderr)
+        return 2
+    render_batch(views, args.out_dir, args.jobs, args.force, cpu_workers=args.cpu_workers, subdivide=args.subdivide)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
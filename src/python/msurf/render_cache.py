@@ -0,0 +1,264 @@
+'''
+Render cache: the iteration state of finished frames, so going back to a view
+(load_bookmark, reset_image, maxiter back and forth) doesn't iterate it again.
+
+An entry is the whole state of a frame, ITER_STATE_PLANES planes of uint32 (the
+counts and each kernel's own z, see MandelbrotFuncs), with every pixel iterated to
+at least maxiter. It is found by the view: the hi/lo fixed point xmin, ymin and
+step_size from double_to_fp_int_array, width, height and the kernel, so views that
+differ below a float's precision don't share entries. see MandelbrotFuncs.render_view
+
+A deeper state gives the same image at a lower maxiter (the counts are clamped to
+maxiter when painting), and carries on from where it stopped at a higher one, so
+only the deepest entry of a view is kept and get() returns it.
+
+Two tiers:
+- memory: an LRU of up to memory_budget bytes
+- disk: one compressed .npz per entry in cache_dir(), written after put() by a
+  writer thread, so the render doesn't wait for it.
+  put() may be given the state before it is filled, with an event to wait for
+  (the device to host copy). the writer and get() wait for it, the render doesn't. the least recently used files
+  are deleted when they pass disk_budget bytes. a disk hit moves the entry back
+  into memory
+
+Set MSURF_RENDER_CACHE to use another directory, or to an empty string to keep
+the cache in memory only.
+
+    cache = RenderCache()
+    cache.put(view, maxiter, state)  # or put(view, maxiter, state, ready)
+    entry = cache.get(view)  # (maxiter, state) or None
+'''
+
+from collections import OrderedDict
+import hashlib
+import numpy as np
+import os
+import queue
+import threading
+import zipfile
+
+
+CACHE_DIR_ENV = 'MSURF_RENDER_CACHE'
+MEMORY_BUDGET = 256 << 20  # bytes of state kept in memory
+DISK_BUDGET = 2 << 30  # bytes of .npz files kept on disk
+
+def cache_dir():
+    '''
+    directory for the disk tier, or '' if it is off
+    '''
+    path = os.environ.get(CACHE_DIR_ENV)
+    if path is None:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        path = os.path.join(base, 'msurf', 'renders')
+    return path
+
+def view_digest(view):
+    '''
+    hex digest naming the files of a view
+    '''
+    return hashlib.sha256(repr(view).encode('utf-8')).hexdigest()
+
+class RenderCache:
+    '''
+    view -> (maxiter, state). view is a tuple of ints and strings, see the module docstring
+    '''
+    def __init__(self, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET, path=None):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.path = cache_dir() if path is None else path
+        self.entries = OrderedDict()  # view -> (maxiter, state), least recently used first
+        self.memory_size = 0
+        # entries put() but not on disk yet, view -> (maxiter, state, ready). shared with the writer thread
+        self.saving = {}
+        self.ready = {}  # view -> event of a state put() that may not be filled yet
+        self.saving_lock = threading.Lock()
+        self.save_queue = queue.Queue()
+        self.writer = None
+
+    def get(self, view):
+        '''
+        (maxiter, state) of the deepest entry for view, or None
+        '''
+        entry = self.entries.get(view)
+        if entry is not None:
+            self.entries.move_to_end(view)
+            self.wait_ready(view)
+            return entry
+        with self.saving_lock:
+            entry = self.saving.get(view)
+        if entry is not None:
+            maxiter, state, ready = entry
+            if ready is not None:
+                ready.wait()
+            entry = (maxiter, state)
+        else:
+            entry = self.load(view)
+        if entry is not None:
+            self.remember(view, *entry)
+        return entry
+
+    def put(self, view, maxiter, state, ready=None):
+        '''
+        keep state, iterated to maxiter, unless there is a deeper one already. the caller
+        must not change state afterwards
+        ready is None or an event (with a wait() method) completed once state is filled
+        '''
+        entry = self.entries.get(view)
+        cached_maxiter = entry[0] if entry is not None else self.disk_maxiter(view)
+        if cached_maxiter >= maxiter:
+            return
+        self.remember(view, maxiter, state)
+        with self.saving_lock:
+            if ready is not None:
+                self.ready[view] = ready
+            else:
+                self.ready.pop(view, None)
+        if not self.path:
+            return
+        with self.saving_lock:
+            self.saving[view] = (maxiter, state, ready)
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write, name='RenderCache.write', daemon=True)
+            self.writer.start()
+        self.save_queue.put(view)
+
+    def write(self):
+        '''
+        writer thread: save the entries put() in the disk tier
+        '''
+        while True:
+            view = self.save_queue.get()
+            with self.saving_lock:
+                entry = self.saving.get(view)
+            if entry is not None:
+                maxiter, state, ready = entry
+                if ready is not None:
+                    ready.wait()
+                self.save(view, maxiter, state)
+                with self.saving_lock:
+                    if self.saving.get(view) is entry:
+                        del self.saving[view]
+            self.save_queue.task_done()
+
+    def wait_ready(self, view):
+        '''
+        wait until the state of view put() with an event is filled
+        '''
+        with self.saving_lock:
+            ready = self.ready.get(view)
+        if ready is None:
+            return
+        ready.wait()
+        with self.saving_lock:
+            if self.ready.get(view) is ready:
+                del self.ready[view]
+
+    def flush(self):
+        '''
+        wait until every entry put() is on disk
+        '''
+        self.save_queue.join()
+
+    def remember(self, view, maxiter, state):
+        '''
+        the memory tier. evict the least recently used entries past memory_budget
+        '''
+        if view in self.entries:
+            self.memory_size -= self.entries.pop(view)[1].nbytes
+        self.entries[view] = (maxiter, state)
+        self.memory_size += state.nbytes
+        while self.memory_size > self.memory_budget and len(self.entries) > 1:
+            old_view, (_, old_state) = self.entries.popitem(last=False)
+            self.memory_size -= old_state.nbytes
+            with self.saving_lock:
+                self.ready.pop(old_view, None)  # the writer keeps its own
+
+    def files(self, view):
+        '''
+        paths of the disk entries of view. normally one
+        '''
+        if not self.path or not os.path.isdir(self.path):
+            return []
+        prefix = view_digest(view) + '-'
+        return [os.path.join(self.path, name) for name in os.listdir(self.path)
+                if name.startswith(prefix) and name.endswith('.npz')]
+
+    def disk_maxiter(self, view):
+        '''
+        maxiter of the deepest entry of view on disk or on its way there, 0 if none.
+        from the file names, without reading them
+        '''
+        with self.saving_lock:
+            entry = self.saving.get(view)
+        if entry is not None:
+            return entry[0]
+        maxiters = [int(os.path.basename(path)[:-len('.npz')].rsplit('-', 1)[1]) for path in self.files(view)]
+        return max(maxiters, default=0)
+
+    def load(self, view):
+        '''
+        the disk tier: (maxiter, state) or None. unreadable files are deleted
+        '''
+        for path in self.files(view):
+            try:
+                with np.load(path) as npz:
+                    if str(npz['view']) != repr(view):
+                        continue  # another view with the same digest
+                    entry = (int(npz['maxiter']), npz['state'])
+                os.utime(path)  # most recently used
+                print(f'RenderCache: loaded {path}')
+                return entry
+            except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+                print(f'RenderCache: removing unreadable {path}: {e}')
+                self.remove(path)
+        return None
+
+    def save(self, view, maxiter, state):
+        '''
+        write the entry to disk and drop the shallower ones of the view. the rename makes
+        the file appear complete or not at all. runs on the writer thread
+        '''
+        if not self.path:
+            return
+        path = os.path.join(self.path, f'{view_digest(view)}-{maxiter}.npz')
+        old_paths = self.files(view)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, view=repr(view), maxiter=maxiter, state=state)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # the memory tier still has it
+            print(f'RenderCache: could not save {path}: {e}')
+            return
+        for old_path in old_paths:
+            if old_path != path:
+                self.remove(old_path)
+        self.evict()
+
+    def evict(self):
+        '''
+        delete the least recently used files until the disk tier is within disk_budget
+        '''
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue  # removed meanwhile
+                files.append((stat.st_mtime, stat.st_size, os.path.join(self.path, name)))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_budget:
+                break
+            print(f'RenderCache: evicting {path}')
+            self.remove(path)
+            total -= size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,107 @@
+'''
+Background render thread for the interactive display.
+
+The tiles of a render are computed on a worker thread so a slow pass doesn't
+block Tk. Every submit() starts a new generation: the job in flight stops before
+its next kernel launch, and its finished tiles are dropped. The finished tiles
+go back through a queue; only the Tk thread may touch the image, so it calls
+poll() from master.after and pastes what comes back.
+
+    worker = RenderWorker(mandelbrot_funcs)
+    worker.submit(scheduler.tiles(copy(params)), scheduler.record)
+    ...
+    for x, y, tile_params, tile_array, tile_width, tile_height in worker.poll():
+        ... paste ...
+
+MandelbrotFuncs is not thread safe. Anything else that uses it (recolor_opencl)
+must hold worker.lock.
+'''
+
+import queue
+import threading
+import time
+
+
+class RenderWorker:
+    '''
+    one thread for the lifetime of the display. it is a daemon, so it doesn't keep
+    the process alive after Tk exits
+    '''
+    pending = None  # generation of the last job submitted, until the worker is done with it
+
+    def __init__(self, mandelbrot_funcs):
+        self.mandelbrot_funcs = mandelbrot_funcs
+        self.lock = threading.Lock()  # held while a tile is rendered
+        self.generation = 0
+        self.pending_lock = threading.Lock()  # pending is set by submit() and cleared by the worker
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='RenderWorker', daemon=True)
+        self.thread.start()
+
+    def submit(self, tile_iter, record=None):
+        '''
+        render the tiles of tile_iter, a generator like MandelbrotParams.tile_iter,
+        instead of whatever is in flight. record(tile_params, seconds) is called from the
+        worker thread after each tile. returns the new generation
+        '''
+        with self.pending_lock:
+            self.generation += 1
+            self.pending = self.generation
+        self.jobs.put((self.generation, tile_iter, record))
+        return self.generation
+
+    def cancel(self):
+        '''
+        stop the render in flight after its current tile, and drop its results
+        '''
+        with self.pending_lock:
+            self.generation += 1
+
+    def busy(self):
+        '''
+        true while the current generation has tiles left to render. set from submit()
+        on, so there is no gap while the worker picks the job up
+        '''
+        return self.pending == self.generation
+
+    def run(self):
+        while True:
+            generation, tile_iter, record = self.jobs.get()
+            if generation == self.generation:
+                try:
+                    self.render(generation, tile_iter, record)
+                except Exception as e:
+                    # the thread has to outlive a bad render
+                    print(f'RenderWorker: generation {generation} failed: {e!r}')
+            # else superseded before it started
+            with self.pending_lock:
+                if self.pending == generation:
+                    self.pending = None
+
+    def render(self, generation, tile_iter, record):
+        for x, y, tile_params, tile_width, tile_height in tile_iter:
+            if generation != self.generation:
+                print(f'RenderWorker: generation {generation} cancelled')
+                return
+            with self.lock:
+                start = time.time()
+                tile_array = self.mandelbrot_funcs.mandelbrot_set_opencl(tile_params)
+                seconds = time.time() - start
+            if record is not None:
+                record(tile_params, seconds)
+            self.results.put((generation, x, y, tile_params, tile_array, tile_width, tile_height))
+
+    def poll(self):
+        '''
+        the tiles finished since the last poll, for the current generation only:
+        a list of (x, y, tile_params, tile_array, tile_width, tile_height)
+        '''
+        tiles = []
+        while True:
+            try:
+                generation, *tile = self.results.get_nowait()
+            except queue.Empty:
+                return tiles
+            if generation == self.generation:
+                tiles.append(tuple(tile))
@@ -0,0 +1,82 @@
+'''
+Mariani-Silver subdivision.
+
+A rectangle of the frame (a tile from MandelbrotParams.tile_params) is iterated
+only on its border. If every border pixel has the same count, the inside takes that
+count without being iterated. If not, the rectangle is split in four along its
+middle row and column, and those lines are the only new pixels to iterate.
+Rectangles of min_size or less are iterated in full.
+
+The filled pixels are never iterated:
+- a border that escaped with one count fills the inside with it. this is the usual
+  heuristic, and it can miss a detail that doesn't reach the border
+- a border that is all ITER_INTERIOR fills the inside with ITER_INTERIOR. that is
+  exact, since the set has no holes
+- a border that is inside at this maxiter leaves the inside alone. it paints black,
+  and a higher maxiter iterates it
+
+Each level of rectangles is a single call of the backend's iterate(mask), so a
+level is one kernel launch. see MandelbrotFuncs.mandelbrot_set_subdivided
+'''
+
+from cpu_backend import ITER_INTERIOR
+from MandelbrotParams import MandelbrotParams
+import numpy as np
+
+
+MIN_SIZE = 16  # rectangles this wide or high are iterated in full
+
+def subdivide(params: MandelbrotParams, iterate, min_size=MIN_SIZE):
+    '''
+    params is the frame or a tile of it
+    iterate(mask) iterates the frame's pixels where mask is set and returns the counts
+    of the whole frame. both shape=(frame.height, frame.width), kernel orientation (row 0 is ymin)
+    returns (fill, filled): the counts of the pixels that were filled instead of
+    iterated, and the mask of them
+    '''
+    frame = params.get_frame()
+    shape = (frame.height, frame.width)
+    fill = np.zeros(shape, dtype=np.int32)
+    filled = np.zeros(shape, dtype=np.bool_)
+    mask = np.zeros(shape, dtype=np.bool_)
+    x, y, w, h = params.frame_x, params.frame_y, params.width, params.height
+    mask[y, x:x + w] = True
+    mask[y + h - 1, x:x + w] = True
+    mask[y:y + h, x] = True
+    mask[y:y + h, x + w - 1] = True
+    pending = [params]
+    level = 0
+    iterated = 0
+    while mask.any():
+        counts = iterate(mask)
+        iterated += int(mask.sum())
+        print(f'subdivide: level {level}  rects: {len(pending)}  pixels: {int(mask.sum())}')
+        mask[:] = False
+        split = []
+        for rect in pending:
+            x, y, w, h = rect.frame_x, rect.frame_y, rect.width, rect.height
+            if w < 3 or h < 3:
+                continue  # all border
+            inner = (slice(y + 1, y + h - 1), slice(x + 1, x + w - 1))
+            border = np.concatenate((counts[y, x:x + w], counts[y + h - 1, x:x + w],
+                                     counts[y + 1:y + h - 1, x], counts[y + 1:y + h - 1, x + w - 1]))
+            value = border[0]
+            if (value < 0 or value == ITER_INTERIOR) and (border == value).all():
+                fill[inner] = value
+                filled[inner] = True
+            elif (border >= 0).all():
+                pass  # inside at this maxiter
+            elif w <= min_size or h <= min_size:
+                mask[inner] = True
+            else:
+                # the middle row and column are shared by the four halves
+                mx, my = w // 2, h // 2
+                mask[y + my, x + 1:x + w - 1] = True
+                mask[y + 1:y + h - 1, x + mx] = True
+                for (rx, ry, rw, rh) in ((0, 0, mx + 1, my + 1), (mx, 0, w - mx, my + 1),
+                                         (0, my, mx + 1, h - my), (mx, my, w - mx, h - my)):
+                    split.append(rect.tile_params(rx, ry, rw, rh)[0])
+        pending = split
+        level += 1
+    print(f'subdivide: iterated {iterated}  filled {int(filled.sum())}  of {params.width * params.height} pixels')
+    return fill, filled
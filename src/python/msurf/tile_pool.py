@@ -0,0 +1,113 @@
+'''
+Multi-core CPU renderer for machines without a GPU.
+
+The tiles from MandelbrotParams.tile_params are rendered by a ProcessPoolExecutor.
+Every worker writes its tile straight into an image and a count array in
+multiprocessing.shared_memory, so only the tile position comes back through the
+pool, never pixel data. Each tile is computed with cpu_backend.render_counts.
+
+    with TilePool() as pool:
+        image, counts = pool.render(params)
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from cpu_backend import colorize_counts, render_counts
+from MandelbrotParams import MandelbrotParams
+from multiprocessing import shared_memory
+import numpy as np
+import os
+import time
+
+
+TILE_SIZE = 128  # small enough to keep every core busy to the end
+
+def _render_tile(tile: MandelbrotParams, image_name, counts_name, horizon):
+    '''
+    worker: render one tile into the shared image and counts of its frame
+    '''
+    frame = tile.get_frame()
+    xn, yn = frame.width, frame.height
+    image_shm = shared_memory.SharedMemory(name=image_name)
+    counts_shm = shared_memory.SharedMemory(name=counts_name)
+    try:
+        image = np.ndarray((yn, xn, 3), dtype=np.uint8, buffer=image_shm.buf)
+        counts = np.ndarray((yn, xn), dtype=np.int32, buffer=counts_shm.buf)
+        # both are stored top row first
+        tile_counts = render_counts(tile, horizon)[::-1]
+        rows = slice(yn - tile.frame_y - tile.height, yn - tile.frame_y)
+        cols = slice(tile.frame_x, tile.frame_x + tile.width)
+        counts[rows, cols] = tile_counts
+        image[rows, cols] = colorize_counts(tile_counts, tile)
+        # the views must go before the shared memory can be closed
+        del image, counts
+    finally:
+        image_shm.close()
+        counts_shm.close()
+    return tile.frame_x, tile.frame_y
+
+class TilePool:
+    '''
+    a pool of worker processes, kept for any number of renders. close() when done
+    '''
+    def __init__(self, workers=None, tile_size=TILE_SIZE):
+        self.workers = workers or os.cpu_count()
+        self.tile_size = tile_size
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def render(self, params: MandelbrotParams, horizon=2.0):
+        '''
+        render the whole frame of params at params.maxiter
+        returns (image, counts) like mandelbrot_set_opencl with output='rgb' and 'counts':
+        image shape=(height, width, 3) dtype=np.uint8, counts shape=(height, width) dtype=np.int32,
+        both top row first
+        '''
+        frame = params.get_frame()
+        xn, yn = frame.width, frame.height
+        start = time.time()
+        image_shm = shared_memory.SharedMemory(create=True, size=xn * yn * 3)
+        counts_shm = shared_memory.SharedMemory(create=True, size=xn * yn * 4)
+        try:
+            futures = []
+            for y in range(0, yn, self.tile_size):
+                for x in range(0, xn, self.tile_size):
+                    tile, _, _ = frame.tile_params(x, y, self.tile_size)
+                    tile.maxiter = params.maxiter
+                    futures.append(self.executor.submit(_render_tile, tile, image_shm.name,
+                                                        counts_shm.name, horizon))
+            for future in futures:
+                future.result()  # re-raises a worker's exception
+            image = np.ndarray((yn, xn, 3), dtype=np.uint8, buffer=image_shm.buf).copy()
+            counts = np.ndarray((yn, xn), dtype=np.int32, buffer=counts_shm.buf).copy()
+        finally:
+            image_shm.close()
+            image_shm.unlink()
+            counts_shm.close()
+            counts_shm.unlink()
+        print(f'TilePool.render: {len(futures)} tiles on {self.workers} workers in {time.time() - start:.2f}s')
+        return image, counts
+
+def render(params: MandelbrotParams, horizon=2.0, workers=None, tile_size=TILE_SIZE):
+    '''
+    one-off render with a temporary pool. returns (image, counts), see TilePool.render
+    '''
+    with TilePool(workers, tile_size) as pool:
+        return pool.render(params, horizon)
+
+def test(filename='tiles.png'):
+    params = MandelbrotParams.from_bounds(-2.0, 1.0, -1.0, 1.0, 1200, 800, 1000)
+    image, counts = render(params)
+    from PIL import Image
+    Image.fromarray(image, 'RGB').save(filename)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,137 @@
+'''
+Adaptive tile scheduler for the interactive display.
+
+A frame is rendered in passes of ITER_STEP more iterations (like
+MandelbrotParams.tile_iter), each pass one tile at a time so the UI can redraw in
+between. The scheduler sizes the tiles so each one takes about budget seconds:
+
+- the first pass is a grid sized from the measured throughput (pixel iterations
+  per second, kept across renders)
+- every later pass re-balances from the time each tile took in the pass before:
+  tiles over budget are split in four, runs of cheap tiles in a row are joined
+- within a pass the tiles closest to the focus go first: the cursor if set_focus
+  was called, otherwise the center
+
+    scheduler = TileScheduler()
+    for x, y, tile_params, tile_width, tile_height in scheduler.tiles(params):
+        start = time.time()
+        ... render tile_params ...
+        scheduler.record(tile_params, time.time() - start)
+'''
+
+from math import sqrt
+from MandelbrotParams import ITER_STEP, MandelbrotParams
+
+
+FRAME_BUDGET = 0.05  # seconds per tile
+MIN_TILE = 32  # pixels
+INITIAL_RATE = 10000000  # pixel iterations per second until a tile has been measured
+
+class TileScheduler:
+    '''
+    one per display. the measured rate carries over to the next render
+    '''
+    def __init__(self, budget=FRAME_BUDGET, min_tile=MIN_TILE):
+        self.budget = budget
+        self.min_tile = min_tile
+        self.rate = INITIAL_RATE
+        self.focus = None  # (x, y) in frame pixels, kernel orientation. None for the center
+        self.costs = {}  # (x, y, width, height) -> seconds, this pass
+
+    def set_focus(self, x, y):
+        '''
+        render the tiles around (x, y) first from the next tile on.
+        frame pixels, kernel orientation (y grows with the imaginary part)
+        '''
+        self.focus = (x, y)
+
+    def record(self, tile_params: MandelbrotParams, seconds):
+        '''
+        the time one tile from tiles() took to render
+        '''
+        if tile_params.stride > 1:
+            return  # a preview iterates a fraction of its area
+        rect = (tile_params.frame_x, tile_params.frame_y, tile_params.width, tile_params.height)
+        self.costs[rect] = seconds
+        if seconds > 0:
+            rate = tile_params.width * tile_params.height * ITER_STEP / seconds
+            self.rate = 0.7 * self.rate + 0.3 * rate
+
+    def grid(self, params: MandelbrotParams):
+        '''
+        rects (x, y, width, height) of square tiles sized for the budget at the measured rate
+        '''
+        tile_size = max(self.min_tile, int(sqrt(self.budget * self.rate / ITER_STEP)))
+        return [(x, y, min(tile_size, params.width - x), min(tile_size, params.height - y))
+                for y in range(0, params.height, tile_size)
+                for x in range(0, params.width, tile_size)]
+
+    def estimate(self, rect):
+        x, y, w, h = rect
+        cost = self.costs.get(rect)
+        return cost if cost is not None else w * h * ITER_STEP / self.rate
+
+    def rebalance(self, rects):
+        '''
+        next pass's rects from this pass's costs. ones over budget are split in four
+        (down to min_tile), then neighbours in a row are joined while under half the budget
+        '''
+        split = []
+        todo = [(rect, self.estimate(rect)) for rect in rects]
+        while todo:
+            rect, cost = todo.pop()
+            x, y, w, h = rect
+            if cost <= self.budget or (w < 2 * self.min_tile and h < 2 * self.min_tile):
+                split.append((rect, cost))
+                continue
+            # split the long sides only, so thin tiles don't get thinner
+            xs = (w // 2, w - w // 2) if w >= 2 * self.min_tile else (w,)
+            ys = (h // 2, h - h // 2) if h >= 2 * self.min_tile else (h,)
+            for j, rh in enumerate(ys):
+                for i, rw in enumerate(xs):
+                    part = (x + i * xs[0], y + j * ys[0], rw, rh)
+                    todo.append((part, cost * rw * rh / (w * h)))
+        split.sort(key=lambda r: (r[0][1], r[0][3], r[0][0]))
+        joined = []
+        for rect, cost in split:
+            if joined:
+                (px, py, pw, ph), pcost = joined[-1]
+                x, y, w, h = rect
+                if (py, ph) == (y, h) and px + pw == x and pcost + cost <= self.budget / 2:
+                    joined[-1] = ((px, py, pw + w, ph), pcost + cost)
+                    continue
+            joined.append((rect, cost))
+        return [rect for rect, _ in joined]
+
+    def ordered(self, params: MandelbrotParams, rects):
+        '''
+        rects sorted by the distance of their center from the focus
+        '''
+        fx, fy = self.focus if self.focus is not None else (params.width / 2, params.height / 2)
+        return sorted(rects, key=lambda r: (r[0] + r[2] / 2 - fx) ** 2 + (r[1] + r[3] / 2 - fy) ** 2)
+
+    def tiles(self, params: MandelbrotParams, preview=False):
+        '''
+        generator like MandelbrotParams.tile_iter: (x, y, tile_params, tile_width, tile_height)
+        for each tile of each pass, up to params.maxiter. call record() after each tile
+        with preview the coarse to fine levels of MandelbrotParams.preview_iter come first
+        '''
+        if preview:
+            yield from params.preview_iter()
+        rects = self.grid(params)
+        cur_iter = 0
+        while cur_iter < params.maxiter:
+            self.costs = {}
+            order = self.ordered(params, rects)
+            print(f'TileScheduler: pass to {min(cur_iter + ITER_STEP, params.maxiter)}  tiles: {len(order)}  '
+                  f'rate: {self.rate:.3g}')
+            while order:
+                x, y, w, h = order.pop(0)
+                tile_params, tile_width, tile_height = params.tile_params(x, y, w, h)
+                tile_params.maxiter = min(cur_iter + ITER_STEP, params.maxiter)
+                yield (x, y, tile_params, tile_width, tile_height)
+                if self.focus is not None:
+                    # the cursor may have moved
+                    order = self.ordered(params, order)
+            rects = self.rebalance(rects)
+            cur_iter += ITER_STEP
@@ -0,0 +1,168 @@
+'''
+Zoom movie renderer.
+
+The frames of a zoom into a fixed center shrink the view width exponentially, from
+start_width to end_width. Rendering every frame would compute the fractal fps times
+per second; instead only keyframes are rendered, one per halving of the width, each
+at 2x the video size. A frame between keyframe k (width start_width / 2^k) and k + 1
+is cut from keyframe k, which always has between 1 and 2 pixels per video pixel, and
+the middle of it, where keyframe k + 1 reaches, is cut from k + 1 for the finer detail.
+
+Keyframes are rendered as they are needed and only two are kept, and frames go to
+the encoder (MP4Writer, like numpy_mandelbrot) through a bounded queue on a writer
+thread. So memory doesn't grow with the length of the video.
+
+    python zoom_video.py --center -0.743643887037151 0.131825904205330 --end-width 1e-10 --seconds 30
+'''
+
+import argparse
+from math import ceil, floor, log2
+from MandelbrotFuncs import MandelbrotFuncs
+from MandelbrotParams import MandelbrotParams
+from MP4Writer import MP4Writer
+import numpy as np
+from PIL import Image
+import queue
+import threading
+import time
+
+
+OVERSIZE = 2  # keyframe pixels per video pixel. a keyframe is used down to 1:1, half its width
+QUEUE_SIZE = 16  # frames waiting for the encoder
+
+class ZoomVideo:
+    '''
+    a zoom from start_width to end_width (widths of the view in the complex plane)
+    into center, over num_frames frames of size (width, height)
+    '''
+    def __init__(self, center, start_width, end_width, num_frames, width, height, maxiter, funcs=None):
+        self.center = center
+        self.start_width = start_width
+        self.end_width = end_width
+        self.num_frames = num_frames
+        self.width = width
+        self.height = height
+        self.maxiter = maxiter
+        self.funcs = funcs if funcs is not None else MandelbrotFuncs()
+        self.keyframes = {}  # index -> PIL image, at most two
+        # the keyframe of the last frame. no finer one is needed
+        self.last_key = max(0, floor(log2(start_width / end_width) + 1e-9))
+        self.rendered = 0
+
+    def frame_width(self, n):
+        '''
+        view width of frame n: exponential, so the zoom speed looks constant
+        '''
+        if self.num_frames == 1:
+            return self.start_width
+        return self.start_width * (self.end_width / self.start_width) ** (n / (self.num_frames - 1))
+
+    def key_width(self, k):
+        return self.start_width / 2 ** k
+
+    def keyframe(self, k):
+        '''
+        keyframe k as a PIL image, rendered on first use. older ones are dropped
+        '''
+        if k not in self.keyframes:
+            key_width = self.key_width(k)
+            xn, yn = self.width * OVERSIZE, self.height * OVERSIZE
+            key_height = key_width * yn / xn
+            cx, cy = self.center
+            params = MandelbrotParams(cx - key_width / 2, cx + key_width / 2, cy - key_height / 2, cy + key_height / 2,
+                                      xn, yn, self.maxiter)
+            start = time.time()
+            self.keyframes[k] = Image.fromarray(self.funcs.mandelbrot_set_opencl(params), 'RGB')
+            self.rendered += 1
+            print(f'ZoomVideo.keyframe: {k}  width: {key_width:.6g}  {time.time() - start:.2f}s')
+            for old in [i for i in self.keyframes if i < k - 1]:
+                del self.keyframes[old]
+        return self.keyframes[k]
+
+    def resample(self, key, key_width, frame_width, box):
+        '''
+        the part box=(x0, y0, x1, y1) of a frame of frame_width, in video pixels,
+        cut from a keyframe of key_width. both share the center
+        '''
+        scale = frame_width / self.width / (key_width / key.width)  # keyframe pixels per video pixel
+        kx, ky = key.width / 2, key.height / 2
+        x0, y0, x1, y1 = box
+        key_box = (kx + (x0 - self.width / 2) * scale, ky + (y0 - self.height / 2) * scale,
+                   kx + (x1 - self.width / 2) * scale, ky + (y1 - self.height / 2) * scale)
+        return key.resize((x1 - x0, y1 - y0), Image.Resampling.BICUBIC, box=key_box)
+
+    def frame(self, n):
+        '''
+        frame n, shape=(height, width, 3) dtype=np.uint8
+        '''
+        frame_width = self.frame_width(n)
+        # the keyframe at or just wider than the frame. the rounding keeps a keyframe's own frame on it
+        k = min(self.last_key, max(0, floor(log2(self.start_width / frame_width) + 1e-9)))
+        image = self.resample(self.keyframe(k), self.key_width(k), frame_width, (0, 0, self.width, self.height))
+        # the finer keyframe covers the middle of the frame
+        inner_width = self.key_width(k + 1)
+        if k < self.last_key:
+            half_x = self.width / 2 * inner_width / frame_width
+            half_y = self.height / 2 * inner_width / frame_width
+            box = (ceil(self.width / 2 - half_x), ceil(self.height / 2 - half_y),
+                   floor(self.width / 2 + half_x), floor(self.height / 2 + half_y))
+            if box[2] > box[0] and box[3] > box[1]:
+                image.paste(self.resample(self.keyframe(k + 1), inner_width, frame_width, box), box[:2])
+        return np.asarray(image)
+
+    def render(self, filename, fps):
+        '''
+        render every frame into an mp4 at filename
+        '''
+        frames = queue.Queue(maxsize=QUEUE_SIZE)
+        writer = MP4Writer(filename, fps, self.width, self.height, is_color=True)
+        errors = []
+        def encode():
+            try:
+                while (image := frames.get()) is not None:
+                    writer.write_frames(np.expand_dims(image, axis=0))
+                writer.commit()
+            except Exception as e:
+                errors.append(e)
+                while frames.get() is not None:
+                    pass  # keep the renderer from blocking on a full queue
+        thread = threading.Thread(target=encode, name='ZoomVideo.encode')
+        thread.start()
+        start = time.time()
+        try:
+            for n in range(self.num_frames):
+                if errors:
+                    break
+                frames.put(self.frame(n))
+        finally:
+            frames.put(None)
+            thread.join()
+        if errors:
+            raise errors[0]
+        print(f'ZoomVideo.render: {self.num_frames} frames from {self.rendered} keyframes '
+              f'in {time.time() - start:.2f}s')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render a zoom movie into the Mandelbrot set.')
+    parser.add_argument('--center', type=float, nargs=2, metavar=('X', 'Y'), default=(-0.743643887037151, 0.131825904205330))
+    parser.add_argument('--bookmark', help='zoom to a bookmark file from the display instead (center, end width and maxiter)')
+    parser.add_argument('--start-width', type=float, default=3.0)
+    parser.add_argument('--end-width', type=float, default=1e-6)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--fps', type=int, default=24)
+    parser.add_argument('--size', default='1440x900', help='WIDTHxHEIGHT of the video')
+    parser.add_argument('--maxiter', type=int, default=1000)
+    parser.add_argument('--out', default='zoom.mp4')
+    args = parser.parse_args(argv)
+    width, height = (int(v) for v in args.size.split('x'))
+    center, end_width, maxiter = args.center, args.end_width, args.maxiter
+    if args.bookmark:
+        params = MandelbrotParams.from_bookmark_string(open(args.bookmark).read(), width, height)
+        center = ((params.xmin + params.xmax) / 2, (params.ymin + params.ymax) / 2)
+        end_width, maxiter = params.xmax - params.xmin, params.maxiter
+    video = ZoomVideo(center, args.start_width, end_width, int(args.seconds * args.fps), width, height, maxiter)
+    video.render(args.out, args.fps)
+
+
+if __name__ == '__main__':
+    main()
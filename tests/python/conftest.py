@@ -0,0 +1,22 @@
+'''
+the msurf modules import each other by their flat names (from MandelbrotFuncs import ...),
+like the scripts in src/python/msurf
+'''
+
+import os
+import pytest
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src', 'python', 'msurf'))
+
+
+@pytest.fixture(scope='session')
+def opencl_funcs():
+    '''
+    a MandelbrotFuncs on an OpenCL device, the tests using it are skipped without one
+    '''
+    from MandelbrotFuncs import MandelbrotFuncs
+    funcs = MandelbrotFuncs()
+    if funcs.cpu_backend is not None:
+        pytest.skip('no OpenCL device')
+    return funcs
@@ -0,0 +1,31 @@
+'''
+read_manifest parses bookmark strings as literals, and reports bad lines as ManifestError
+'''
+
+from MandelbrotParams import MandelbrotParams
+import pytest
+import render_batch
+
+
+def read(tmp_path, line):
+    manifest = tmp_path / 'views.txt'
+    manifest.write_text(line + '\n')
+    return render_batch.read_manifest(str(manifest))
+
+def test_bookmark(tmp_path):
+    bookmark = MandelbrotParams.from_bounds(-2.0, 1.0, -1.0, 1.0, 240, 160, 300).bookmark_string()
+    [(filename, params)] = read(tmp_path, f'view.png  240x160  {bookmark}')
+    assert filename == 'view.png'
+    assert (params.width, params.height, params.maxiter) == (240, 160, 300)
+    assert params.xmin == pytest.approx(-2.0) and params.ymax == pytest.approx(1.0)
+
+@pytest.mark.parametrize('bookmark', [
+    "{'xcenter': open('x'), 'ycenter': 0.0, 'step_size': 0.01, 'maxiter': 300}",  # not a literal
+    "{'xcenter': undefined}",
+    "{'xcenter': 0.0}",  # missing keys
+    "{'xcenter': 0.0, 'ycenter': 0.0, 'step_size': '0.01', 'maxiter': 300}",  # a string
+    "{'xcenter': 0.0",
+])
+def test_bad_bookmark(tmp_path, bookmark):
+    with pytest.raises(render_batch.ManifestError, match='views.txt:1'):
+        read(tmp_path, f'view.png  {bookmark}')
@@ -0,0 +1,69 @@
+'''
+the periodicity check must not take boundary pixels that escape for interior ones.
+near the Misiurewicz point c = i the orbits land next to a repelling 2-cycle and come
+back almost exactly before they blow up. at a step of 2**-63 a fixed 2**-56 tolerance
+is 256 pixels wide there
+'''
+
+import cpu_backend
+import fp_numpy
+from MandelbrotParams import MandelbrotParams
+import numpy as np
+
+
+STEP = 2.0 ** -63
+WIDTH, HEIGHT = 24, 16
+MAXITER = 500
+
+def deep_params():
+    cx, cy = 0.0, 1.0
+    return MandelbrotParams.from_bounds(cx - WIDTH * STEP / 2, cx + WIDTH * STEP / 2,
+                                        cy - HEIGHT * STEP / 2, cy + HEIGHT * STEP / 2, WIDTH, HEIGHT, MAXITER)
+
+def iterate(params, tolerance):
+    '''
+    counts of every pixel, kernel orientation, with this periodicity tolerance. 0 turns the check off
+    '''
+    ys, xs = np.indices((params.height, params.width)).reshape(2, -1)
+    c_real, c_imag = cpu_backend.pixel_c_fixed(params, xs, ys)
+    counts = np.zeros(len(xs), dtype=np.int32)
+    fp_numpy.iterate_active(counts, fp_numpy.zeros(len(xs)), fp_numpy.zeros(len(xs)), c_real, c_imag,
+                            params.maxiter, 4.0, tolerance)
+    return counts.reshape(params.height, params.width)
+
+def false_interior(counts, reference):
+    return (counts == fp_numpy.ITER_INTERIOR) & (reference < 0)
+
+def test_period_tolerance_below_pixel_size():
+    for step in (2.0 ** -20, 1e-12, 1e-16, STEP, 2.0 ** -70):
+        tolerance = fp_numpy.period_tolerance(step)
+        assert tolerance <= fp_numpy.PERIOD_TOLERANCE
+        assert tolerance < step or tolerance == 2.0 ** -fp_numpy.FP_SCALE_BITS
+
+def test_fixed_tolerance_fails_deep():
+    # the reason for period_tolerance: the old fixed tolerance paints escaping pixels black
+    params = deep_params()
+    reference = iterate(params, 0.0)
+    assert false_interior(iterate(params, fp_numpy.PERIOD_TOLERANCE), reference).any()
+
+def test_numpy_deep_zoom_no_false_interior():
+    params = deep_params()
+    assert cpu_backend.precision_for(params.step_size()) == 'tfm'
+    reference = iterate(params, 0.0)
+    counts = cpu_backend.render_counts(params)
+    assert (reference < 0).sum() > params.width * params.height // 2
+    assert not false_interior(counts, reference).any()
+    # apart from the pixels found periodic, the check changes nothing
+    found = counts == fp_numpy.ITER_INTERIOR
+    assert (counts[~found] == reference[~found]).all()
+
+def test_tfm_kernel_deep_zoom_no_false_interior(opencl_funcs):
+    params = deep_params()
+    assert opencl_funcs.select_kernel(params.step_size()) in ('tfm', 'perturb')
+    opencl_funcs.precision = 'tfm'
+    try:
+        counts = opencl_funcs.mandelbrot_set_opencl(params, output='counts')[::-1]  # kernel orientation
+    finally:
+        opencl_funcs.precision = None
+    assert not false_interior(counts, iterate(params, 0.0)).any()
+    assert (counts == cpu_backend.render_counts(params)).all()
@@ -0,0 +1,50 @@
+'''
+RenderCache.put() with an event: the state is read only after the event, by get()
+and by the writer thread
+'''
+
+from MandelbrotFuncs import MandelbrotFuncs
+from MandelbrotParams import MandelbrotParams
+import numpy as np
+from render_cache import RenderCache
+import render_cache
+import threading
+
+
+class Copy:
+    '''
+    stands in for the OpenCL copy event: fills state when waited for, after release()
+    '''
+    def __init__(self, state, value):
+        self.state = state
+        self.value = value
+        self.released = threading.Event()
+
+    def wait(self):
+        self.released.wait()
+        self.state[...] = self.value
+
+def test_put_before_filled(tmp_path):
+    cache = RenderCache(path=str(tmp_path))
+    view = ('view', 1)
+    state = np.zeros((7, 4, 4), dtype=np.uint32)
+    ready = Copy(state, 5)
+    cache.put(view, 100, state, ready)
+    assert cache.disk_maxiter(view) == 100
+    ready.released.set()
+    maxiter, cached = cache.get(view)
+    assert maxiter == 100 and (cached == 5).all()
+    cache.flush()
+    maxiter, loaded = RenderCache(path=str(tmp_path)).get(view)
+    assert maxiter == 100 and (loaded == 5).all()
+
+def test_frame_cached(tmp_path, monkeypatch, opencl_funcs):
+    monkeypatch.setenv(render_cache.CACHE_DIR_ENV, str(tmp_path))
+    funcs = MandelbrotFuncs(use_render_cache=True)
+    params = MandelbrotParams.from_bounds(-2.0, 1.0, -1.0, 1.0, 96, 64, 200)
+    funcs.mandelbrot_set_opencl(params)
+    funcs.render_cache.flush()
+    [(maxiter, state)] = funcs.render_cache.entries.values()
+    assert maxiter == 200
+    assert (state == funcs.read_iter_state()).all()
+    assert len(list(tmp_path.iterdir())) == 1
@@ -0,0 +1,40 @@
+'''
+msurf-render --subdivide routes every view through MandelbrotFuncs.mandelbrot_set_subdivided
+'''
+
+from MandelbrotFuncs import MandelbrotFuncs
+import numpy as np
+from PIL import Image
+import pytest
+import render_batch
+
+
+VIEW = 'view.png  240x160  -2.0 1.0 -1.0 1.0 300'
+
+def render(tmp_path, monkeypatch, *flags):
+    calls = []
+    subdivided = MandelbrotFuncs.mandelbrot_set_subdivided
+    def spy(self, params, *args, **kwargs):
+        calls.append(params)
+        return subdivided(self, params, *args, **kwargs)
+    monkeypatch.setattr(MandelbrotFuncs, 'mandelbrot_set_subdivided', spy)
+    manifest = tmp_path / 'views.txt'
+    manifest.write_text(VIEW + '\n')
+    out_dir = tmp_path / ('out' + '_'.join(flags))
+    assert render_batch.main([str(manifest), '--out-dir', str(out_dir), *flags]) == 0
+    return np.asarray(Image.open(out_dir / 'view.png')), calls
+
+def test_subdivide_flag(tmp_path, monkeypatch):
+    image, calls = render(tmp_path, monkeypatch, '--subdivide')
+    assert len(calls) == 1
+    reference, calls = render(tmp_path, monkeypatch)
+    assert not calls
+    # filling is a heuristic, it may only miss a few pixels of detail
+    assert (image != reference).any(axis=2).mean() < 0.01
+
+def test_subdivide_with_cpu_workers_is_an_error(tmp_path):
+    manifest = tmp_path / 'views.txt'
+    manifest.write_text(VIEW + '\n')
+    with pytest.raises(SystemExit) as e:
+        render_batch.main([str(manifest), '--subdivide', '--cpu-workers', '2'])
+    assert e.value.code == 2